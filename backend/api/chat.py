@@ -0,0 +1,143 @@
+import json
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from backend.config import settings
+from backend.core.answer_cache import (
+    chunk_ids,
+    find_answer,
+    question_vector,
+    store_answer
+)
+from backend.core.logging import get_logger
+from backend.core.ollama_scheduler import chat_chunks
+
+logger = get_logger()
+
+SYSTEM_MESSAGE_CONTEXT = (
+    "You are a document Q&A assistant. Only answer questions based on "
+    "the provided context. If the answer cannot be found in the context, "
+    "say so."
+)
+SYSTEM_MESSAGE = "You are Q&A assistant"
+
+NO_CONTEXT_ANSWER = (
+    "I couldn't find relevant information in the uploaded document "
+    "to answer your question."
+)
+
+
+def create_prompt_with_context(question, context):
+    return f"""Please answer the question based ONLY on the provided context. If the context doesn't contain the information needed to answer the question, please respond with "I cannot answer this question based on the provided context."
+
+Context: {context}
+
+Question: {question}
+
+Answer: """
+
+
+def create_prompt_without_context(question):
+    return f"""Please answer the following question"
+
+Question: {question}
+
+Answer: """
+
+
+def build_messages(request, references):
+    """Messages for the model, earlier messages of the chat included"""
+    history = [
+        {"role": message.role, "content": message.content}
+        for message in request.history
+    ]
+    question = "\n".join(
+        [message["content"] for message in history] + [request.prompt])
+
+    if request.context_aware:
+        context = "\n\n".join(
+            result.page_content or "" for result in references)
+        system = SYSTEM_MESSAGE_CONTEXT
+        prompt = create_prompt_with_context(question, context)
+    else:
+        system = SYSTEM_MESSAGE
+        prompt = create_prompt_without_context(question)
+
+    return [
+        {"role": "system", "content": system},
+        *history,
+        {"role": "user", "content": prompt}
+    ]
+
+
+def sse_event(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+
+async def stream_chat(request, references):
+    """
+    Server-sent events of a chat: the references used as context, the
+    answer as it is generated and a closing done event with stats.
+    A disconnecting client cancels the generation. Answers of context
+    aware chats without history are cached and replayed for similar
+    questions citing the same chunks.
+    """
+    yield sse_event({
+        "documents": [
+            result.model_dump(exclude_unset=True) for result in references
+        ]
+    }, "references")
+
+    if request.context_aware and not references:
+        yield sse_event({"content": NO_CONTEXT_ANSWER})
+        yield sse_event({"model": request.model}, "done")
+        return
+
+    started = time.perf_counter()
+    cache_key = None
+    if settings.ANSWER_CACHE and request.context_aware and not request.history:
+        try:
+            ids = chunk_ids(references)
+            vector = await run_in_threadpool(question_vector, request.prompt)
+            cache_key = (request.model, ids, vector)
+        except Exception as e:
+            logger.warning(f"Answer cache unavailable: {str(e)}")
+    if cache_key:
+        cached = find_answer(*cache_key)
+        if cached:
+            for content in cached.chunks:
+                yield sse_event({"content": content})
+            yield sse_event({
+                **cached.stats,
+                "cached": True,
+                "duration": round(time.perf_counter() - started, 3)
+            }, "done")
+            return
+
+    stats = {"model": request.model}
+    chunks = []
+    try:
+        async for chunk in chat_chunks(
+                request.model, build_messages(request, references)):
+            if chunk.message.content:
+                chunks.append(chunk.message.content)
+                yield sse_event({"content": chunk.message.content})
+            if chunk.done:
+                stats["eval_count"] = chunk.eval_count
+                stats["prompt_eval_count"] = chunk.prompt_eval_count
+    except Exception as e:
+        logger.error(f"Error generating chat answer: {str(e)}")
+        yield sse_event({"error": str(e)}, "error")
+        return
+
+    stats["duration"] = round(time.perf_counter() - started, 3)
+    logger.info(
+        f"Chat answer of {request.model}: {stats.get('eval_count')} tokens "
+        f"in {stats['duration']}s")
+    if cache_key:
+        store_answer(*cache_key, chunks, stats)
+    yield sse_event(stats, "done")
@@ -1,17 +1,25 @@
 # backend/auth/dependencies.py
-from typing import Optional
-
-from fastapi import Depends, Request
-from fastapi_users import BaseUserManager, FastAPIUsers, IntegerIDMixin
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request, status
+from fastapi_users import (
+    BaseUserManager,
+    FastAPIUsers,
+    IntegerIDMixin,
+    exceptions,
+)
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
 from fastapi_users.db import SQLAlchemyUserDatabase
+from sqlalchemy.orm import make_transient_to_detached
 
 
 from backend.api.models import User
+from backend.api.service import run_crypto
 from backend.config import settings
 from backend.database import get_async_session
 
@@ -41,6 +49,29 @@ auth_backend = AuthenticationBackend(
     get_strategy=get_jwt_strategy,
 )
 
+# Users by id (the token subject), detached from any session
+user_cache = TTLCache(
+    maxsize=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL_SECONDS
+)
+
+
+def detached_copy(user):
+    copy = User(**{
+        column.key: getattr(user, column.key)
+        for column in User.__table__.columns
+    })
+    make_transient_to_detached(copy)
+    return copy
+
+
+# Failed login attempts by email, forgotten after the lockout period
+login_attempts = TTLCache(
+    maxsize=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.LOGIN_LOCKOUT_SECONDS
+)
+
+
 # User manager
 
 
@@ -48,6 +79,112 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     reset_password_token_secret = settings.SECRET_KEY
     verification_token_secret = settings.SECRET_KEY
 
+    async def get(self, id: int) -> User:
+        """Resolve the user of a token, from the cache when possible"""
+        cached = user_cache.get(id)
+        if cached is not None:
+            # Attach a copy to the request's session without a query
+            return await self.user_db.session.merge(cached, load=False)
+
+        user = await super().get(id)
+        user_cache[id] = detached_copy(user)
+        return user
+
+    async def authenticate(self, credentials) -> Optional[User]:
+        """
+        Same as fastapi-users, with hashing in the crypto pool and a
+        limit on failed attempts per account
+        """
+        key = credentials.username.lower()
+        attempts = login_attempts.get(key, 0)
+        if attempts >= settings.LOGIN_MAX_ATTEMPTS:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many failed login attempts, try again later",
+                headers={"Retry-After": str(settings.LOGIN_LOCKOUT_SECONDS)}
+            )
+        # Counted before hashing, so parallel guesses are limited too
+        login_attempts[key] = attempts + 1
+
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Run the hasher anyway to mitigate timing attacks
+            await run_crypto(self.password_helper.hash, credentials.password)
+            return None
+
+        verified, updated_password_hash = await run_crypto(
+            self.password_helper.verify_and_update,
+            credentials.password,
+            user.hashed_password
+        )
+        if not verified:
+            return None
+
+        login_attempts.pop(key, None)
+        # Update password hash to a more robust one if needed
+        if updated_password_hash is not None:
+            await self.user_db.update(
+                user, {"hashed_password": updated_password_hash})
+        return user
+
+    async def create(
+        self,
+        user_create,
+        safe: bool = False,
+        request: Optional[Request] = None
+    ) -> User:
+        """Same as fastapi-users, with the password hashed in the crypto pool"""
+        await self.validate_password(user_create.password, user_create)
+
+        existing_user = await self.user_db.get_by_email(user_create.email)
+        if existing_user is not None:
+            raise exceptions.UserAlreadyExists()
+
+        user_dict = (
+            user_create.create_update_dict()
+            if safe
+            else user_create.create_update_dict_superuser()
+        )
+        password = user_dict.pop("password")
+        user_dict["hashed_password"] = await run_crypto(
+            self.password_helper.hash, password)
+
+        created_user = await self.user_db.create(user_dict)
+        await self.on_after_register(created_user, request)
+        return created_user
+
+    async def _update(self, user: User, update_dict: Dict[str, Any]) -> User:
+        password = update_dict.pop("password", None)
+        if password is not None:
+            await self.validate_password(password, user)
+            update_dict["hashed_password"] = await run_crypto(
+                self.password_helper.hash, password)
+        return await super()._update(user, update_dict)
+
+    async def on_after_update(
+        self,
+        user: User,
+        update_dict: Dict[str, Any],
+        request: Optional[Request] = None
+    ):
+        user_cache.pop(user.id, None)
+
+    async def on_after_verify(
+        self, user: User, request: Optional[Request] = None
+    ):
+        user_cache.pop(user.id, None)
+
+    async def on_after_reset_password(
+        self, user: User, request: Optional[Request] = None
+    ):
+        user_cache.pop(user.id, None)
+
+    async def on_after_delete(
+        self, user: User, request: Optional[Request] = None
+    ):
+        user_cache.pop(user.id, None)
+
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         print(f"User {user.id} has registered.")
 
@@ -1,10 +1,24 @@
 # backend/auth/models.py
 from fastapi_users.db import SQLAlchemyBaseUserTable
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    Boolean,
+    DateTime,
+    ForeignKey,
+    JSON,
+    LargeBinary,
+    Text,
+    Index,
+    UniqueConstraint
+)
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 
 from backend.database import Base
+from datetime import datetime
 import enum
 
 
@@ -26,6 +40,11 @@ class User(SQLAlchemyBaseUserTable[int], Base):
 
 class FileUpload(Base):
     __tablename__ = "file_uploads"
+    __table_args__ = (
+        Index("ix_file_uploads_user_content_hash", "user_id", "content_hash"),
+        # Listing of the latest files of a user
+        Index("ix_file_uploads_user_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
@@ -34,30 +53,56 @@ class FileUpload(Base):
     file_url = Column(String)
     status = Column(String)
     content_type = Column(String)
+    # sha256 of the uploaded bytes
+    content_hash = Column(String)
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, onupdate=func.now())
+    # Set on insert as well, lists are paged by (updated_at, id)
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    content_id = Column(
+        Integer, ForeignKey("shared_contents.id"), index=True)
+    import_job_id = Column(
+        Integer, ForeignKey("import_jobs.id"), index=True)
 
     owner = relationship("User", back_populates="files")
 
 
 class Link(Base):
     __tablename__ = "links"
+    __table_args__ = (
+        # Same page is stored only once per user
+        Index(
+            "ix_links_user_normalized_url",
+            "user_id",
+            "normalized_url",
+            unique=True
+        ),
+        Index("ix_links_user_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, index=True)
+    normalized_url = Column(String)
     title = Column(String)
     favicon = Column(String)
     status = Column(String)
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, onupdate=func.now())
+    # Set on insert as well, lists are paged by (updated_at, id)
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    content_id = Column(
+        Integer, ForeignKey("shared_contents.id"), index=True)
 
     owner = relationship("User", back_populates="links")
 
 
 class Note(Base):
     __tablename__ = "notes"
+    __table_args__ = (
+        Index("ix_notes_user_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, index=True)
@@ -66,12 +111,177 @@ class Note(Base):
     file_path = Column(String)
     status = Column(String)
     created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, onupdate=func.now())
+    # Set on insert as well, lists are paged by (updated_at, id)
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    import_job_id = Column(
+        Integer, ForeignKey("import_jobs.id"), index=True)
 
     owner = relationship("User", back_populates="notes")
 
 
+class SharedContent(Base):
+    """
+    Content addressed set of chunks in the vector store, shared
+    by all links and files of any user having the same content.
+    """
+    __tablename__ = "shared_contents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, unique=True, index=True, nullable=False)
+    source_type = Column(String)
+    # Source and title stored with the chunks
+    source = Column(String)
+    title = Column(String)
+    # Number of links and files referring to the content
+    ref_count = Column(Integer, default=0, nullable=False)
+    status = Column(String)
+    # process working on the row and until when, see worker/dispatch.py
+    claimed_by = Column(String)
+    claimed_until = Column(DateTime)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+
+
+class UploadSession(Base):
+    """Chunked upload which is still being received"""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True)
+    filename = Column(String)
+    content_type = Column(String)
+    total_size = Column(BigInteger, nullable=False)
+    # Bytes stored so far, i.e. offset of the next part
+    received_size = Column(BigInteger, default=0, nullable=False)
+    part_path = Column(String)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+
+class DeadLetterJob(Base):
+    __tablename__ = "dead_letter_jobs"
+    __table_args__ = (
+        UniqueConstraint("job_type", "resource_id",
+                         name="uq_dead_letter_job_resource"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    # one of SourceType values: link, file or note
+    job_type = Column(String, index=True)
+    resource_id = Column(Integer)
+    # everything needed to put the job back on its queue
+    payload = Column(JSON)
+    attempts = Column(Integer, default=0)
+    error_kind = Column(String)
+    last_error = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+
+class CrawlJob(Base):
+    __tablename__ = "crawl_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # normalised start url of the crawl
+    root_url = Column(String, index=True)
+    status = Column(String)
+    options = Column(JSON)
+    headers = Column(JSON)
+    # checkpointed crawl state, only loaded when resuming a crawl
+    # frontier: list of [url, depth] which are yet to be stored
+    # visited: packed 64 bit hashes of all discovered urls
+    frontier = deferred(Column(JSON))
+    visited = deferred(Column(LargeBinary))
+    pages_crawled = Column(Integer, default=0)
+    pages_failed = Column(Integer, default=0)
+    urls_visited = Column(Integer, default=0)
+    urls_pending = Column(Integer, default=0)
+    # process working on the row and until when, see worker/dispatch.py
+    claimed_by = Column(String)
+    claimed_until = Column(DateTime)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+
+class ImportJob(Base):
+    """Files and notes imported together from an archive"""
+    __tablename__ = "import_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # name of the uploaded archive
+    filename = Column(String)
+    status = Column(String)
+    files_added = Column(Integer, default=0)
+    notes_added = Column(Integer, default=0)
+    # entries with the same content as an existing file of the user
+    duplicates = Column(Integer, default=0)
+    # directories, hidden and unsupported entries
+    skipped = Column(Integer, default=0)
+    error = Column(Text)
+    # process working on the row and until when, see worker/dispatch.py
+    claimed_by = Column(String)
+    claimed_until = Column(DateTime)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+
+class SitemapEntry(Base):
+    __tablename__ = "sitemap_entries"
+    __table_args__ = (
+        UniqueConstraint("user_id", "url", name="uq_sitemap_entry_user_url"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    # normalised url of the page listed in a sitemap
+    url = Column(String)
+    lastmod = Column(DateTime, nullable=True)
+    link_id = Column(Integer, ForeignKey("links.id", ondelete="SET NULL"))
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, onupdate=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+
+class ResourceCount(Base):
+    """
+    Number of links, files or notes of a user, adjusted along with
+    every insert and delete so lists don't have to count their rows
+    """
+    __tablename__ = "resource_counts"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "resource", name="uq_resource_count_user_resource"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    # one of SourceType values: link, file or note
+    resource = Column(String)
+    count = Column(Integer, default=0)
+
+
+class QueuedJob(Base):
+    """Link, file or note job waiting to be claimed by a worker process"""
+    __tablename__ = "queued_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # one of SourceType values: link, file or note
+    job_type = Column(String)
+    # queue item of the job
+    payload = Column(JSON)
+    # jobs are claimed once due, later for retries with backoff
+    available_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # lease of the claiming process, the row is removed once the job
+    # is done and claimed again by anyone after the lease ran out
+    claimed_by = Column(String)
+    claimed_until = Column(DateTime)
+    created_at = Column(DateTime, server_default=func.now())
+
+
 class ProcessingStatus(str, enum.Enum):
     PENDING = "pending"
     IN_PROGRESS = "in_progress"
@@ -83,3 +293,16 @@ class SourceType(str, enum.Enum):
     FILE = "file"
     LINK = "link"
     NOTE = "note"
+
+
+class ErrorKind(str, enum.Enum):
+    TRANSIENT = "transient"
+    PERMANENT = "permanent"
+
+
+class CrawlStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    PAUSED = "paused"
+    FINISHED = "finished"
+    FAILED = "failed"
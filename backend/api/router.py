@@ -5,10 +5,13 @@ from fastapi import (
     HTTPException,
     UploadFile,
     File,
+    Request,
     status
 )
-from fastapi.responses import FileResponse
-from sqlalchemy import select, desc, func, delete
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import select, desc, func, delete, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.api.dependencies import (
@@ -17,19 +20,61 @@ from backend.api.dependencies import (
     fastapi_users,
 )
 
-from backend.core.utils import save_file, update_file_with_backup
+from backend.core.utils import (
+    save_file,
+    update_file_with_backup,
+    normalize_url,
+    save_upload_file,
+    write_file_part,
+    UploadTooLarge,
+    iter_lines
+)
 
-from backend.worker.url_processor import url_processing_queue
-from backend.worker.url_processor_recursive import recursive_url_processing_queue
+from backend.worker.url_processor import (
+    url_processing_queue,
+    upsert_links,
+    LinkAction
+)
+from backend.worker.url_processor_recursive import (
+    recursive_url_processing_queue,
+    running_crawlers,
+    crawl_progress
+)
 from backend.worker.process_uploaded_file import file_processor_queue
+from backend.worker.sitemap import import_sitemap
+from backend.worker.archive_import import (
+    archive_import_queue,
+    archive_path_for,
+    is_supported_archive,
+    import_progress
+)
+from backend.worker.shared_content import (
+    load_shared_access,
+    release_content,
+    hash_file
+)
+from backend.worker.resource_counts import adjust_count, get_count
+from backend.worker.dispatch import (
+    dispatch_job,
+    dispatch_jobs,
+    lease,
+    take_lease
+)
 from backend.vector_store.adapter import vector_db
+from backend.vector_store.models import DOCUMENT_COLUMNS
 
 from backend.api.models import (
     User,
     FileUpload,
     ProcessingStatus,
     Link,
-    Note
+    Note,
+    DeadLetterJob,
+    SourceType,
+    CrawlJob,
+    CrawlStatus,
+    UploadSession,
+    ImportJob
 )
 from backend.api.schemas import (
     TokenPayload,
@@ -37,18 +82,31 @@ from backend.api.schemas import (
     UserRead,
     UserUpdate,
     FileUploadResponse,
+    UploadSessionCreate,
+    UploadSessionResponse,
+    UploadFinalizeRequest,
+    ImportJobResponse,
+    ImportJobList,
     LinkCreate,
     LinkResponse,
     BulkLinkCreate,
     BulkLinkResponse,
     LinkCrawl,
     LinkCrawlResponse,
+    CrawlJobResponse,
+    CrawlJobList,
+    SitemapImport,
+    SitemapImportResponse,
     DocumentSearchResponse,
     DocumentSearchRequest,
+    DocumentSearchBatchRequest,
+    DocumentSearchBatchResponse,
+    ChatRequest,
     DocumentResult,
     DocumentMetadata,
     NoteCreateRequest,
     NoteCreateResponse,
+    NoteBulkResult,
     NoteList,
     NoteResponse,
     NoteUpdateRequest,
@@ -56,16 +114,26 @@ from backend.api.schemas import (
     LinksList,
     FilesList,
     FilePollingResponse,
-    ResourceDeletedResponse
+    ResourceDeletedResponse,
+    DeadLetterJobResponse,
+    DeadLetterJobList,
+    DeadLetterRetryRequest,
+    DeadLetterRetryResponse
 )
 from backend.api.service import validate_jwt_token
-from backend.database import get_async_session
+from backend.api.chat import stream_chat
+from backend.database import get_async_session, async_session_maker
 from backend.core.logging import get_logger
+from backend.core.responses import FastJSONResponse
 
 from backend.config import settings
+import asyncio
+import base64
+import json
 import os
+import re
 import uuid
-import shutil
+from datetime import datetime, timedelta
 from pathlib import Path
 
 
@@ -97,6 +165,8 @@ router.include_router(
 file_router = APIRouter(tags=["files"])
 link_router = APIRouter(tags=["links"])
 document_router = APIRouter(tags=["documents"])
+job_router = APIRouter(tags=["jobs"])
+chat_router = APIRouter(tags=["chat"])
 
 # Custom token validation endpoint
 
@@ -104,7 +174,7 @@ document_router = APIRouter(tags=["documents"])
 @router.post("/validate-token", tags=["auth"])
 async def validate_token(payload: TokenPayload):
     """Validate a JWT token and return user info if valid"""
-    return validate_jwt_token(payload.token)
+    return await validate_jwt_token(payload.token)
 
 
 # Custom endpoint to get user by username
@@ -137,24 +207,85 @@ async def upload_file(
     # Create the file path
     file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
 
-    # Save the file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save the file, hashing it on the way
+    content_hash = await save_upload_file(file, file_path)
+
+    return await register_uploaded_file(
+        session,
+        user,
+        file.filename,
+        file.content_type,
+        unique_filename,
+        file_path,
+        content_hash
+    )
 
-    if file.filename.endswith('.md'):
+
+async def register_uploaded_file(
+        session,
+        user,
+        original_filename,
+        content_type,
+        unique_filename,
+        file_path,
+        content_hash):
+    """Create the file or note entry of a stored upload and queue it"""
+    if not original_filename.endswith('.md'):
+        # Same bytes uploaded before by the user, reuse the stored
+        # file along with its chunks instead of processing it again
+        result = await session.execute(
+            select(FileUpload)
+            .where(
+                FileUpload.user_id == user.id,
+                FileUpload.content_hash == content_hash
+            )
+            .order_by(FileUpload.id)
+        )
+        existing_file = result.scalars().first()
+        if existing_file:
+            await asyncio.to_thread(os.remove, file_path)
+            if existing_file.status == ProcessingStatus.FAILED:
+                existing_file.status = ProcessingStatus.PENDING
+                await session.commit()
+                await session.refresh(existing_file)
+                await dispatch_job(
+                    file_processor_queue,
+                    SourceType.FILE,
+                    (
+                        existing_file.file_path,
+                        existing_file.filename,
+                        existing_file.file_url,
+                        existing_file.id,
+                        user.email,
+                        "file",
+                        1
+                    )
+                )
+            logger.info(
+                f"Upload {original_filename} is a duplicate of {existing_file.filename}")
+            return {
+                "filename": existing_file.filename,
+                "file_url": existing_file.file_url,
+                "status": existing_file.status,
+                "created_at": existing_file.created_at,
+                "updated_at": existing_file.updated_at
+            }
+
+    if original_filename.endswith('.md'):
         source_type = "note"
 
         file_url = f"/file/note/{unique_filename}"
 
         db_note = Note(
             url=file_url,
-            title=file.filename,
+            title=original_filename,
             filename=unique_filename,
             file_path=str(file_path),
             status=ProcessingStatus.PENDING,
             user_id=user.id
         )
         session.add(db_note)
+        await adjust_count(session, user.id, SourceType.NOTE, 1)
         await session.commit()
         await session.refresh(db_note)
 
@@ -169,28 +300,33 @@ async def upload_file(
         # Create a database entry
         db_file = FileUpload(
             filename=unique_filename,
-            original_filename=file.filename,
+            original_filename=original_filename,
             file_path=str(file_path),
             file_url=file_url,
             status=ProcessingStatus.PENDING,
-            content_type=file.content_type,
+            content_type=content_type,
+            content_hash=content_hash,
             user_id=user.id
         )
         session.add(db_file)
+        await adjust_count(session, user.id, SourceType.FILE, 1)
         await session.commit()
         await session.refresh(db_file)
 
         file_id = db_file.id
         created_at = db_file.created_at
 
-    await file_processor_queue.put(
+    await dispatch_job(
+        file_processor_queue,
+        source_type,
         (
             file_path,
             unique_filename,
             file_url,
             file_id,
             user.email,
-            source_type
+            source_type,
+            1
         )
     )
     # Return the file URL to the client
@@ -202,18 +338,269 @@ async def upload_file(
     }
 
 
-# Files List endpoint
-@file_router.get("/", response_model=FilesList, status_code=200)
-async def list_uploaded_files(
+def upload_session_response(upload):
+    return UploadSessionResponse(
+        upload_id=upload.id,
+        filename=upload.filename,
+        size=upload.total_size,
+        offset=upload.received_size,
+        chunk_size=settings.UPLOAD_CHUNK_SIZE
+    )
+
+
+async def get_user_upload_session(session, upload_id, user):
+    result = await session.execute(
+        select(UploadSession).where(
+            UploadSession.id == upload_id,
+            UploadSession.user_id == user.id
+        )
+    )
+    upload = result.scalars().first()
+    if not upload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found"
+        )
+    return upload
+
+
+async def remove_upload_session(session, upload):
+    await session.execute(
+        delete(UploadSession).where(UploadSession.id == upload.id)
+    )
+    await session.commit()
+    if os.path.exists(upload.part_path):
+        await asyncio.to_thread(os.remove, upload.part_path)
+
+
+async def remove_expired_upload_sessions(session):
+    expiry = datetime.utcnow() - timedelta(
+        hours=settings.UPLOAD_SESSION_TTL_HOURS)
+    result = await session.execute(
+        select(UploadSession).where(
+            func.coalesce(UploadSession.updated_at,
+                          UploadSession.created_at) < expiry
+        )
+    )
+    for upload in result.scalars().all():
+        logger.info(f"Removing expired upload {upload.id}")
+        await remove_upload_session(session, upload)
+
+
+# Start a chunked upload
+@file_router.post(
+    "/upload/init",
+    response_model=UploadSessionResponse,
+    status_code=201)
+async def init_chunked_upload(
+    data: UploadSessionCreate,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    await remove_expired_upload_sessions(session)
+
+    upload_id = uuid.uuid4().hex
+    part_path = os.path.join(settings.UPLOAD_PARTS_DIR, upload_id)
+    await asyncio.to_thread(Path(part_path).touch)
+
+    upload = UploadSession(
+        id=upload_id,
+        filename=os.path.basename(data.filename),
+        content_type=data.content_type,
+        total_size=data.size,
+        received_size=0,
+        part_path=part_path,
+        user_id=user.id
+    )
+    session.add(upload)
+    await session.commit()
+
+    return upload_session_response(upload)
+
+
+# State of a chunked upload, used to find the offset to resume from
+@file_router.get(
+    "/upload/{upload_id}",
+    response_model=UploadSessionResponse,
+    status_code=200)
+async def get_chunked_upload(
+    upload_id: str,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    upload = await get_user_upload_session(session, upload_id, user)
+    return upload_session_response(upload)
+
+
+# Upload a part of the file, the body is streamed straight to disk
+@file_router.put(
+    "/upload/{upload_id}",
+    response_model=UploadSessionResponse,
+    status_code=200)
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    upload = await get_user_upload_session(session, upload_id, user)
+
+    # Parts can be sent again, but must not leave a gap
+    if offset < 0 or offset > upload.received_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Expected offset {upload.received_size}"
+        )
+
+    try:
+        written = await write_file_part(
+            request.stream(), upload.part_path, offset, upload.total_size)
+    except UploadTooLarge as err:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(err)
+        )
+
+    upload.received_size = offset + written
+    await session.commit()
+    await session.refresh(upload)
+
+    return upload_session_response(upload)
+
+
+# Verify the uploaded file and queue it for processing
+@file_router.post(
+    "/upload/{upload_id}/finalize",
+    response_model=FileUploadResponse,
+    status_code=202)
+async def finalize_chunked_upload(
+    upload_id: str,
+    data: UploadFinalizeRequest,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    upload = await get_user_upload_session(session, upload_id, user)
+
+    if upload.received_size != upload.total_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Received {upload.received_size} of {upload.total_size} bytes"
+        )
+
+    content_hash = await asyncio.to_thread(hash_file, upload.part_path)
+    if content_hash != data.checksum.lower():
+        # Start over, the stored parts can't be trusted
+        await remove_upload_session(session, upload)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Checksum mismatch"
+        )
+
+    unique_filename = f"{uuid.uuid4()}-{upload.filename}"
+    file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
+    await asyncio.to_thread(os.replace, upload.part_path, file_path)
+
+    await session.execute(
+        delete(UploadSession).where(UploadSession.id == upload.id)
+    )
+    await session.commit()
+
+    return await register_uploaded_file(
+        session,
+        user,
+        upload.filename,
+        upload.content_type,
+        unique_filename,
+        file_path,
+        content_hash
+    )
+
+
+# Abort a chunked upload
+@file_router.delete(
+    "/upload/{upload_id}",
+    response_model=ResourceDeletedResponse,
+    status_code=200)
+async def abort_chunked_upload(
+    upload_id: str,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    upload = await get_user_upload_session(session, upload_id, user)
+    await remove_upload_session(session, upload)
+    return ResourceDeletedResponse(status="deleted")
+
+
+async def import_job_response(session, job):
+    return ImportJobResponse(
+        id=job.id,
+        filename=job.filename,
+        status=job.status,
+        files_added=job.files_added,
+        notes_added=job.notes_added,
+        duplicates=job.duplicates,
+        skipped=job.skipped,
+        error=job.error,
+        progress=await import_progress(session, job.id),
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
+
+
+# Import files and notes from a zip or tar archive
+@file_router.post("/import", response_model=ImportJobResponse, status_code=202)
+async def import_files_from_archive(
+    file: UploadFile = File(...),
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    job = ImportJob(
+        filename=file.filename,
+        status=ProcessingStatus.PENDING,
+        user_id=user.id,
+        **lease()
+    )
+    session.add(job)
+    await session.commit()
+
+    archive_path = archive_path_for(job.id)
+    try:
+        await save_upload_file(file, archive_path)
+    except Exception:
+        # Nothing would ever pick up the job or its partial archive
+        if await asyncio.to_thread(os.path.exists, archive_path):
+            await asyncio.to_thread(os.remove, archive_path)
+        await session.delete(job)
+        await session.commit()
+        raise
+
+    if not await asyncio.to_thread(is_supported_archive, archive_path):
+        await asyncio.to_thread(os.remove, archive_path)
+        await session.delete(job)
+        await session.commit()
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Only zip and tar archives can be imported"
+        )
+
+    await archive_import_queue.put(job.id)
+    await session.refresh(job)
+
+    return await import_job_response(session, job)
+
+
+@file_router.get("/import", response_model=ImportJobList, status_code=200)
+async def list_archive_imports(
     skip: int = 0,
     limit: int = 100,
     user: User = Depends(current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
     stmt = (
-        select(FileUpload)
-        .where(FileUpload.user_id == user.id)
-        .order_by(desc(FileUpload.updated_at))
+        select(ImportJob)
+        .where(ImportJob.user_id == user.id)
+        .order_by(desc(ImportJob.id))
         .offset(skip)
         .limit(limit)
     )
@@ -223,13 +610,106 @@ async def list_uploaded_files(
 
     count_stmt = (
         select(func.count())
-        .select_from(FileUpload)
-        .where(FileUpload.user_id == user.id)
+        .select_from(ImportJob)
+        .where(ImportJob.user_id == user.id)
     )
 
     total_count = await session.execute(count_stmt)
     total_count = total_count.scalar() or 0
 
+    return ImportJobList(
+        jobs=[await import_job_response(session, record) for record in records],
+        total=total_count
+    )
+
+
+@file_router.get(
+    "/import/{job_id}",
+    response_model=ImportJobResponse,
+    status_code=200)
+async def get_archive_import(
+    job_id: int,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    result = await session.execute(
+        select(ImportJob).where(
+            ImportJob.id == job_id,
+            ImportJob.user_id == user.id
+        )
+    )
+    job = result.scalars().first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import not found"
+        )
+    return await import_job_response(session, job)
+
+
+def encode_cursor(record):
+    value = f"{record.updated_at.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        updated_at, record_id = value.split("|")
+        return datetime.fromisoformat(updated_at), int(record_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Invalid cursor"
+        )
+
+
+def paginate(stmt, model, skip, limit, cursor):
+    """
+    Latest records first. With a cursor the page starts right after
+    the record it points to, so deep pages cost the same as the first
+    one, otherwise skip is used as offset.
+    """
+    stmt = stmt.order_by(desc(model.updated_at), desc(model.id)).limit(limit)
+    if cursor:
+        return stmt.where(
+            tuple_(model.updated_at, model.id) < decode_cursor(cursor))
+    return stmt.offset(skip)
+
+
+def next_cursor(records, limit):
+    if records and len(records) == limit:
+        return encode_cursor(records[-1])
+    return None
+
+
+# Files List endpoint
+@file_router.get(
+    "/",
+    response_model=FilesList,
+    status_code=200,
+    response_class=FastJSONResponse
+)
+async def list_uploaded_files(
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str = None,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    stmt = paginate(
+        select(FileUpload).where(FileUpload.user_id == user.id),
+        FileUpload,
+        skip,
+        limit,
+        cursor
+    )
+
+    result = await session.execute(stmt)
+    records = result.scalars().all()
+
+    total_count = await get_count(session, user.id, SourceType.FILE)
+
     result = [
         FileUploadResponse(
             file_url=record.file_url,
@@ -242,7 +722,8 @@ async def list_uploaded_files(
     # Return the file URL to the client
     return FilesList(
         files=result,
-        total=total_count
+        total=total_count,
+        next_cursor=next_cursor(records, limit)
     )
 
 
@@ -253,7 +734,8 @@ async def create_note(
     user: User = Depends(current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    doc_id, file_path, filename, saved = save_file(note.content, note.title)
+    doc_id, file_path, filename, saved = await asyncio.to_thread(
+        save_file, note.content, note.title)
 
     if not saved:
         raise HTTPException(
@@ -274,11 +756,14 @@ async def create_note(
     )
 
     session.add(db_note)
+    await adjust_count(session, user.id, SourceType.NOTE, 1)
     await session.commit()
     await session.refresh(db_note)
 
-    await file_processor_queue.put(
-        (file_path, filename, file_url, db_note.id, user.email, "note")
+    await dispatch_job(
+        file_processor_queue,
+        SourceType.NOTE,
+        (file_path, filename, file_url, db_note.id, user.email, "note", 1)
     )
     # Return the file URL to the client
     return NoteCreateResponse(
@@ -289,33 +774,154 @@ async def create_note(
     )
 
 
+def save_note_files(notes):
+    return [save_file(note.content, note.title) for note in notes]
+
+
+async def store_note_batch(user, batch):
+    """
+    Write the files of a batch of (line, note) and create their rows
+    in a single transaction. Returns the results of the batch.
+    """
+    saved_files = await asyncio.to_thread(
+        save_note_files, [note for _, note in batch])
+
+    results = []
+    rows = []
+    for (line, note), (_, file_path, filename, saved) in zip(batch, saved_files):
+        if not saved:
+            results.append(NoteBulkResult(
+                line=line,
+                title=note.title,
+                status=ProcessingStatus.FAILED,
+                error="Error creating file"
+            ))
+            continue
+        db_note = Note(
+            url=f"/file/note/{filename}",
+            title=note.title,
+            filename=filename,
+            file_path=str(file_path),
+            status=ProcessingStatus.PENDING,
+            user_id=user.id
+        )
+        rows.append((line, db_note))
+
+    async with async_session_maker() as session:
+        session.add_all([db_note for _, db_note in rows])
+        await adjust_count(session, user.id, SourceType.NOTE, len(rows))
+        await session.commit()
+
+    await dispatch_jobs(
+        file_processor_queue,
+        SourceType.NOTE,
+        [
+            (db_note.file_path, db_note.filename, db_note.url,
+             db_note.id, user.email, "note", 1)
+            for _, db_note in rows
+        ]
+    )
+    for line, db_note in rows:
+        results.append(NoteBulkResult(
+            line=line,
+            id=db_note.id,
+            url=db_note.url,
+            title=db_note.title,
+            status=db_note.status
+        ))
+
+    results.sort(key=lambda result: result.line)
+    return results
+
+
+async def create_notes_from_ndjson(request, user):
+    batch = []
+    line = 0
+    try:
+        async for raw_line in iter_lines(
+                request.stream(), settings.NOTE_BULK_MAX_LINE_SIZE):
+            line += 1
+            if not raw_line.strip():
+                continue
+            try:
+                note = NoteCreateRequest.model_validate_json(raw_line)
+            except ValidationError as err:
+                error = "; ".join(e["msg"] for e in err.errors())
+                yield NoteBulkResult(
+                    line=line,
+                    status=ProcessingStatus.FAILED,
+                    error=error
+                ).model_dump_json(exclude_none=True) + "\n"
+                continue
+
+            batch.append((line, note))
+            if len(batch) >= settings.NOTE_BULK_BATCH_SIZE:
+                for result in await store_note_batch(user, batch):
+                    yield result.model_dump_json(exclude_none=True) + "\n"
+                batch = []
+    except UploadTooLarge as err:
+        # Rest of the body can't be split into lines reliably
+        yield NoteBulkResult(
+            line=line + 1,
+            status=ProcessingStatus.FAILED,
+            error=str(err)
+        ).model_dump_json(exclude_none=True) + "\n"
+
+    if batch:
+        for result in await store_note_batch(user, batch):
+            yield result.model_dump_json(exclude_none=True) + "\n"
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose content still reads the request body.
+    StreamingResponse otherwise consumes the body while listening for
+    a disconnect, the body stream notices a disconnect by itself.
+    """
+
+    async def listen_for_disconnect(self, receive):
+        await asyncio.Event().wait()
+
+
+# Create many notes from NDJSON body, one {"title", "content"} per line.
+# Body is read incrementally and results are streamed back per line.
+@file_router.post("/note/bulk", status_code=200)
+async def create_notes_bulk(
+    request: Request,
+    user: User = Depends(current_active_user)
+):
+    return RequestStreamingResponse(
+        create_notes_from_ndjson(request, user),
+        media_type="application/x-ndjson"
+    )
+
+
 # Note List endpoint
-@file_router.get("/note", response_model=NoteList, status_code=200)
+@file_router.get(
+    "/note",
+    response_model=NoteList,
+    status_code=200,
+    response_class=FastJSONResponse
+)
 async def list_notes(
     skip: int = 0,
     limit: int = 100,
+    cursor: str = None,
     user: User = Depends(current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    stmt = (
-        select(Note)
-        .where(Note.user_id == user.id)
-        .order_by(desc(Note.updated_at))
-        .offset(skip)
-        .limit(limit)
+    stmt = paginate(
+        select(Note).where(Note.user_id == user.id),
+        Note,
+        skip,
+        limit,
+        cursor
     )
 
     result = await session.execute(stmt)
     records = result.scalars().all()
 
-    count_stmt = (
-        select(func.count())
-        .select_from(Note)
-        .where(Note.user_id == user.id)
-    )
-
-    total_count = await session.execute(count_stmt)
-    total_count = total_count.scalar() or 0
+    total_count = await get_count(session, user.id, SourceType.NOTE)
 
     result = [
         NoteResponse(
@@ -330,7 +936,8 @@ async def list_notes(
     # Return the file URL to the client
     return NoteList(
         notes=result,
-        total=total_count
+        total=total_count,
+        next_cursor=next_cursor(records, limit)
     )
 
 
@@ -399,7 +1006,8 @@ async def update_note(
             detail="File not found"
         )
 
-    updated = update_file_with_backup(note.content, note_record.filename)
+    updated = await asyncio.to_thread(
+        update_file_with_backup, note.content, note_record.filename)
     if not updated:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -408,19 +1016,23 @@ async def update_note(
 
     # remove existing vector documents
     # and then add new set of updated documents
-    vector_store.remove_documents(
+    await asyncio.to_thread(
+        vector_store.remove_documents,
         note_record.filename,
         user.email
     )
 
-    await file_processor_queue.put(
+    await dispatch_job(
+        file_processor_queue,
+        SourceType.NOTE,
         (
             note_record.file_path,
             note_record.filename,
             note_record.url,
             note_record.id,
             user.email,
-            "note"
+            "note",
+            1
         )
     )
 
@@ -451,7 +1063,9 @@ async def delete_note(
         await session.execute(
             delete(Note).where(Note.id == note.id)
         )
-        vector_store.remove_documents(
+        await adjust_count(session, user.id, SourceType.NOTE, -1)
+        await asyncio.to_thread(
+            vector_store.remove_documents,
             note.filename,
             user.email
         )
@@ -529,11 +1143,15 @@ async def delete_uploaded_file(
         await session.execute(
             delete(FileUpload).where(FileUpload.id == fl.id)
         )
-        vector_store.remove_documents(
+        await adjust_count(session, user.id, SourceType.FILE, -1)
+        await asyncio.to_thread(
+            vector_store.remove_documents,
             fl.filename,
             user.email
         )
         await session.commit()
+        if fl.content_id:
+            await release_content(session, fl.content_id)
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -578,18 +1196,18 @@ async def submit_link(
     user: User = Depends(current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    db_link = Link(
-        url=str(link.url),
-        user_id=user.id,
-        status=ProcessingStatus.PENDING
-    )
-    session.add(db_link)
-    await session.commit()
-    await session.refresh(db_link)
-
-    # Add to processing queue
-    await url_processing_queue.put((db_link.id, str(link.url), user.email, link.headers))
+    [(db_link, action)] = await upsert_links(
+        session, user, [str(link.url)], refresh=link.refresh)
+
+    # Duplicates of queued links attach to the running job
+    if action in (LinkAction.CREATED, LinkAction.REFRESHED):
+        await dispatch_job(
+            url_processing_queue,
+            SourceType.LINK,
+            (db_link.id, db_link.url, user.email, link.headers, 1)
+        )
 
+    await session.refresh(db_link)
     return db_link
 
 
@@ -600,59 +1218,57 @@ async def submit_links_bulk(
     user: User = Depends(current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    # Process each URL
-    successful_links = []
-    failed_urls = []
-
-    for url in links_data.urls:
-        try:
-            # Create new link entry
-            db_link = Link(
-                url=str(url),
-                user_id=user.id,
-                status=ProcessingStatus.PENDING
-            )
-            session.add(db_link)
-            await session.commit()
-            await session.refresh(db_link)
-
-            # Add to processing queue with headers if provided
-            await url_processing_queue.put((db_link.id, str(url), user.email, links_data.headers))
-
-            successful_links.append(db_link)
-        except Exception as e:
-            failed_urls.append(str(url))
+    # New links are inserted with a single multi-row statement
+    # in one transaction instead of a commit per url
+    resolved = await upsert_links(
+        session,
+        user,
+        [str(url) for url in links_data.urls],
+        refresh=links_data.refresh
+    )
 
-    return BulkLinkResponse(links_added=len(successful_links))
+    counts = {action: 0 for action in LinkAction}
+    jobs = []
+    for link, action in resolved:
+        counts[action] += 1
+        if action in (LinkAction.CREATED, LinkAction.REFRESHED):
+            jobs.append((link.id, link.url, user.email, links_data.headers, 1))
+    await dispatch_jobs(url_processing_queue, SourceType.LINK, jobs)
+
+    return BulkLinkResponse(
+        links_added=counts[LinkAction.CREATED],
+        links_refreshed=counts[LinkAction.REFRESHED],
+        links_unchanged=len(links_data.urls) - counts[LinkAction.CREATED]
+        - counts[LinkAction.REFRESHED]
+    )
 
 
 # Links List endpoint
-@link_router.get("/", response_model=LinksList, status_code=200)
+@link_router.get(
+    "/",
+    response_model=LinksList,
+    status_code=200,
+    response_class=FastJSONResponse
+)
 async def list_links(
     skip: int = 0,
     limit: int = 100,
+    cursor: str = None,
     user: User = Depends(current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    stmt = (
-        select(Link)
-        .where(Link.user_id == user.id)
-        .order_by(desc(Link.updated_at))
-        .offset(skip)
-        .limit(limit)
+    stmt = paginate(
+        select(Link).where(Link.user_id == user.id),
+        Link,
+        skip,
+        limit,
+        cursor
     )
 
     result = await session.execute(stmt)
     records = result.scalars().all()
 
-    count_stmt = (
-        select(func.count())
-        .select_from(Link)
-        .where(Link.user_id == user.id)
-    )
-
-    total_count = await session.execute(count_stmt)
-    total_count = total_count.scalar() or 0
+    total_count = await get_count(session, user.id, SourceType.LINK)
 
     result = [
         LinkResponse(
@@ -668,10 +1284,86 @@ async def list_links(
     # Return the file URL to the client
     return LinksList(
         links=result,
-        total=total_count
+        total=total_count,
+        next_cursor=next_cursor(records, limit)
     )
 
 
+# Import links listed in sitemap.xml or sitemap index. The sitemap is
+# read before responding, only processing of the links is queued.
+@link_router.post(
+    "/sitemap",
+    response_model=SitemapImportResponse,
+    status_code=200)
+async def import_links_from_sitemap(
+    sitemap: SitemapImport,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    try:
+        counts = await import_sitemap(
+            session,
+            user,
+            str(sitemap.url),
+            sitemap.headers,
+            sitemap.include_patterns,
+            sitemap.exclude_patterns,
+            sitemap.modified_since
+        )
+    except re.error as err:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid url pattern: {err}"
+        )
+    except Exception as err:
+        logger.error(f"Error importing sitemap {sitemap.url}: {err}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Error reading sitemap: {err}"
+        )
+
+    return SitemapImportResponse(url=str(sitemap.url), **counts)
+
+
+def crawl_job_response(job):
+    return CrawlJobResponse(
+        id=job.id,
+        url=job.root_url,
+        status=job.status,
+        options=job.options or {},
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+        **crawl_progress(job)
+    )
+
+
+async def get_user_crawl_job(session, job_id, user):
+    result = await session.execute(
+        select(CrawlJob)
+        .where(CrawlJob.id == job_id, CrawlJob.user_id == user.id)
+    )
+    job = result.scalars().first()
+
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Crawl not found"
+        )
+    return job
+
+
+def ensure_crawler_stopped(job):
+    """
+    A paused crawler stores its pages and checkpoints before it stops,
+    a second one started meanwhile would be overwritten by it
+    """
+    if job.id in running_crawlers:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Crawl is still stopping, try again shortly"
+        )
+
+
 # Recursively Crawl the link
 @link_router.post("/crawl", response_model=LinkCrawlResponse, status_code=202)
 async def recursive_crawl(
@@ -681,9 +1373,158 @@ async def recursive_crawl(
 ):
 
     url = links_data.url
-    await recursive_url_processing_queue.put((str(url), user, links_data.headers))
+    root_url = normalize_url(str(url))
+    options = links_data.model_dump(
+        include={
+            "max_depth",
+            "max_pages",
+            "concurrency",
+            "same_domain",
+            "path_prefix",
+            "respect_robots"
+        }
+    )
+
+    # Resubmitting an unfinished crawl resumes it from its checkpoint
+    # instead of starting over
+    result = await session.execute(
+        select(CrawlJob).where(
+            CrawlJob.user_id == user.id,
+            CrawlJob.root_url == root_url,
+            CrawlJob.status.in_([
+                CrawlStatus.PENDING,
+                CrawlStatus.RUNNING,
+                CrawlStatus.PAUSED,
+                CrawlStatus.FAILED
+            ])
+        ).order_by(desc(CrawlJob.id))
+    )
+    job = result.scalars().first()
+
+    if job and job.status in (CrawlStatus.PENDING, CrawlStatus.RUNNING):
+        return LinkCrawlResponse(status=job.status, url=url, job_id=job.id)
+
+    if job:
+        ensure_crawler_stopped(job)
+        job.options = options
+        job.headers = links_data.headers
+        job.status = CrawlStatus.PENDING
+        take_lease(job)
+    else:
+        job = CrawlJob(
+            root_url=root_url,
+            status=CrawlStatus.PENDING,
+            options=options,
+            headers=links_data.headers,
+            user_id=user.id,
+            **lease()
+        )
+        session.add(job)
+
+    await session.commit()
+    await recursive_url_processing_queue.put(job.id)
+
+    return LinkCrawlResponse(status="submitted", url=url, job_id=job.id)
+
+
+# Crawls List endpoint
+@link_router.get("/crawl", response_model=CrawlJobList, status_code=200)
+async def list_crawls(
+    skip: int = 0,
+    limit: int = 100,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    stmt = (
+        select(CrawlJob)
+        .where(CrawlJob.user_id == user.id)
+        .order_by(desc(CrawlJob.id))
+        .offset(skip)
+        .limit(limit)
+    )
+
+    result = await session.execute(stmt)
+    records = result.scalars().all()
+
+    count_stmt = (
+        select(func.count())
+        .select_from(CrawlJob)
+        .where(CrawlJob.user_id == user.id)
+    )
+
+    total_count = await session.execute(count_stmt)
+    total_count = total_count.scalar() or 0
+
+    return CrawlJobList(
+        jobs=[crawl_job_response(record) for record in records],
+        total=total_count
+    )
+
+
+@link_router.get(
+    "/crawl/{job_id}",
+    response_model=CrawlJobResponse,
+    status_code=200)
+async def get_crawl(
+    job_id: int,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    job = await get_user_crawl_job(session, job_id, user)
+    return crawl_job_response(job)
+
+
+@link_router.post(
+    "/crawl/{job_id}/pause",
+    response_model=CrawlJobResponse,
+    status_code=202)
+async def pause_crawl(
+    job_id: int,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    job = await get_user_crawl_job(session, job_id, user)
+
+    if job.status in (CrawlStatus.PENDING, CrawlStatus.RUNNING):
+        # Running crawler stops fetching, stores the pages
+        # fetched so far and checkpoints its frontier
+        crawler = running_crawlers.get(job.id)
+        if crawler:
+            crawler.pause()
+        job.status = CrawlStatus.PAUSED
+        await session.commit()
+        await session.refresh(job)
+
+    return crawl_job_response(job)
+
+
+@link_router.post(
+    "/crawl/{job_id}/resume",
+    response_model=CrawlJobResponse,
+    status_code=202)
+async def resume_crawl(
+    job_id: int,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    job = await get_user_crawl_job(session, job_id, user)
+
+    if job.status == CrawlStatus.FINISHED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Crawl has already finished"
+        )
+
+    ensure_crawler_stopped(job)
 
-    return LinkCrawlResponse(status="submitted", url=url)
+    if job.status in (CrawlStatus.PAUSED, CrawlStatus.FAILED):
+        job.status = CrawlStatus.PENDING
+        take_lease(job)
+        await session.commit()
+        await session.refresh(job)
+        await recursive_url_processing_queue.put(job.id)
+
+    return crawl_job_response(job)
 
 
 @link_router.delete(
@@ -707,11 +1548,15 @@ async def delete_link(
         await session.execute(
             delete(Link).where(Link.id == link.id)
         )
-        vector_store.remove_link_documents(
+        await adjust_count(session, user.id, SourceType.LINK, -1)
+        await asyncio.to_thread(
+            vector_store.remove_link_documents,
             link.id,
             user.email
         )
         await session.commit()
+        if link.content_id:
+            await release_content(session, link.content_id)
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -721,46 +1566,192 @@ async def delete_link(
     return ResourceDeletedResponse(status="deleted")
 
 
-@document_router.post("/search", response_model=DocumentSearchResponse, status_code=200)
+# Dead-letter jobs list endpoint
+@job_router.get("/dead-letter", response_model=DeadLetterJobList, status_code=200)
+async def list_dead_letter_jobs(
+    skip: int = 0,
+    limit: int = 100,
+    job_type: str = None,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    conditions = [DeadLetterJob.user_id == user.id]
+    if job_type:
+        conditions.append(DeadLetterJob.job_type == job_type)
+
+    stmt = (
+        select(DeadLetterJob)
+        .where(*conditions)
+        .order_by(desc(DeadLetterJob.id))
+        .offset(skip)
+        .limit(limit)
+    )
+
+    result = await session.execute(stmt)
+    records = result.scalars().all()
+
+    count_stmt = (
+        select(func.count())
+        .select_from(DeadLetterJob)
+        .where(*conditions)
+    )
+
+    total_count = await session.execute(count_stmt)
+    total_count = total_count.scalar() or 0
+
+    return DeadLetterJobList(
+        jobs=[DeadLetterJobResponse.model_validate(record)
+              for record in records],
+        total=total_count
+    )
+
+
+# Put dead-lettered jobs back on their queues
+@job_router.post(
+    "/dead-letter/retry",
+    response_model=DeadLetterRetryResponse,
+    status_code=202)
+async def retry_dead_letter_jobs(
+    retry_request: DeadLetterRetryRequest,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    stmt = select(DeadLetterJob).where(DeadLetterJob.user_id == user.id)
+    if retry_request.ids:
+        stmt = stmt.where(DeadLetterJob.id.in_(retry_request.ids))
+    if retry_request.job_type:
+        stmt = stmt.where(DeadLetterJob.job_type == retry_request.job_type)
+
+    result = await session.execute(stmt)
+    dead_letters = result.scalars().all()
+
+    retry_jobs = []
+    dropped = 0
+    for dead_letter in dead_letters:
+        if dead_letter.job_type == SourceType.LINK:
+            model = Link
+        elif dead_letter.job_type == SourceType.NOTE:
+            model = Note
+        else:
+            model = FileUpload
+
+        row = await session.get(model, dead_letter.resource_id)
+        await session.delete(dead_letter)
+
+        # Resource has been removed in the meantime
+        if not row or row.user_id != user.id:
+            dropped += 1
+            continue
+
+        row.status = ProcessingStatus.PENDING
+        retry_jobs.append((dead_letter, row))
+
+    await session.commit()
+
+    for dead_letter, row in retry_jobs:
+        payload = dead_letter.payload
+        if dead_letter.job_type == SourceType.LINK:
+            await dispatch_job(
+                url_processing_queue,
+                SourceType.LINK,
+                (row.id, payload["url"], user.email, payload["headers"], 1)
+            )
+        else:
+            await dispatch_job(
+                file_processor_queue,
+                dead_letter.job_type,
+                (
+                    payload["file_path"],
+                    payload["file_name"],
+                    payload["file_url"],
+                    row.id,
+                    user.email,
+                    dead_letter.job_type,
+                    1
+                )
+            )
+
+    return DeadLetterRetryResponse(
+        retried=len(retry_jobs),
+        dropped=dropped
+    )
+
+
+def search_columns(fields):
+    """
+    Stored columns needed for the requested fields, source and
+    belongs_to are always read to dedupe links and remap shared chunks
+    """
+    if fields is None:
+        return None
+    wanted = {*fields, "source", "belongs_to"}
+    return [column for column in DOCUMENT_COLUMNS if column in wanted]
+
+
+def project_result(doc, score, fields):
+    # Keys are set even when missing, so they are kept as null
+    metadata = DocumentMetadata(**{
+        key: doc.metadata.get(key) for key in DocumentMetadata.model_fields
+        if fields is None or key in fields
+    })
+    if fields is None or "page_content" in fields:
+        return DocumentResult(
+            page_content=doc.page_content, metadata=metadata, score=score)
+    return DocumentResult(metadata=metadata, score=score)
+
+
+def iter_search_results(docs, request, access):
+    """
+    Results of a search as shown to the user, links are deduplicated
+    down to window_size sources
+    """
+    uniq_sources = set()
+    for doc, score in docs:
+        access.remap(doc)
+        source = doc.metadata.get("source", "")
+        if request.source_type == "link":
+            if len(uniq_sources) >= request.window_size:
+                break
+            if source in uniq_sources:
+                continue
+
+        yield project_result(doc, score, request.fields)
+        uniq_sources.add(source)
+
+
+@document_router.post(
+    "/search",
+    response_model=DocumentSearchResponse,
+    # Fields left out by the request are left out of the response
+    response_model_exclude_unset=True,
+    status_code=200,
+    response_class=FastJSONResponse
+)
 async def search_documents(
     request: DocumentSearchRequest,
     user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
 ):
     try:
-
-        window_size = request.window_size
-        source_type = request.source_type
-        docs = vector_store.fetch_documents(
-            request.include_sources,
-            request.exclude_sources,
+        # Shared chunks the user can read through own links and files
+        access = await load_shared_access(
+            session, user, request.include_sources, request.source_type)
+        docs = await run_in_threadpool(
+            vector_store.fetch_documents,
+            access.translate_sources(request.include_sources),
+            access.translate_sources(request.exclude_sources),
             request.window_size,
             user.email,
             request.prompt,
-            request.source_type
-        )
-        # Format results
-        results = []
-        uniq_sources = set()
-        for doc, score in docs:
-            source = doc.metadata.get("source", "")
-            if source_type == "link" and len(uniq_sources) >= window_size:
-                break
-            if source_type == "link" and source in uniq_sources:
-                continue
-
-            results.append(
-                DocumentResult(
-                    page_content=doc.page_content,
-                    metadata=DocumentMetadata(**doc.metadata),
-                    score=score
-                )
-            )
-
-            if source not in uniq_sources:
-                uniq_sources.add(source)
+            request.source_type,
+            access.keys,
+            search_columns(request.fields),
+            request.snippet_length
+        )
+        results = list(iter_search_results(docs, request, access))
 
         logger.info(
-            f"doc received = {len(docs)}, uniq_sources = {len(uniq_sources)}")
+            f"doc received = {len(docs)}, results = {len(results)}")
         return DocumentSearchResponse(
             documents=results,
             count=len(results)
@@ -770,3 +1761,148 @@ async def search_documents(
         logger.error(f"Error searching documents: {str(e)}")
         raise HTTPException(
             status_code=500, detail=f"Error searching documents: {str(e)}")
+
+
+def stream_search_results(docs, request, access):
+    """NDJSON lines of the results, produced while docs are searched"""
+    try:
+        for result in iter_search_results(docs, request, access):
+            yield result.model_dump_json(exclude_unset=True) + "\n"
+    except Exception as e:
+        logger.error(f"Error searching documents: {str(e)}")
+        yield json.dumps(
+            {"error": f"Error searching documents: {str(e)}"}) + "\n"
+
+
+# Same search as /search, results are sent as NDJSON one per line
+# as soon as they are found
+@document_router.post("/search/stream", status_code=200)
+async def search_documents_stream(
+    request: DocumentSearchRequest,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    access = await load_shared_access(
+        session, user, request.include_sources, request.source_type)
+    docs = vector_store.iter_documents(
+        access.translate_sources(request.include_sources),
+        access.translate_sources(request.exclude_sources),
+        request.window_size,
+        user.email,
+        request.prompt,
+        request.source_type,
+        access.keys,
+        search_columns(request.fields),
+        request.snippet_length
+    )
+    # A sync iterator runs in the threadpool, keeping the blocking
+    # searches off the event loop
+    return StreamingResponse(
+        stream_search_results(docs, request, access),
+        media_type="application/x-ndjson"
+    )
+
+
+def batch_access_scope(searches):
+    """Sources and source type the shared contents of all searches are in"""
+    sources = None
+    if all(search.include_sources for search in searches):
+        sources = list(dict.fromkeys(
+            source for search in searches for source in search.include_sources))
+    source_types = {search.source_type for search in searches}
+    source_type = source_types.pop() if len(source_types) == 1 else None
+    return sources, source_type
+
+
+@document_router.post(
+    "/search/batch",
+    response_model=DocumentSearchBatchResponse,
+    response_model_exclude_unset=True,
+    status_code=200,
+    response_class=FastJSONResponse
+)
+async def search_documents_batch(
+    request: DocumentSearchBatchRequest,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Run several searches with one embedding call"""
+    shared = request.model_dump(exclude={"searches"})
+    searches = [
+        DocumentSearchRequest(**{**shared, **search.model_dump(exclude_unset=True)})
+        for search in request.searches
+    ]
+    try:
+        access = await load_shared_access(
+            session, user, *batch_access_scope(searches))
+        results = await run_in_threadpool(
+            vector_store.fetch_documents_batch,
+            [
+                {
+                    "prompt": search.prompt,
+                    "include_selected": access.translate_sources(
+                        search.include_sources),
+                    "exclude_selected": access.translate_sources(
+                        search.exclude_sources),
+                    "window_size": search.window_size,
+                    "source_type": search.source_type,
+                    "columns": search_columns(search.fields),
+                    "snippet_length": search.snippet_length
+                }
+                for search in searches
+            ],
+            user.email,
+            access.keys
+        )
+
+        responses = []
+        for search, docs in zip(searches, results):
+            documents = list(iter_search_results(docs, search, access))
+            responses.append(DocumentSearchResponse(
+                documents=documents,
+                count=len(documents)
+            ))
+        return DocumentSearchBatchResponse(results=responses)
+
+    except Exception as e:
+        logger.error(f"Error searching documents: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error searching documents: {str(e)}")
+
+
+# Answer a prompt with the documents found for it, as server-sent
+# events: references, then the answer while it is generated
+@chat_router.post("/stream", status_code=200)
+async def chat_stream(
+    request: ChatRequest,
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    references = []
+    if request.context_aware:
+        access = await load_shared_access(
+            session, user, request.include_sources, request.source_type)
+        try:
+            docs = await run_in_threadpool(
+                vector_store.fetch_documents,
+                access.translate_sources(request.include_sources),
+                access.translate_sources(request.exclude_sources),
+                request.window_size,
+                user.email,
+                request.prompt,
+                request.source_type,
+                access.keys,
+                search_columns(request.fields),
+                request.snippet_length
+            )
+        except Exception as e:
+            logger.error(f"Error searching documents: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Error searching documents: {str(e)}")
+        references = list(iter_search_results(docs, request, access))
+
+    return StreamingResponse(
+        stream_chat(request, references),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
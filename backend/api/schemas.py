@@ -1,9 +1,10 @@
 # backend/auth/schemas.py
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any, Literal
 from fastapi_users import schemas
 from datetime import datetime
 from pydantic import HttpUrl, Field
 from backend.config import settings
+from backend.vector_store.models import DOCUMENT_COLUMNS
 
 
 class UserRead(schemas.BaseUser[int]):
@@ -54,11 +55,28 @@ class LinkBase(schemas.BaseModel):
 
 
 class LinkCreate(LinkBase):
-    pass
+    refresh: bool = Field(
+        default=False,
+        description="Fetch the url again if it was added before")
 
 
 class LinkCrawl(LinkBase):
-    pass
+    max_depth: int = Field(
+        default=settings.CRAWL_MAX_DEPTH, ge=0,
+        description="Maximum number of links to follow from the start url")
+    max_pages: int = Field(
+        default=settings.CRAWL_MAX_PAGES, ge=1,
+        description="Maximum number of urls to visit")
+    concurrency: int = Field(
+        default=settings.CRAWL_CONCURRENCY, ge=1,
+        description="Number of pages to fetch in parallel")
+    same_domain: bool = Field(
+        default=True, description="Only follow links on the same host")
+    path_prefix: Optional[str] = Field(
+        default=None,
+        description="Only follow links whose path starts with this prefix")
+    respect_robots: bool = Field(
+        default=True, description="Honour robots.txt of the crawled site")
 
 
 class LinkResponse(LinkBase):
@@ -75,37 +93,118 @@ class LinkResponse(LinkBase):
 
 class LinkCrawlResponse(LinkBase):
     status: str
+    job_id: Optional[int] = None
 
     class Config:
         from_attributes = True
 
 
+class SitemapImport(LinkBase):
+    include_patterns: Optional[List[str]] = Field(
+        default=None,
+        description="Only import urls matching any of these regex patterns")
+    exclude_patterns: Optional[List[str]] = Field(
+        default=None,
+        description="Skip urls matching any of these regex patterns")
+    modified_since: Optional[datetime] = Field(
+        default=None,
+        description="Skip entries whose lastmod is older than this")
+
+
+class SitemapImportResponse(schemas.BaseModel):
+    url: str
+    discovered: int
+    enqueued: int
+    refreshed: int
+    skipped: int
+    # Entries whose url could not be parsed
+    invalid: int = 0
+
+
+class CrawlJobResponse(schemas.BaseModel):
+    id: int
+    url: str
+    status: str
+    options: Dict[str, Any]
+    pages_crawled: int
+    pages_failed: int
+    urls_visited: int
+    urls_pending: int
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+
+class CrawlJobList(schemas.BaseModel):
+    jobs: List[CrawlJobResponse]
+    total: int
+
+
 class BulkLinkCreate(schemas.BaseModel):
     urls: List[HttpUrl]
     headers: Optional[Dict[str, str]] = Field(
         default=settings.DEFAULT_HEADERS, description="Custom request headers to use for all URLs")
+    refresh: bool = Field(
+        default=False,
+        description="Fetch urls again if they were added before")
 
 
 class BulkLinkResponse(schemas.BaseModel):
     links_added: int
+    links_refreshed: int = 0
+    # Duplicates merged into existing or in-flight links
+    links_unchanged: int = 0
 
     class Config:
         from_attributes = True
 
 
-class DocumentSearchRequest(schemas.BaseModel):
-    prompt: str
+# page_content and the metadata fields of a search result
+SearchField = Literal[tuple(DOCUMENT_COLUMNS)]
+
+
+class DocumentSearchOptions(schemas.BaseModel):
     include_sources: Optional[List[str]] = None
     exclude_sources: Optional[List[str]] = None
     window_size: Optional[int] = 5
     source_type: Optional[str] = None
+    fields: Optional[List[SearchField]] = Field(
+        default=None,
+        description="Fields of the results to return, all when not set")
+    snippet_length: Optional[int] = Field(
+        default=None, ge=0,
+        description="Return only this many characters of page_content")
+
+
+class DocumentSearchRequest(DocumentSearchOptions):
+    prompt: str
+
+
+class ChatMessage(schemas.BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(DocumentSearchOptions):
+    prompt: str
+    model: str = settings.DEFAULT_CHAT_MODEL
+    # Earlier messages of the conversation, oldest first
+    history: List[ChatMessage] = []
+    # Answer from the documents found for the prompt
+    context_aware: bool = True
+
+
+class DocumentSearchBatchRequest(DocumentSearchOptions):
+    # Options set on a search override the shared ones
+    searches: List[DocumentSearchRequest] = Field(
+        min_length=1, max_length=settings.SEARCH_BATCH_MAX_SIZE)
 
 
 class DocumentMetadata(schemas.BaseModel):
-    source: str
-    page: str
-    source_type: str
-    belongs_to: str
+    # Unset when left out by the fields of the search request
+    source: Optional[str] = None
+    page: Optional[str] = None
+    source_type: Optional[str] = None
+    belongs_to: Optional[str] = None
     title: Optional[str] = None
     link_id: Optional[str] = None
     file_id: Optional[str] = None
@@ -113,7 +212,7 @@ class DocumentMetadata(schemas.BaseModel):
 
 
 class DocumentResult(schemas.BaseModel):
-    page_content: str
+    page_content: Optional[str] = None
     metadata: DocumentMetadata
     score: float
 
@@ -123,11 +222,26 @@ class DocumentSearchResponse(schemas.BaseModel):
     count: int
 
 
+class DocumentSearchBatchResponse(schemas.BaseModel):
+    # In the order of the searches of the request
+    results: List[DocumentSearchResponse]
+
+
 class NoteCreateRequest(schemas.BaseModel):
     content: str
     title: str
 
 
+class NoteBulkResult(schemas.BaseModel):
+    # Line number of the note in the request body, starting at 1
+    line: int
+    id: Optional[int] = None
+    url: Optional[str] = None
+    title: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+
 class NoteUpdateRequest(schemas.BaseModel):
     content: str
 
@@ -156,16 +270,61 @@ class NoteResponse(schemas.BaseModel):
 class NoteList(schemas.BaseModel):
     notes: List[NoteResponse]
     total: int
+    # Pass as cursor to get the next page, None on the last page
+    next_cursor: Optional[str] = None
 
 
 class LinksList(schemas.BaseModel):
     links: List[LinkResponse]
     total: int
+    # Pass as cursor to get the next page, None on the last page
+    next_cursor: Optional[str] = None
 
 
 class FilesList(schemas.BaseModel):
     files: List[FileUploadResponse]
     total: int
+    # Pass as cursor to get the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+class UploadSessionCreate(schemas.BaseModel):
+    filename: str
+    size: int = Field(ge=0, description="Total size of the file in bytes")
+    content_type: Optional[str] = None
+
+
+class UploadSessionResponse(schemas.BaseModel):
+    upload_id: str
+    filename: str
+    size: int
+    # Offset of the next part to upload
+    offset: int
+    chunk_size: int
+
+
+class UploadFinalizeRequest(schemas.BaseModel):
+    checksum: str = Field(description="sha256 hex digest of the whole file")
+
+
+class ImportJobResponse(schemas.BaseModel):
+    id: int
+    filename: str
+    status: str
+    files_added: int
+    notes_added: int
+    duplicates: int
+    skipped: int
+    error: Optional[str] = None
+    # Number of imported files and notes per processing status
+    progress: Dict[str, int]
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+
+class ImportJobList(schemas.BaseModel):
+    jobs: List[ImportJobResponse]
+    total: int
 
 
 class FilePollingResponse(schemas.BaseModel):
@@ -174,3 +333,33 @@ class FilePollingResponse(schemas.BaseModel):
 
 class ResourceDeletedResponse(schemas.BaseModel):
     status: str
+
+
+class DeadLetterJobResponse(schemas.BaseModel):
+    id: int
+    job_type: str
+    resource_id: int
+    attempts: int
+    error_kind: str
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class DeadLetterJobList(schemas.BaseModel):
+    jobs: List[DeadLetterJobResponse]
+    total: int
+
+
+class DeadLetterRetryRequest(schemas.BaseModel):
+    # retry everything in the dead-letter table when not provided
+    ids: Optional[List[int]] = None
+    job_type: Optional[str] = None
+
+
+class DeadLetterRetryResponse(schemas.BaseModel):
+    retried: int
+    dropped: int
@@ -1,5 +1,11 @@
 # backend/auth/service.py
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
+
+from cachetools import TLRUCache
 from jose import jwt
 
 from backend.config import settings
@@ -9,9 +15,26 @@ from backend.core.logging import get_logger
 
 logger = get_logger()
 
+# Password hashing and token decoding are CPU bound, they run here
+# so they never hold up the event loop
+crypto_executor = ThreadPoolExecutor(
+    max_workers=settings.CRYPTO_WORKERS, thread_name_prefix="crypto")
 
-def validate_jwt_token(token: str) -> dict:
-    """Validate a JWT token and return user info if valid"""
+# Results of valid tokens, each kept until the token expires
+token_cache = TLRUCache(
+    maxsize=settings.TOKEN_CACHE_MAX_SIZE,
+    ttu=lambda token, cached, now: cached[1],
+    timer=time.time
+)
+
+
+async def run_crypto(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(crypto_executor, partial(func, *args))
+
+
+def decode_jwt_token(token: str):
+    """Payload of a valid, unexpired JWT token, None otherwise"""
     try:
         payload = jwt.decode(
             token,
@@ -22,18 +45,33 @@ def validate_jwt_token(token: str) -> dict:
 
         user_id = payload.get("sub")
         if user_id is None:
-            return {"valid": False}
+            return None
 
         # Check token expiration
         exp = payload.get("exp")
         utc_now = datetime.now(timezone.utc)
         if exp is None or utc_now > datetime.fromtimestamp(exp, tz=timezone.utc):
-            return {"valid": False}
+            return None
 
-        return {
-            "valid": True,
-            "user_id": user_id
-        }
+        return payload
     except Exception as e:
         print(f"Token validation error: {e}")
+        return None
+
+
+async def validate_jwt_token(token: str) -> dict:
+    """Validate a JWT token and return user info if valid"""
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached[0]
+
+    payload = await run_crypto(decode_jwt_token, token)
+    if payload is None:
         return {"valid": False}
+
+    result = {
+        "valid": True,
+        "user_id": payload["sub"]
+    }
+    token_cache[token] = (result, payload["exp"])
+    return result
@@ -0,0 +1,64 @@
+import hashlib
+import math
+import threading
+
+from cachetools import TTLCache
+
+from backend.config import settings
+from backend.core.ollama_scheduler import ScheduledEmbeddings
+
+embeddings = ScheduledEmbeddings(settings.EMBEDDINGS_MODEL)
+
+# Answers by model and ids of the chunks they were generated from.
+# Chunk ids are hashes of the content given to the model, a changed
+# chunk gets a new id so answers citing it are not found anymore.
+answers = TTLCache(
+    maxsize=settings.ANSWER_CACHE_MAX_SIZE, ttl=settings.ANSWER_CACHE_TTL)
+answers_lock = threading.Lock()
+
+# Answers kept per model and chunks, for differently phrased questions
+ANSWERS_PER_KEY = 8
+
+
+class CachedAnswer:
+    def __init__(self, vector, chunks, stats):
+        self.vector = vector
+        self.chunks = chunks
+        self.stats = stats
+
+
+def chunk_ids(references):
+    return frozenset(
+        hashlib.sha256((result.page_content or "").encode()).hexdigest()
+        for result in references
+    )
+
+
+def question_vector(question):
+    """Embedding of the question, of unit length"""
+    vector = embeddings.embed_query(question)
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def similarity(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def find_answer(model, ids, vector):
+    """Cached answer of the most similar question, None below the threshold"""
+    with answers_lock:
+        candidates = answers.get((model, ids), [])
+    best, best_similarity = None, settings.ANSWER_CACHE_SIMILARITY
+    for answer in candidates:
+        score = similarity(answer.vector, vector)
+        if score >= best_similarity:
+            best, best_similarity = answer, score
+    return best
+
+
+def store_answer(model, ids, vector, chunks, stats):
+    key = (model, ids)
+    with answers_lock:
+        kept = answers.get(key, [])[-(ANSWERS_PER_KEY - 1):]
+        answers[key] = [*kept, CachedAnswer(vector, chunks, stats)]
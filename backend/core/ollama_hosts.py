@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import threading
+import time
+
+import httpx
+import ollama
+
+from backend.config import settings
+from backend.core.logging import get_logger
+
+logger = get_logger()
+
+
+class OllamaHost:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.client = ollama.Client(host=self.url)
+        self.async_client = ollama.AsyncClient(
+            host=self.url,
+            limits=httpx.Limits(max_connections=settings.OLLAMA_MAX_CONNECTIONS),
+            timeout=settings.OLLAMA_CHAT_TIMEOUT
+        )
+        # Requests sent and not answered yet
+        self.outstanding = 0
+        # Failed requests in a row
+        self.failures = 0
+        self.ejected_until = 0.0
+        # Ejected by a failed health check, a passing one ends it
+        self.ejected_by_check = False
+        # Picked least recently first among equally busy hosts
+        self.picked = 0
+
+
+def is_host_failure(err):
+    """Errors of the host itself, not of the request"""
+    if isinstance(err, (ConnectionError, httpx.TransportError)):
+        return True
+    return isinstance(err, ollama.ResponseError) and err.status_code >= 500
+
+
+class OllamaHostPool:
+    """
+    Ollama servers requests are balanced over, the one with the least
+    outstanding requests first. Hosts failing OLLAMA_HOST_MAX_FAILURES
+    requests in a row are left out for OLLAMA_HOST_EJECT_SECONDS, hosts
+    failing a health check until they pass one. When all hosts are out
+    the one coming back first is used anyway.
+    """
+
+    def __init__(self, urls):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    def acquire(self, exclude=()):
+        with self.lock:
+            candidates = [host for host in self.hosts if host not in exclude]
+            now = time.monotonic()
+            available = [
+                host for host in candidates if host.ejected_until <= now
+            ]
+            if available:
+                host = min(
+                    available, key=lambda host: (host.outstanding, host.picked))
+            else:
+                host = min(candidates, key=lambda host: host.ejected_until)
+            host.outstanding += 1
+            host.picked = next(self.counter)
+            return host
+
+    def available_count(self):
+        """Number of hosts which are not left out, at least one"""
+        now = time.monotonic()
+        with self.lock:
+            return max(1, sum(
+                host.ejected_until <= now for host in self.hosts))
+
+    def release(self, host, err=None):
+        with self.lock:
+            host.outstanding -= 1
+            if err is None:
+                host.failures = 0
+            elif is_host_failure(err):
+                host.failures += 1
+                if host.failures >= settings.OLLAMA_HOST_MAX_FAILURES:
+                    self.eject(host, err)
+
+    def eject(self, host, reason, by_check=False):
+        """Leave the host out for a while, lock held"""
+        if host.ejected_until <= time.monotonic():
+            logger.warning(
+                f"Ejecting Ollama host {host.url} for "
+                f"{settings.OLLAMA_HOST_EJECT_SECONDS}s: {reason}")
+            host.ejected_by_check = by_check
+        elif not by_check:
+            # Failing requests outweigh a passing health check
+            host.ejected_by_check = False
+        host.ejected_until = (
+            time.monotonic() + settings.OLLAMA_HOST_EJECT_SECONDS)
+
+    def can_retry(self, err, tried):
+        return is_host_failure(err) and len(tried) < len(self.hosts)
+
+    def run(self, func):
+        """
+        Call func with the client of the least busy host, again with
+        the next host while hosts fail
+        """
+        tried = set()
+        while True:
+            host = self.acquire(tried)
+            try:
+                result = func(host.client)
+            except Exception as err:
+                self.release(host, err)
+                tried.add(host)
+                if not self.can_retry(err, tried):
+                    raise
+                logger.warning(f"Ollama host {host.url} failed, retrying: {err}")
+                continue
+            self.release(host)
+            return result
+
+    async def stream(self, func):
+        """
+        Chunks of the stream func returns for the async client of the
+        least busy host. Streams failing before their first chunk are
+        retried on the next host.
+        """
+        tried = set()
+        while True:
+            host = self.acquire(tried)
+            started = False
+            error = None
+            try:
+                async for chunk in await func(host.async_client):
+                    started = True
+                    yield chunk
+                return
+            except Exception as err:
+                error = err
+                tried.add(host)
+                if started or not self.can_retry(err, tried):
+                    raise
+                logger.warning(f"Ollama host {host.url} failed, retrying: {err}")
+            finally:
+                self.release(host, error)
+
+    async def check_health(self, client, host):
+        try:
+            response = await client.get(f"{host.url}/api/version")
+            response.raise_for_status()
+        except Exception as err:
+            with self.lock:
+                self.eject(host, f"health check failed: {err}", by_check=True)
+            return
+
+        # Hosts ejected for failing requests sit out their full time
+        with self.lock:
+            if host.ejected_by_check and host.ejected_until > time.monotonic():
+                logger.info(f"Ollama host {host.url} is healthy again")
+                host.ejected_until = 0.0
+            host.ejected_by_check = False
+
+    async def check_health_forever(self):
+        async with httpx.AsyncClient(
+                timeout=settings.OLLAMA_HEALTH_CHECK_TIMEOUT) as client:
+            while True:
+                await asyncio.gather(*(
+                    self.check_health(client, host) for host in self.hosts
+                ))
+                await asyncio.sleep(settings.OLLAMA_HEALTH_CHECK_INTERVAL)
+
+
+host_pool = OllamaHostPool(settings.OLLAMA_HOSTS or [settings.OLLAMA_HOST])
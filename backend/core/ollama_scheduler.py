@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import enum
+import itertools
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from cachetools import LRUCache
+from langchain_core.embeddings import Embeddings
+
+from backend.config import settings
+from backend.core.logging import get_logger
+from backend.core.ollama_hosts import host_pool
+
+logger = get_logger()
+
+
+class Priority(enum.IntEnum):
+    """Lower goes first"""
+    CHAT = 0
+    QUERY = 1
+    BULK = 2
+
+
+class Waiter:
+    def __init__(self, priority, seq, model, notify):
+        self.priority = priority
+        self.seq = seq
+        self.model = model
+        self.notify = notify
+        self.granted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OllamaScheduler:
+    """
+    Hands out slots for requests to Ollama, at most max_concurrency at a
+    time and at most the limit of the model per model, for every host
+    `hosts()` counts as usable. Free slots go to the waiting request of
+    the highest priority whose model has room, the oldest one first.
+    Usable from threads and from the event loop.
+    """
+
+    def __init__(
+            self,
+            max_concurrency,
+            model_concurrency,
+            default_model_concurrency,
+            hosts=lambda: 1):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = model_concurrency
+        self.default_model_concurrency = default_model_concurrency
+        self.hosts = hosts
+        self.lock = threading.Lock()
+        self.waiting = []
+        self.active = {}
+        self.total = 0
+        self.counter = itertools.count()
+
+    def has_room(self, model, hosts):
+        limit = self.model_concurrency.get(
+            model, self.default_model_concurrency)
+        return (self.total < self.max_concurrency * hosts
+                and self.active.get(model, 0) < limit * hosts)
+
+    def dispatch(self):
+        """Grant slots to waiters while there is room, lock held"""
+        hosts = self.hosts()
+        index = 0
+        while (index < len(self.waiting)
+               and self.total < self.max_concurrency * hosts):
+            waiter = self.waiting[index]
+            if not self.has_room(waiter.model, hosts):
+                index += 1
+                continue
+            self.waiting.pop(index)
+            self.active[waiter.model] = self.active.get(waiter.model, 0) + 1
+            self.total += 1
+            waiter.granted = True
+            waiter.notify()
+
+    def enqueue(self, model, priority, notify):
+        waiter = Waiter(priority, next(self.counter), model, notify)
+        with self.lock:
+            bisect.insort(self.waiting, waiter)
+            self.dispatch()
+        return waiter
+
+    def release(self, model):
+        with self.lock:
+            self.active[model] -= 1
+            self.total -= 1
+            self.dispatch()
+
+    def cancel(self, waiter):
+        with self.lock:
+            if not waiter.granted:
+                self.waiting.remove(waiter)
+                return
+        # Granted meanwhile, give the slot to the next one
+        self.release(waiter.model)
+
+    @contextmanager
+    def slot(self, model, priority):
+        granted = threading.Event()
+        self.enqueue(model, priority, granted.set)
+        granted.wait()
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    @asynccontextmanager
+    async def async_slot(self, model, priority):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None))
+
+        waiter = self.enqueue(model, priority, notify)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            self.cancel(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": dict(self.active),
+                "waiting": len(self.waiting)
+            }
+
+
+# Concurrency limits are per Ollama host which is not ejected, balancing
+# over the least busy hosts keeps every host within them
+scheduler = OllamaScheduler(
+    settings.OLLAMA_MAX_CONCURRENCY,
+    settings.OLLAMA_MODEL_CONCURRENCY,
+    settings.OLLAMA_DEFAULT_MODEL_CONCURRENCY,
+    host_pool.available_count
+)
+
+# A chat embeds its prompt for the search and for the answer cache
+query_cache = LRUCache(maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE)
+query_cache_lock = threading.Lock()
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings of a model through the scheduler, documents being
+    ingested wait for queries of searches
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def embed(self, texts, priority):
+        with scheduler.slot(self.model, priority):
+            return host_pool.run(lambda client: client.embed(
+                self.model,
+                texts,
+                keep_alive=settings.OLLAMA_KEEP_ALIVE
+            ))["embeddings"]
+
+    def embed_documents(self, texts):
+        return self.embed(texts, Priority.BULK)
+
+    def embed_query(self, text):
+        key = (self.model, text)
+        with query_cache_lock:
+            embedding = query_cache.get(key)
+        if embedding is None:
+            embedding = self.embed([text], Priority.QUERY)[0]
+            with query_cache_lock:
+                query_cache[key] = embedding
+        return embedding
+
+    def embed_queries(self, texts):
+        return self.embed(texts, Priority.QUERY)
+
+
+async def chat_chunks(model, messages):
+    """Chunks of a streamed chat answer, generated in a chat slot"""
+    async with scheduler.async_slot(model, Priority.CHAT):
+        async for chunk in host_pool.stream(lambda client: client.chat(
+            model=model,
+            messages=messages,
+            stream=True,
+            keep_alive=settings.OLLAMA_KEEP_ALIVE
+        )):
+            yield chunk
+
+
+async def prewarm_models():
+    """
+    Load the embedding and default chat models on every Ollama host
+    before they are needed
+    """
+    models = [(settings.EMBEDDINGS_MODEL, True)]
+    if settings.DEFAULT_CHAT_MODEL:
+        models.append((settings.DEFAULT_CHAT_MODEL, False))
+
+    for host in host_pool.hosts:
+        for model, embedding in models:
+            try:
+                async with scheduler.async_slot(model, Priority.BULK):
+                    # Requests without input only load the model
+                    if embedding:
+                        await host.async_client.embed(
+                            model, "", keep_alive=settings.OLLAMA_KEEP_ALIVE)
+                    else:
+                        await host.async_client.generate(
+                            model, keep_alive=settings.OLLAMA_KEEP_ALIVE)
+                logger.info(f"Loaded Ollama model {model} on {host.url}")
+            except Exception as e:
+                logger.warning(
+                    f"Could not load Ollama model {model} on {host.url}: {str(e)}")
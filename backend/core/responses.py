@@ -0,0 +1,102 @@
+import gzip
+
+import zstandard
+from fastapi.responses import JSONResponse, ORJSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from backend.config import settings
+
+# Response class of the search and list endpoints
+FastJSONResponse = ORJSONResponse if settings.ORJSON_RESPONSES else JSONResponse
+
+# Preferred first when the client accepts both equally
+ENCODINGS = ("zstd", "gzip")
+
+
+def choose_encoding(accept_encoding):
+    """Supported encoding with the highest q-value of an Accept-Encoding header"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(
+            level=settings.ZSTD_COMPRESSION_LEVEL).compress(body)
+    return gzip.compress(
+        body, compresslevel=settings.GZIP_COMPRESSION_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with zstd or gzip, as negotiated through
+    Accept-Encoding, once they are larger than minimum_size bytes.
+    Only responses sent in one piece are compressed, streamed ones
+    (file downloads, NDJSON) pass through so they are still delivered
+    as they are produced.
+    """
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(
+            Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Held back until we know whether the body is compressed
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
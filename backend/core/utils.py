@@ -1,7 +1,10 @@
 import PyPDF2
+import asyncio
+import hashlib
 import mimetypes
 import uuid
 import os
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from backend.config import settings
 import shutil
@@ -19,6 +22,36 @@ text_splitter = RecursiveCharacterTextSplitter(
 )
 
 
+# Query parameters which only track the visitor and
+# don't change the content of the page
+TRACKING_QUERY_PARAMS = {
+    "fbclid", "gclid", "mc_cid", "mc_eid", "ref", "ref_src"
+}
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    """
+    Canonical form of the url used for deduplication:
+    lowercase scheme and host, no default port, no fragment,
+    no tracking params and sorted query string.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    query = urlencode(sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in TRACKING_QUERY_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
 def is_file_pdf(file_path):
     mime_type, _ = mimetypes.guess_type(file_path)
     return mime_type == 'application/pdf'
@@ -31,6 +64,19 @@ def read_text_file_content(file_path):
     return text_content
 
 
+def sync_file(f):
+    """Flush the file to disk according to FILE_FSYNC_POLICY"""
+    f.flush()
+    if settings.FILE_FSYNC_POLICY == "always":
+        os.fsync(f.fileno())
+
+
+def write_text_file(file_path, content):
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        sync_file(f)
+
+
 def save_file(content, title):
     # Generate a unique ID
     doc_id = str(uuid.uuid4())
@@ -46,8 +92,7 @@ def save_file(content, title):
 
     # Write content to file
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        write_text_file(file_path, content)
         saved = True
     except Exception as err:
         logger.error(f"Error creating note {file_path}: {err}")
@@ -56,6 +101,87 @@ def save_file(content, title):
     return doc_id, file_path, filename, saved
 
 
+def write_chunk(f, digest, chunk):
+    digest.update(chunk)
+    f.write(chunk)
+
+
+async def save_upload_file(upload, file_path):
+    """
+    Stream the uploaded file to disk in chunks, hashing it on the way.
+    Reads, writes and hashing never block the event loop.
+    Returns sha256 of the written bytes.
+    """
+    digest = hashlib.sha256()
+    f = await asyncio.to_thread(open, file_path, "wb")
+    try:
+        while chunk := await upload.read(settings.FILE_WRITE_CHUNK_SIZE):
+            await asyncio.to_thread(write_chunk, f, digest, chunk)
+        await asyncio.to_thread(sync_file, f)
+    finally:
+        await asyncio.to_thread(f.close)
+    return digest.hexdigest()
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def iter_lines(chunks, max_line_size):
+    """
+    Split a stream of byte chunks into lines as they arrive.
+    Raises UploadTooLarge for lines longer than max_line_size.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if len(line) > max_line_size:
+                raise UploadTooLarge(f"Line longer than {max_line_size} bytes")
+            yield line
+        if len(buffer) > max_line_size:
+            raise UploadTooLarge(f"Line longer than {max_line_size} bytes")
+    if buffer:
+        yield buffer
+
+
+def open_part(file_path, offset):
+    """Open the part file for writing at offset, dropping anything after"""
+    f = open(file_path, "r+b")
+    f.seek(offset)
+    f.truncate()
+    return f
+
+
+async def write_file_part(chunks, file_path, offset, max_size):
+    """
+    Write the async iterable of bytes to the file starting at offset.
+    An interrupted stream keeps what was written so far, so the client
+    can resume from there. Returns the number of bytes written.
+    """
+    f = await asyncio.to_thread(open_part, file_path, offset)
+    written = 0
+    try:
+        try:
+            async for chunk in chunks:
+                if offset + written + len(chunk) > max_size:
+                    await asyncio.to_thread(f.truncate, offset)
+                    raise UploadTooLarge(
+                        f"Upload exceeds the declared size of {max_size} bytes")
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+        except UploadTooLarge:
+            raise
+        except Exception as err:
+            logger.warning(
+                f"Upload part of {file_path} interrupted after {written} bytes: {err}")
+        await asyncio.to_thread(sync_file, f)
+    finally:
+        await asyncio.to_thread(f.close)
+    return written
+
+
 def extract_text_from_pdf(pdf_file):
     """Extract text from PDF file"""
     texts = []
@@ -110,8 +236,7 @@ def update_file_with_backup(content, filename):
         # Create backup of the original file
         shutil.copy2(file_path, backup_path)
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(content)
+            write_text_file(file_path, content)
             os.remove(backup_path)
             return True
         except Exception as write_err:
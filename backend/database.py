@@ -1,35 +1,72 @@
 # backend/database.py
 from typing import AsyncGenerator
 
-from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from backend.config import settings
+from backend.migrations import run_migrations, lock_schema
 
 # Create base model
 Base = declarative_base()
 
-# Create synchronous engine for initial setup
-sync_engine = create_engine(
-    settings.DATABASE_URL.replace("+aiosqlite", ""),
-    connect_args={"check_same_thread": False}
-)
+DIALECT = make_url(settings.DATABASE_URL).get_backend_name()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def engine_options():
+    options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT
+    }
+    if DIALECT == "sqlite":
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000
+        }
+    else:
+        options["pool_pre_ping"] = True
+        options["pool_recycle"] = settings.DB_POOL_RECYCLE
+    return options
+
 
 # Create async engine for FastAPI
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+engine = create_async_engine(settings.DATABASE_URL, **engine_options())
+
+if DIALECT == "sqlite":
+    event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+
 async_session_maker = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False)
 
+
+def insert(table):
+    """INSERT supporting on_conflict_do_nothing on the configured database"""
+    if DIALECT == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
 # Create tables
 
 
-def create_db_and_tables():
-    Base.metadata.create_all(sync_engine)
+async def create_db_and_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(lock_schema)
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
 
 # Get async session
 
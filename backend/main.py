@@ -3,11 +3,35 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from backend.api.router import router as auth_router
-from backend.api.router import file_router, link_router, document_router
+from backend.api.router import (
+    file_router,
+    link_router,
+    document_router,
+    job_router,
+    chat_router
+)
+from backend.worker import url_processor, process_uploaded_file
 from backend.worker.url_processor import process_url_queue
-from backend.worker.url_processor_recursive import process_recursive_url_queue
+from backend.worker.url_processor_recursive import (
+    process_recursive_url_queue,
+    resume_interrupted_crawls
+)
 from backend.worker.process_uploaded_file import process_uploaded_file_queue
+from backend.worker.dispatch import (
+    process_queued_jobs,
+    maintain_leases,
+    DATABASE_DISPATCH
+)
+from backend.api.models import SourceType
+from backend.worker.shared_content import reset_interrupted_contents
+from backend.worker.archive_import import (
+    process_archive_import_queue,
+    fail_interrupted_imports
+)
 from backend.config import settings
+from backend.core.responses import CompressionMiddleware
+from backend.core.ollama_scheduler import prewarm_models
+from backend.core.ollama_hosts import host_pool
 from backend.database import create_db_and_tables
 from backend.core.logging import setup_logging
 import asyncio
@@ -27,20 +51,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.RESPONSE_COMPRESSION:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE
+    )
+
 # Include routers
 app.include_router(auth_router, prefix="/auth")
 app.include_router(file_router, prefix="/file")
 app.include_router(link_router, prefix="/links")
 app.include_router(document_router, prefix="/documents")
+app.include_router(job_router, prefix="/jobs")
+app.include_router(chat_router, prefix="/chat")
 
 
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    await create_db_and_tables()
+    if len(host_pool.hosts) > 1:
+        asyncio.create_task(host_pool.check_health_forever())
+    if settings.OLLAMA_PREWARM:
+        asyncio.create_task(prewarm_models())
+    recoveries = [
+        reset_interrupted_contents,
+        fail_interrupted_imports,
+        resume_interrupted_crawls
+    ]
+    if settings.JOB_DISPATCH_MODE == DATABASE_DISPATCH:
+        file_worker = (
+            process_uploaded_file.process_file,
+            settings.FILES_JOB_QUEUE_CONCURRENCY
+        )
+        asyncio.create_task(process_queued_jobs({
+            SourceType.LINK: (
+                url_processor.process_single_url,
+                settings.LINKS_JOB_QUEUE_CONCURRENCY
+            ),
+            SourceType.FILE: file_worker,
+            SourceType.NOTE: file_worker,
+        }))
+        # Other processes may still be working on leftovers, only
+        # the ones whose lease runs out are recovered
+        asyncio.create_task(maintain_leases(recoveries))
+    else:
+        # Leftovers of a previous run of this (only) process
+        for recover in recoveries:
+            await recover()
     asyncio.create_task(process_url_queue())
     asyncio.create_task(process_recursive_url_queue())
     asyncio.create_task(process_uploaded_file_queue())
-
+    asyncio.create_task(process_archive_import_queue())
 
 # Root endpoint
 @app.get("/")
@@ -0,0 +1,187 @@
+# backend/migrations.py
+from sqlalchemy import inspect, text
+
+from backend.core.logging import get_logger
+from backend.core.utils import normalize_url
+
+logger = get_logger()
+
+# Key of the PostgreSQL advisory lock held while changing the schema
+SCHEMA_LOCK_KEY = 7340211
+
+
+# New tables are created by create_all, migrations only take care
+# of changes to tables which may already exist in older databases.
+
+
+def add_column(conn, table, column, column_type):
+    columns = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(
+            text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def add_link_normalized_url(conn):
+    add_column(conn, "links", "normalized_url", "VARCHAR")
+
+    taken = set(conn.execute(text(
+        "SELECT user_id, normalized_url FROM links "
+        "WHERE normalized_url IS NOT NULL"
+    )).all())
+    rows = conn.execute(text(
+        "SELECT id, user_id, url FROM links "
+        "WHERE normalized_url IS NULL ORDER BY id"
+    )).all()
+
+    # Oldest link of every url is the canonical one, existing
+    # duplicates are kept as they are without a normalized url
+    updates = []
+    for link_id, user_id, url in rows:
+        key = (user_id, normalize_url(url))
+        if key in taken:
+            continue
+        taken.add(key)
+        updates.append({"id": link_id, "normalized_url": key[1]})
+
+    if updates:
+        conn.execute(
+            text("UPDATE links SET normalized_url = :normalized_url "
+                 "WHERE id = :id"),
+            updates
+        )
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_links_user_normalized_url "
+        "ON links (user_id, normalized_url)"
+    ))
+    logger.info(
+        f"Normalized {len(updates)} links, "
+        f"{len(rows) - len(updates)} duplicates left as they are")
+
+
+def add_content_references(conn):
+    for table in ("links", "file_uploads"):
+        add_column(
+            conn, table, "content_id",
+            "INTEGER REFERENCES shared_contents (id)")
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_content_id "
+            f"ON {table} (content_id)"
+        ))
+
+
+def add_file_content_hash(conn):
+    add_column(conn, "file_uploads", "content_hash", "VARCHAR")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_file_uploads_user_content_hash "
+        "ON file_uploads (user_id, content_hash)"
+    ))
+
+
+def add_import_job_references(conn):
+    for table in ("file_uploads", "notes"):
+        add_column(
+            conn, table, "import_job_id",
+            "INTEGER REFERENCES import_jobs (id)")
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_import_job_id "
+            f"ON {table} (import_job_id)"
+        ))
+
+
+def add_user_updated_at_indexes(conn):
+    for table in ("file_uploads", "links", "notes"):
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_user_updated_at "
+            f"ON {table} (user_id, updated_at)"
+        ))
+
+
+def backfill_updated_at(conn):
+    for table in ("file_uploads", "links", "notes"):
+        if conn.dialect.name == "sqlite":
+            # Same text format as the datetimes written by the models,
+            # otherwise comparisons of the paging cursor are off
+            conn.execute(text(
+                f"UPDATE {table} SET updated_at = strftime("
+                f"'%Y-%m-%d %H:%M:%f000', "
+                f"coalesce(updated_at, created_at, CURRENT_TIMESTAMP))"
+            ))
+        else:
+            conn.execute(text(
+                f"UPDATE {table} SET updated_at = "
+                f"coalesce(created_at, CURRENT_TIMESTAMP) "
+                f"WHERE updated_at IS NULL"
+            ))
+
+
+def add_job_leases(conn):
+    for table in (
+            "queued_jobs", "crawl_jobs", "import_jobs", "shared_contents"):
+        add_column(conn, table, "claimed_by", "VARCHAR")
+        add_column(conn, table, "claimed_until", "TIMESTAMP")
+
+
+# Applied in order, names must never change once released
+MIGRATIONS = [
+    ("0001_link_normalized_url", add_link_normalized_url),
+    ("0002_content_references", add_content_references),
+    ("0003_file_content_hash", add_file_content_hash),
+    ("0004_import_job_references", add_import_job_references),
+    ("0005_user_updated_at_indexes", add_user_updated_at_indexes),
+    ("0006_backfill_updated_at", backfill_updated_at),
+    ("0007_job_leases", add_job_leases),
+]
+
+
+def lock_schema(conn):
+    """
+    Serialize schema changes of processes starting at the same time,
+    until the end of the transaction. Sqlite writers are serialized
+    by the database already.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"),
+                     {"key": SCHEMA_LOCK_KEY})
+
+
+def create_migrations_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "name VARCHAR PRIMARY KEY, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+
+
+def applied_migrations(conn):
+    return {
+        row[0] for row in
+        conn.execute(text("SELECT name FROM schema_migrations"))
+    }
+
+
+def apply_migration(conn, name, migration):
+    lock_schema(conn)
+    # Another process may have applied it while we waited for the lock
+    if name in applied_migrations(conn):
+        return False
+    migration(conn)
+    conn.execute(
+        text("INSERT INTO schema_migrations (name) VALUES (:name)"),
+        {"name": name}
+    )
+    return True
+
+
+async def run_migrations(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(lock_schema)
+        await conn.run_sync(create_migrations_table)
+        applied = await conn.run_sync(applied_migrations)
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        # Every migration runs in its own transaction
+        async with engine.begin() as conn:
+            if await conn.run_sync(apply_migration, name, migration):
+                logger.info(f"Applied database migration {name}")
@@ -1,8 +1,9 @@
+import json
 from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 from langchain.schema import Document
 from backend.config import settings
 from backend.core.logging import get_logger
+from backend.core.ollama_scheduler import ScheduledEmbeddings
 from backend.core.utils import (
     extract_text_from_pdf,
     is_file_pdf,
@@ -16,8 +17,7 @@ from backend.api.models import SourceType
 logger = get_logger()
 
 # Initialize embeddings
-embeddings = OllamaEmbeddings(
-    model=settings.EMBEDDINGS_MODEL, base_url=settings.OLLAMA_HOST)
+embeddings = ScheduledEmbeddings(settings.EMBEDDINGS_MODEL)
 persist_directory = settings.CHROMA_VECTOR_STORE_PERSISTS_DIRECTORY
 
 # Initialize Chroma vector store
@@ -27,12 +27,10 @@ vector_store = Chroma(
 )
 
 
-def add_link_content_to_vector_store(
-        text_content, source, title, link_id, username):
-
+def build_link_documents(text_content, source, title, link_id, username):
     texts = chunk_link_content(text_content)
 
-    documents = [
+    return [
         Document(
             page_content=f"{title}\n\n{text}",
             metadata={
@@ -46,10 +44,40 @@ def add_link_content_to_vector_store(
         ) for i, text in enumerate(texts)
     ]
 
+
+def add_link_content_to_vector_store(
+        text_content, source, title, link_id, username):
+
+    documents = build_link_documents(
+        text_content, source, title, link_id, username)
+
     vector_store.add_documents(documents=documents)
     logger.info(f"processed: {source} with {title}")
 
 
+def add_links_content_to_vector_store(pages, username):
+    """
+    Batched variant of add_link_content_to_vector_store,
+    embeds chunks of all the pages in a single call.
+    pages: list of dicts with text_content, source, title and link_id
+    """
+    documents = []
+    for page in pages:
+        documents.extend(build_link_documents(
+            page["text_content"],
+            page["source"],
+            page["title"],
+            page["link_id"],
+            page.get("belongs_to", username)
+        ))
+
+    if not documents:
+        return
+
+    vector_store.add_documents(documents=documents)
+    logger.info(f"processed: {len(pages)} links with {len(documents)} chunks")
+
+
 def add_uploaded_document_content_to_vector_store(
         file_path, file_name, file_url, file_id, username):
 
@@ -85,18 +113,19 @@ def add_uploaded_document_content_to_vector_store(
     logger.info(f"processed: {file_name} with id={file_id}")
 
 
-def fetch_documents(
+def search_limit(window_size, source_type=None):
+    if source_type == 'link':
+        return window_size * settings.WINDOW_SIZE_MULTIPLIER
+    return window_size
+
+
+def search_filter(
         include_selected,
         exclude_selected,
-        window_size,
         username,
-        prompt,
-        source_type=None):
-
-    if source_type == 'link':
-        window_size_modified = window_size * settings.WINDOW_SIZE_MULTIPLIER
-    else:
-        window_size_modified = window_size
+        source_type=None,
+        access=None):
+    readers = [username, *(access or [])]
 
     filter_dict = {}
     if exclude_selected and include_selected:
@@ -107,7 +136,7 @@ def fetch_documents(
                 # Include these sources
                 {"source": {"$in": include_selected}},
                 # Include souces belonging to current users only
-                {"belongs_to": {"$in": [username]}}
+                {"belongs_to": {"$in": readers}}
 
             ]
         }
@@ -115,7 +144,7 @@ def fetch_documents(
         filter_dict = {
             "$and": [
                 {"source": {"$nin": exclude_selected}},
-                {"belongs_to": {"$in": [username]}}
+                {"belongs_to": {"$in": readers}}
 
             ]
         }
@@ -123,13 +152,13 @@ def fetch_documents(
         filter_dict = {
             "$and": [
                 {"source": {"$in": include_selected}},
-                {"belongs_to": {"$in": [username]}}
+                {"belongs_to": {"$in": readers}}
 
             ]
         }
     else:
         filter_dict = {
-            "belongs_to": {"$in": [username]}
+            "belongs_to": {"$in": readers}
         }
 
     if source_type is not None:
@@ -144,14 +173,49 @@ def fetch_documents(
             filter_dict = {
                 "$and": [
                     {"source_type": {"$in": [source_type]}},
-                    {"belongs_to": {"$in": [username]}}
+                    {"belongs_to": {"$in": readers}}
                 ]
             }
 
+    return filter_dict
+
+
+def project_documents(docs, columns=None, snippet_length=None):
+    # Chroma returns whole documents, projected once fetched
+    for doc, _ in docs:
+        doc.page_content = doc.page_content[:snippet_length]
+        if columns is not None:
+            doc.metadata = {
+                key: value for key, value in doc.metadata.items()
+                if key in columns
+            }
+    return docs
+
+
+def fetch_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type=None,
+        access=None,
+        columns=None,
+        snippet_length=None):
+    """
+    access: additional `belongs_to` values readable by the user,
+    i.e. keys of shared content referenced by the user
+    columns: stored columns to read, all of them when None
+    snippet_length: number of characters of page_content to return
+    """
+
+    filter_dict = search_filter(
+        include_selected, exclude_selected, username, source_type, access)
+
     docs = vector_store.similarity_search_with_relevance_scores(
         prompt,
         filter=filter_dict,
-        k=window_size_modified  # Retrieve more relevant chunks
+        k=search_limit(window_size, source_type)  # Retrieve more relevant chunks
     )
 
     # TODO: Add mmr search later
@@ -165,7 +229,85 @@ def fetch_documents(
     #    }
     # )
     # docs = retriever.get_relevant_documents(prompt)
-    return docs
+    return project_documents(docs, columns, snippet_length)
+
+
+def iter_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type=None,
+        access=None,
+        columns=None,
+        snippet_length=None):
+    """
+    Same results as fetch_documents. The langchain store can't skip
+    results, so they are all searched at once.
+    """
+    yield from fetch_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type,
+        access,
+        columns,
+        snippet_length
+    )
+
+
+def fetch_documents_batch(searches, username, access=None):
+    """
+    Results of several searches, each a dict of the keyword arguments
+    of fetch_documents. All prompts are embedded in one call, searches
+    with the same filter run as one multi-vector query.
+    """
+    query_embeddings = embeddings.embed_queries(
+        [search["prompt"] for search in searches])
+
+    groups = {}
+    for index, search in enumerate(searches):
+        filter_dict = search_filter(
+            search.get("include_selected"),
+            search.get("exclude_selected"),
+            username,
+            search.get("source_type"),
+            access
+        )
+        limit = search_limit(search["window_size"], search.get("source_type"))
+        key = (json.dumps(filter_dict, sort_keys=True), limit)
+        groups.setdefault(key, (filter_dict, []))[1].append(index)
+
+    # Same scores as similarity_search_with_relevance_scores
+    relevance_score = vector_store._select_relevance_score_fn()
+    results = [[] for _ in searches]
+    for (_, limit), (filter_dict, indexes) in groups.items():
+        query_results = vector_store._collection.query(
+            query_embeddings=[query_embeddings[index] for index in indexes],
+            n_results=limit,
+            where=filter_dict,
+            include=["documents", "metadatas", "distances"]
+        )
+        for query_index, index in enumerate(indexes):
+            docs = [
+                (Document(page_content=text or "", metadata=metadata or {}),
+                 relevance_score(distance))
+                for text, metadata, distance in zip(
+                    query_results["documents"][query_index],
+                    query_results["metadatas"][query_index],
+                    query_results["distances"][query_index]
+                )
+            ]
+            search = searches[index]
+            results[index] = project_documents(
+                docs, search.get("columns"), search.get("snippet_length"))
+
+    logger.info(
+        f"Ran {len(searches)} searches as {len(groups)} Chroma queries")
+    return results
 
 
 def remove_documents(filename, username):
@@ -224,3 +366,21 @@ def remove_link_documents(link_id, username):
         logger.error(
             f"Error removing documents with link_id={link_id}: {str(err)}")
         return False
+
+
+def remove_content_documents(belongs_to):
+    """Remove all documents stored under the given owner key"""
+    try:
+        matching_docs = vector_store._collection.get(
+            where={"belongs_to": {"$eq": belongs_to}})
+        if matching_docs and len(matching_docs['ids']) > 0:
+            vector_store.delete(ids=matching_docs['ids'])
+            logger.info(
+                f"Removed {len(matching_docs['ids'])} documents belonging to {belongs_to}")
+            return True
+        return False
+
+    except Exception as err:
+        logger.error(
+            f"Error removing documents belonging to {belongs_to}: {str(err)}")
+        return False
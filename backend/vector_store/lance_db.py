@@ -1,9 +1,9 @@
-from langchain_ollama import OllamaEmbeddings
 from langchain.schema import Document
 import lancedb
 import uuid
 from backend.config import settings
 from backend.core.logging import get_logger
+from backend.core.ollama_scheduler import ScheduledEmbeddings
 from backend.core.utils import (
     extract_text_from_pdf,
     is_file_pdf,
@@ -13,14 +13,14 @@ from backend.core.utils import (
     chunk_link_content
 )
 from backend.api.models import SourceType
+from backend.vector_store.models import DOCUMENT_COLUMNS
 import pyarrow as pa
 
 
 logger = get_logger()
 
 # Initialize embeddings
-embeddings = OllamaEmbeddings(
-    model=settings.EMBEDDINGS_MODEL, base_url=settings.OLLAMA_HOST)
+embeddings = ScheduledEmbeddings(settings.EMBEDDINGS_MODEL)
 
 # Initialize LanceDB
 db = lancedb.connect(settings.LANCE_DB_VECTOR_STORE_PERSISTS_DIRECTOY)
@@ -118,12 +118,10 @@ def add_documents(documents):
     logger.info(f"Added {len(documents)} documents to LanceDB table")
 
 
-def add_link_content_to_vector_store(
-        text_content, source, title, link_id, username):
-
+def build_link_documents(text_content, source, title, link_id, username):
     texts = chunk_link_content(text_content)
 
-    documents = [
+    return [
         Document(
             page_content=f"{title}\n\n{text}",
             metadata={
@@ -137,10 +135,40 @@ def add_link_content_to_vector_store(
         ) for i, text in enumerate(texts)
     ]
 
+
+def add_link_content_to_vector_store(
+        text_content, source, title, link_id, username):
+
+    documents = build_link_documents(
+        text_content, source, title, link_id, username)
+
     add_documents(documents)
     logger.info(f"processed: {source} with {title}")
 
 
+def add_links_content_to_vector_store(pages, username):
+    """
+    Batched variant of add_link_content_to_vector_store,
+    embeds chunks of all the pages in a single call.
+    pages: list of dicts with text_content, source, title and link_id
+    """
+    documents = []
+    for page in pages:
+        documents.extend(build_link_documents(
+            page["text_content"],
+            page["source"],
+            page["title"],
+            page["link_id"],
+            page.get("belongs_to", username)
+        ))
+
+    if not documents:
+        return
+
+    add_documents(documents)
+    logger.info(f"processed: {len(pages)} links with {len(documents)} chunks")
+
+
 def add_uploaded_document_content_to_vector_store(
         file_path, file_name, file_url, file_id, username):
 
@@ -176,27 +204,22 @@ def add_uploaded_document_content_to_vector_store(
     logger.info(f"processed: {file_name} with id={file_id}")
 
 
-def fetch_documents(
-        include_selected,
-        exclude_selected,
-        window_size,
-        username,
-        prompt,
-        source_type=None):
-
+def search_limit(window_size, source_type=None):
     if source_type == 'link':
-        window_size_modified = window_size * settings.WINDOW_SIZE_MULTIPLIER
-    else:
-        window_size_modified = window_size
+        return window_size * settings.WINDOW_SIZE_MULTIPLIER
+    return window_size
 
-    # Open the table
-    table = db.open_table(TABLE_NAME)
-
-    # Generate embedding for the query
-    query_embedding = embeddings.embed_query(prompt)
 
+def search_filter(
+        include_selected,
+        exclude_selected,
+        username,
+        source_type=None,
+        access=None):
     # Build filter expression for LanceDB
-    filter_conditions = [f"belongs_to = '{username}'"]
+    readers = ", ".join(
+        f"'{reader}'" for reader in [username, *(access or [])])
+    filter_conditions = [f"belongs_to IN ({readers})"]
 
     # Handle exclude_selected sources
     if exclude_selected and len(exclude_selected) > 0:
@@ -223,36 +246,168 @@ def fetch_documents(
         filter_conditions.append(f"source_type = '{source_type}'")
 
     # Combine all filter conditions
-    filter_expr = " AND ".join(filter_conditions)
+    return " AND ".join(filter_conditions)
 
-    logger.info(f"LanceDB filter expression: {filter_expr}")
 
-    # Perform similarity search
-    search_results = table.search(
-        query_embedding,
-        vector_column_name="vector"
-    ).where(filter_expr).limit(window_size_modified).to_pandas()
+def select_columns(columns=None, snippet_length=None):
+    # Never read the vectors back, the snippet is cut by lance
+    selected = {column: column for column in (columns or DOCUMENT_COLUMNS)}
+    if snippet_length is not None and "page_content" in selected:
+        selected["page_content"] = f"substr(page_content, 1, {snippet_length})"
+    return selected
 
-    # Process search results
+
+def result_documents(search_results):
     docs_with_scores = []
     for _, row in search_results.iterrows():
         # Create metadata dictionary
-        metadata = {k: v for k, v in row.items()
-                    if k not in ['vector', 'page_content', 'id'] and v is not None}
+        metadata = {
+            k: v for k, v in row.items()
+            if k not in ['page_content', '_distance', 'query_index']
+            and v is not None
+        }
 
         # Create Document object
         doc = Document(
-            page_content=row['page_content'],
+            page_content=row.get('page_content') or "",
             metadata=metadata
         )
 
         # Add to results with score (already in cosine similarity format)
         docs_with_scores.append((doc, row['_distance']))
+    return docs_with_scores
+
+
+def fetch_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type=None,
+        access=None,
+        columns=None,
+        snippet_length=None):
+    """
+    access: additional `belongs_to` values readable by the user,
+    i.e. keys of shared content referenced by the user
+    columns: stored columns to read, all of them when None
+    snippet_length: number of characters of page_content to return
+    """
+
+    # Open the table
+    table = db.open_table(TABLE_NAME)
+
+    # Generate embedding for the query
+    query_embedding = embeddings.embed_query(prompt)
+
+    filter_expr = search_filter(
+        include_selected, exclude_selected, username, source_type, access)
+
+    # Perform similarity search
+    search_results = table.search(
+        query_embedding,
+        vector_column_name="vector"
+    ).where(filter_expr).select(
+        select_columns(columns, snippet_length)
+    ).limit(search_limit(window_size, source_type)).to_pandas()
+
+    # Process search results
+    docs_with_scores = result_documents(search_results)
 
     logger.info(f"Found {len(docs_with_scores)} relevant documents")
     return docs_with_scores
 
 
+def iter_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type=None,
+        access=None,
+        columns=None,
+        snippet_length=None):
+    """
+    Same results as fetch_documents, searched in pages of growing size
+    so the first ones are available early and a consumer that stops
+    iterating saves the rest of the search
+    """
+    table = db.open_table(TABLE_NAME)
+    query_embedding = embeddings.embed_query(prompt)
+    filter_expr = search_filter(
+        include_selected, exclude_selected, username, source_type, access)
+    selected = select_columns(columns, snippet_length)
+
+    limit = search_limit(window_size, source_type)
+    offset = 0
+    page_size = settings.SEARCH_STREAM_PAGE_SIZE
+    while offset < limit:
+        end = min(limit, offset + page_size)
+        # The limit of lance counts the skipped rows too
+        docs = result_documents(table.search(
+            query_embedding,
+            vector_column_name="vector"
+        ).where(filter_expr).select(selected).limit(end).offset(
+            offset).to_pandas())
+        yield from docs
+
+        if len(docs) < end - offset:
+            return
+        offset = end
+        page_size *= 2
+
+
+def fetch_documents_batch(searches, username, access=None):
+    """
+    Results of several searches, each a dict of the keyword arguments
+    of fetch_documents. All prompts are embedded in one call, searches
+    with the same filter and columns run as one multi-vector query.
+    """
+    table = db.open_table(TABLE_NAME)
+    query_embeddings = embeddings.embed_queries(
+        [search["prompt"] for search in searches])
+
+    groups = {}
+    for index, search in enumerate(searches):
+        filter_expr = search_filter(
+            search.get("include_selected"),
+            search.get("exclude_selected"),
+            username,
+            search.get("source_type"),
+            access
+        )
+        key = (
+            filter_expr,
+            search_limit(search["window_size"], search.get("source_type")),
+            tuple(search.get("columns") or DOCUMENT_COLUMNS),
+            search.get("snippet_length")
+        )
+        groups.setdefault(key, []).append(index)
+
+    results = [[] for _ in searches]
+    for (filter_expr, limit, columns, snippet_length), indexes in groups.items():
+        vectors = [query_embeddings[index] for index in indexes]
+        search_results = table.search(
+            vectors if len(vectors) > 1 else vectors[0],
+            vector_column_name="vector"
+        ).where(filter_expr).select(
+            select_columns(list(columns), snippet_length)
+        ).limit(limit).to_pandas()
+
+        if len(vectors) == 1:
+            results[indexes[0]] = result_documents(search_results)
+            continue
+        # Rows of all vectors come together, told apart by query_index
+        for query_index, rows in search_results.groupby("query_index"):
+            results[indexes[query_index]] = result_documents(rows)
+
+    logger.info(
+        f"Ran {len(searches)} searches as {len(groups)} LanceDB queries")
+    return results
+
+
 def remove_documents(filename, username):
     try:
         # Open the table
@@ -309,3 +464,23 @@ def remove_link_documents(link_id, username):
         logger.error(
             f"Error removing documents with filename={link_id}: {str(err)}")
         return False
+
+
+def remove_content_documents(belongs_to):
+    """Remove all documents stored under the given owner key"""
+    try:
+        # Open the table
+        table = db.open_table(TABLE_NAME)
+
+        filter_expr = f"belongs_to = '{belongs_to}'"
+        count_before = table.count_rows(filter_expr)
+        table.delete(filter_expr)
+
+        logger.info(
+            f"Removed {count_before} documents belonging to {belongs_to}")
+        return count_before > 0
+
+    except Exception as err:
+        logger.error(
+            f"Error removing documents belonging to {belongs_to}: {str(err)}")
+        return False
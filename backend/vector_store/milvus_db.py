@@ -1,10 +1,10 @@
-from langchain_ollama import OllamaEmbeddings
 from langchain.schema import Document
 from pymilvus import MilvusClient, DataType
 import json
 import uuid
 from backend.config import settings
 from backend.core.logging import get_logger
+from backend.core.ollama_scheduler import ScheduledEmbeddings
 from backend.core.utils import (
     extract_text_from_pdf,
     is_file_pdf,
@@ -14,13 +14,13 @@ from backend.core.utils import (
     chunk_link_content
 )
 from backend.api.models import SourceType
+from backend.vector_store.models import DOCUMENT_COLUMNS
 
 
 logger = get_logger()
 
 # Initialize embeddings
-embeddings = OllamaEmbeddings(
-    model=settings.EMBEDDINGS_MODEL, base_url=settings.OLLAMA_HOST)
+embeddings = ScheduledEmbeddings(settings.EMBEDDINGS_MODEL)
 
 db_path = settings.MILVUS_VECTOR_STORE_URL
 
@@ -149,12 +149,10 @@ def add_documents(documents):
     logger.info(f"Added {len(documents)} documents to Milvus collection")
 
 
-def add_link_content_to_vector_store(
-        text_content, source, title, link_id, username):
-
+def build_link_documents(text_content, source, title, link_id, username):
     texts = chunk_link_content(text_content)
 
-    documents = [
+    return [
         Document(
             page_content=f"{title}\n\n{text}",
             metadata={
@@ -168,10 +166,40 @@ def add_link_content_to_vector_store(
         ) for i, text in enumerate(texts)
     ]
 
+
+def add_link_content_to_vector_store(
+        text_content, source, title, link_id, username):
+
+    documents = build_link_documents(
+        text_content, source, title, link_id, username)
+
     add_documents(documents)
     logger.info(f"processed: {source} with {title}")
 
 
+def add_links_content_to_vector_store(pages, username):
+    """
+    Batched variant of add_link_content_to_vector_store,
+    embeds chunks of all the pages in a single call.
+    pages: list of dicts with text_content, source, title and link_id
+    """
+    documents = []
+    for page in pages:
+        documents.extend(build_link_documents(
+            page["text_content"],
+            page["source"],
+            page["title"],
+            page["link_id"],
+            page.get("belongs_to", username)
+        ))
+
+    if not documents:
+        return
+
+    add_documents(documents)
+    logger.info(f"processed: {len(pages)} links with {len(documents)} chunks")
+
+
 def add_uploaded_document_content_to_vector_store(
         file_path, file_name, file_url, file_id, username):
 
@@ -207,21 +235,21 @@ def add_uploaded_document_content_to_vector_store(
     logger.info(f"processed: {file_name} with id={file_id}")
 
 
-def fetch_documents(
+def search_limit(window_size, source_type=None):
+    if source_type == 'link':
+        return window_size * settings.WINDOW_SIZE_MULTIPLIER
+    return window_size
+
+
+def search_filter(
         include_selected,
         exclude_selected,
-        window_size,
         username,
-        prompt,
-        source_type=None):
-
-    if source_type == 'link':
-        window_size_modified = window_size * settings.WINDOW_SIZE_MULTIPLIER
-    else:
-        window_size_modified = window_size
-
+        source_type=None,
+        access=None):
     # Build filter expression for Milvus
-    filter_expr = f"belongs_to == '{username}'"
+    readers = json.dumps([username, *(access or [])])
+    filter_expr = f"belongs_to in {readers}"
 
     # Handle exclude_selected sources
     if exclude_selected and len(exclude_selected) > 0:
@@ -247,27 +275,14 @@ def fetch_documents(
     if source_type is not None:
         filter_expr = f"{filter_expr} && source_type == '{source_type}'"
 
-    logger.info(f"Milvus filter expression: {filter_expr}")
+    return filter_expr
 
-    # Generate embedding for the query
-    query_embedding = embeddings.embed_query(prompt)
-
-    print(query_embedding,  "qb")
-    # Perform similarity search
-    search_results = milvus_client.search(
-        collection_name=COLLECTION_NAME,
-        data=[query_embedding],
-        filter=filter_expr,
-        limit=window_size_modified,
-        output_fields=["page_content", "source", "page", "title", "filename",
-                       "belongs_to", "link_id", "file_id", "source_type"]
-    )
 
-    print(search_results, "sr..")
-    # Process search results
+def result_documents(search_results, index=0, snippet_length=None):
+    """Documents with scores of the index-th query vector"""
     docs_with_scores = []
-    if search_results and 'data' in search_results and len(search_results['data']) > 0:
-        results = json.loads(search_results['data'][0])
+    if search_results and 'data' in search_results and len(search_results['data']) > index:
+        results = json.loads(search_results['data'][index])
         for result in results:
             entity = result['entity']
 
@@ -277,17 +292,141 @@ def fetch_documents(
 
             # Create Document object
             doc = Document(
-                page_content=entity['page_content'],
+                page_content=entity.get('page_content', "")[:snippet_length],
                 metadata=metadata
             )
 
             # Add to results with score (1 - distance for cosine similarity)
             docs_with_scores.append((doc, 1 - result['distance']))
+    return docs_with_scores
+
+
+def fetch_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type=None,
+        access=None,
+        columns=None,
+        snippet_length=None):
+    """
+    access: additional `belongs_to` values readable by the user,
+    i.e. keys of shared content referenced by the user
+    columns: stored columns to read, all of them when None
+    snippet_length: number of characters of page_content to return
+    """
+
+    filter_expr = search_filter(
+        include_selected, exclude_selected, username, source_type, access)
+
+    # Generate embedding for the query
+    query_embedding = embeddings.embed_query(prompt)
+
+    print(query_embedding,  "qb")
+    # Perform similarity search
+    search_results = milvus_client.search(
+        collection_name=COLLECTION_NAME,
+        data=[query_embedding],
+        filter=filter_expr,
+        limit=search_limit(window_size, source_type),
+        output_fields=columns or DOCUMENT_COLUMNS
+    )
+
+    print(search_results, "sr..")
+    # Process search results
+    docs_with_scores = result_documents(
+        search_results, snippet_length=snippet_length)
 
     logger.info(f"Found {len(docs_with_scores)} relevant documents")
     return docs_with_scores
 
 
+def iter_documents(
+        include_selected,
+        exclude_selected,
+        window_size,
+        username,
+        prompt,
+        source_type=None,
+        access=None,
+        columns=None,
+        snippet_length=None):
+    """
+    Same results as fetch_documents, searched in pages of growing size
+    so the first ones are available early and a consumer that stops
+    iterating saves the rest of the search
+    """
+    query_embedding = embeddings.embed_query(prompt)
+    filter_expr = search_filter(
+        include_selected, exclude_selected, username, source_type, access)
+
+    limit = search_limit(window_size, source_type)
+    offset = 0
+    page_size = settings.SEARCH_STREAM_PAGE_SIZE
+    while offset < limit:
+        size = min(page_size, limit - offset)
+        docs = result_documents(milvus_client.search(
+            collection_name=COLLECTION_NAME,
+            data=[query_embedding],
+            filter=filter_expr,
+            limit=size,
+            offset=offset,
+            output_fields=columns or DOCUMENT_COLUMNS
+        ), snippet_length=snippet_length)
+        yield from docs
+
+        if len(docs) < size:
+            return
+        offset += size
+        page_size *= 2
+
+
+def fetch_documents_batch(searches, username, access=None):
+    """
+    Results of several searches, each a dict of the keyword arguments
+    of fetch_documents. All prompts are embedded in one call, searches
+    with the same filter and columns run as one multi-vector query.
+    """
+    query_embeddings = embeddings.embed_queries(
+        [search["prompt"] for search in searches])
+
+    groups = {}
+    for index, search in enumerate(searches):
+        filter_expr = search_filter(
+            search.get("include_selected"),
+            search.get("exclude_selected"),
+            username,
+            search.get("source_type"),
+            access
+        )
+        key = (
+            filter_expr,
+            search_limit(search["window_size"], search.get("source_type")),
+            tuple(search.get("columns") or DOCUMENT_COLUMNS),
+            search.get("snippet_length")
+        )
+        groups.setdefault(key, []).append(index)
+
+    results = [[] for _ in searches]
+    for (filter_expr, limit, columns, snippet_length), indexes in groups.items():
+        search_results = milvus_client.search(
+            collection_name=COLLECTION_NAME,
+            data=[query_embeddings[index] for index in indexes],
+            filter=filter_expr,
+            limit=limit,
+            output_fields=list(columns)
+        )
+        for query_index, index in enumerate(indexes):
+            results[index] = result_documents(
+                search_results, query_index, snippet_length)
+
+    logger.info(
+        f"Ran {len(searches)} searches as {len(groups)} Milvus queries")
+    return results
+
+
 def remove_documents(filename, username):
     try:
         # Build explicit filter expression for Milvus
@@ -338,3 +477,21 @@ def remove_link_documents(link_id, username):
         logger.error(
             f"Error removing documents with link_id={link_id}: {str(err)}")
         return False
+
+
+def remove_content_documents(belongs_to):
+    """Remove all documents stored under the given owner key"""
+    try:
+        result = milvus_client.delete(
+            collection_name=COLLECTION_NAME,
+            filter=f"belongs_to == '{belongs_to}'"
+        )
+
+        count = result.get('delete_count', 0) if result else 0
+        logger.info(f"Removed {count} documents belonging to {belongs_to}")
+        return count > 0
+
+    except Exception as err:
+        logger.error(
+            f"Error removing documents belonging to {belongs_to}: {str(err)}")
+        return False
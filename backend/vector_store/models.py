@@ -5,3 +5,10 @@ class StoreEngine(str, enum.Enum):
     CHROMA = "chroma_db"
     LANCE = "lance_db"
     MILVUS_LITE = "milvus_lite_db"
+
+
+# Columns stored with every chunk besides its vector
+DOCUMENT_COLUMNS = [
+    "page_content", "source", "page", "title", "filename",
+    "belongs_to", "link_id", "file_id", "source_type"
+]
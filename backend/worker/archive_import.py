@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import tarfile
+import uuid
+import zipfile
+
+from sqlalchemy import select, func, update
+
+from backend.api.models import (
+    FileUpload,
+    ImportJob,
+    Note,
+    ProcessingStatus,
+    SourceType,
+    User
+)
+from backend.config import settings
+from backend.core.logging import get_logger
+from backend.core.utils import sync_file
+from backend.database import async_session_maker
+from backend.worker.process_uploaded_file import file_processor_queue
+from backend.worker.resource_counts import adjust_count
+from backend.worker.dispatch import dispatch_jobs, abandoned
+
+logger = get_logger()
+
+# Create a queue for background processing
+archive_import_queue = asyncio.Queue()
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_path_for(job_id):
+    return os.path.join(settings.UPLOAD_PARTS_DIR, f"import-{job_id}")
+
+
+def is_supported_archive(archive_path):
+    return zipfile.is_zipfile(archive_path) or tarfile.is_tarfile(archive_path)
+
+
+def is_wanted_entry(name):
+    parts = [part for part in name.replace("\\", "/").split("/") if part]
+    if any(part.startswith(".") or part == "__MACOSX" for part in parts):
+        return False
+    extension = os.path.splitext(name)[1].lower()
+    return extension in settings.IMPORT_FILE_EXTENSIONS
+
+
+def iter_archive_members(archive_path):
+    """
+    Yield (name, file object) for every regular file of the zip or tar
+    archive. Entries are read one after another, tar archives (also
+    compressed ones) in streaming mode.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as f:
+                    yield info.filename, f
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                yield member.name, archive.extractfile(member)
+
+
+class ArchiveReader:
+    """
+    Copies entries of an archive to the upload directory in batches.
+    Not thread safe, batches have to be read one after another.
+    """
+
+    def __init__(self, archive_path):
+        self.members = iter_archive_members(archive_path)
+        self.entries = 0
+        self.size = 0
+        self.skipped = 0
+        self.done = False
+
+    def store_entry(self, name, source):
+        original_filename = os.path.basename(name.replace("\\", "/"))
+        unique_filename = f"{uuid.uuid4()}-{original_filename}"
+        file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
+
+        digest = hashlib.sha256()
+        try:
+            with open(file_path, "wb") as f:
+                for chunk in iter(
+                        lambda: source.read(settings.FILE_WRITE_CHUNK_SIZE), b""):
+                    self.size += len(chunk)
+                    if self.size > settings.IMPORT_MAX_BYTES:
+                        raise ArchiveError(
+                            f"Archive is larger than {settings.IMPORT_MAX_BYTES} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+                sync_file(f)
+        except Exception:
+            os.remove(file_path)
+            raise
+
+        return {
+            "original_filename": original_filename,
+            "unique_filename": unique_filename,
+            "file_path": file_path,
+            "content_hash": digest.hexdigest()
+        }
+
+    def read_batch(self, batch_size):
+        batch = []
+        try:
+            while len(batch) < batch_size:
+                try:
+                    name, source = next(self.members)
+                except StopIteration:
+                    self.done = True
+                    break
+
+                if not is_wanted_entry(name):
+                    self.skipped += 1
+                    continue
+
+                self.entries += 1
+                if self.entries > settings.IMPORT_MAX_ENTRIES:
+                    raise ArchiveError(
+                        f"Archive has more than {settings.IMPORT_MAX_ENTRIES} entries")
+                batch.append(self.store_entry(name, source))
+        except Exception:
+            # Entries of the batch have no rows yet, nothing else removes them
+            for entry in batch:
+                os.remove(entry["file_path"])
+            raise
+        return batch
+
+    def close(self):
+        self.members.close()
+
+
+async def register_entries(db, job, user, entries):
+    """
+    Create file and note rows of a batch of stored entries in one
+    transaction and queue them for processing. Files with the same
+    content as an existing file of the user are dropped.
+    """
+    hashes = [
+        entry["content_hash"] for entry in entries
+        if not entry["original_filename"].endswith(".md")
+    ]
+    result = await db.execute(
+        select(FileUpload.content_hash).where(
+            FileUpload.user_id == user.id,
+            FileUpload.content_hash.in_(hashes)
+        )
+    )
+    known_hashes = set(result.scalars().all())
+
+    rows = []
+    duplicates = []
+    for entry in entries:
+        unique_filename = entry["unique_filename"]
+        if entry["original_filename"].endswith(".md"):
+            row = Note(
+                url=f"/file/note/{unique_filename}",
+                title=entry["original_filename"],
+                filename=unique_filename,
+                file_path=entry["file_path"],
+                status=ProcessingStatus.PENDING,
+                user_id=user.id,
+                import_job_id=job.id
+            )
+            rows.append((row, row.url, SourceType.NOTE))
+            continue
+
+        if entry["content_hash"] in known_hashes:
+            duplicates.append(entry["file_path"])
+            continue
+        known_hashes.add(entry["content_hash"])
+
+        row = FileUpload(
+            filename=unique_filename,
+            original_filename=entry["original_filename"],
+            file_path=entry["file_path"],
+            file_url=f"/file/{unique_filename}",
+            status=ProcessingStatus.PENDING,
+            content_type=mimetypes.guess_type(entry["original_filename"])[0],
+            content_hash=entry["content_hash"],
+            user_id=user.id,
+            import_job_id=job.id
+        )
+        rows.append((row, row.file_url, SourceType.FILE))
+
+    db.add_all([row for row, _, _ in rows])
+    notes_added = sum(
+        1 for _, _, source_type in rows if source_type == SourceType.NOTE)
+    files_added = len(rows) - notes_added
+    job.notes_added += notes_added
+    job.files_added += files_added
+    job.duplicates += len(duplicates)
+    await adjust_count(db, user.id, SourceType.NOTE, notes_added)
+    await adjust_count(db, user.id, SourceType.FILE, files_added)
+    await db.commit()
+
+    for job_type in (SourceType.NOTE, SourceType.FILE):
+        await dispatch_jobs(
+            file_processor_queue,
+            job_type,
+            [
+                (row.file_path, row.filename, file_url, row.id,
+                 user.email, source_type.value, 1)
+                for row, file_url, source_type in rows
+                if source_type == job_type
+            ]
+        )
+
+    for file_path in duplicates:
+        await asyncio.to_thread(os.remove, file_path)
+
+
+async def import_archive(job_id):
+    archive_path = archive_path_for(job_id)
+    async with async_session_maker() as db:
+        job = await db.get(ImportJob, job_id)
+        if not job or job.status != ProcessingStatus.PENDING:
+            return
+        user = await db.get(User, job.user_id)
+
+        job.status = ProcessingStatus.IN_PROGRESS
+        await db.commit()
+
+        reader = ArchiveReader(archive_path)
+        try:
+            while not reader.done:
+                entries = await asyncio.to_thread(
+                    reader.read_batch, settings.IMPORT_BATCH_SIZE)
+                if entries:
+                    await register_entries(db, job, user, entries)
+                job.skipped = reader.skipped
+            job.status = ProcessingStatus.FINISHED
+        except Exception as err:
+            logger.error(f"Error importing archive of job {job_id}: {err}")
+            job.status = ProcessingStatus.FAILED
+            job.error = f"{type(err).__name__}: {err}"
+        finally:
+            await asyncio.to_thread(reader.close)
+            await asyncio.to_thread(os.remove, archive_path)
+
+        job.skipped = reader.skipped
+        await db.commit()
+        logger.info(
+            f"Imported archive {job.filename} for user {user.email}: "
+            f"{job.files_added} files, {job.notes_added} notes, "
+            f"{job.duplicates} duplicates, {job.skipped} skipped")
+
+
+async def process_archive_import_queue():
+    while True:
+        try:
+            job_id = await archive_import_queue.get()
+            # One archive at a time, file workers do the heavy lifting
+            try:
+                await import_archive(job_id)
+            finally:
+                archive_import_queue.task_done()
+        except Exception as e:
+            logger.error(f"Error in archive import queue: {str(e)}")
+            await asyncio.sleep(1)
+
+
+async def fail_interrupted_imports():
+    """Archives being imported by a stopped server are not resumed"""
+    async with async_session_maker() as db:
+        result = await db.execute(
+            update(ImportJob)
+            .where(
+                ImportJob.status.in_([
+                    ProcessingStatus.PENDING,
+                    ProcessingStatus.IN_PROGRESS
+                ]),
+                abandoned(ImportJob)
+            )
+            .values(
+                status=ProcessingStatus.FAILED,
+                error="Interrupted by server restart"
+            )
+            .returning(ImportJob.id)
+        )
+        job_ids = result.scalars().all()
+        await db.commit()
+
+    for job_id in job_ids:
+        if await asyncio.to_thread(os.path.exists, archive_path_for(job_id)):
+            await asyncio.to_thread(os.remove, archive_path_for(job_id))
+
+    if job_ids:
+        logger.info(
+            f"Marked {len(job_ids)} interrupted archive imports as failed")
+
+
+async def import_progress(db, job_id):
+    """Number of imported files and notes per processing status"""
+    progress = {status.value: 0 for status in ProcessingStatus}
+    for model in (FileUpload, Note):
+        result = await db.execute(
+            select(model.status, func.count())
+            .where(model.import_job_id == job_id)
+            .group_by(model.status)
+        )
+        for row_status, count in result.all():
+            progress[row_status] = progress.get(row_status, 0) + count
+    return progress
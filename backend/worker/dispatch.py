@@ -0,0 +1,247 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, update, or_, true
+
+from backend.api.models import (
+    CrawlJob,
+    CrawlStatus,
+    ImportJob,
+    ProcessingStatus,
+    QueuedJob,
+    SharedContent,
+    SourceType
+)
+from backend.config import settings
+from backend.core.logging import get_logger
+from backend.database import async_session_maker
+
+logger = get_logger()
+
+DATABASE_DISPATCH = "database"
+
+# Owner of the leases taken by this process
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Statuses of leased rows which are still being worked on
+LEASED_STATUSES = {
+    CrawlJob: [CrawlStatus.PENDING, CrawlStatus.RUNNING],
+    ImportJob: [ProcessingStatus.PENDING, ProcessingStatus.IN_PROGRESS],
+    SharedContent: [ProcessingStatus.IN_PROGRESS],
+}
+
+# Keep references to delayed and claimed jobs, otherwise
+# the event loop may garbage collect pending tasks
+_delayed_jobs = set()
+_claimed_jobs = set()
+
+
+def lease():
+    """Column values leasing a row to this process"""
+    return {
+        "claimed_by": WORKER_ID,
+        "claimed_until": datetime.utcnow() + timedelta(
+            seconds=settings.JOB_LEASE_SECONDS)
+    }
+
+
+def take_lease(row):
+    """Lease the model instance to this process"""
+    for column, value in lease().items():
+        setattr(row, column, value)
+
+
+def abandoned(model):
+    """
+    Condition of rows nobody works on anymore. With the memory dispatch
+    mode these are all of them at startup, with the database mode the
+    ones whose lease ran out.
+    """
+    if settings.JOB_DISPATCH_MODE != DATABASE_DISPATCH:
+        return true()
+    return or_(
+        model.claimed_until.is_(None),
+        model.claimed_until < datetime.utcnow()
+    )
+
+
+def put_later(queue, item, delay):
+    """Put the job on the queue after the given delay"""
+    async def _put():
+        await asyncio.sleep(delay)
+        await queue.put(item)
+
+    task = asyncio.create_task(_put())
+    _delayed_jobs.add(task)
+    task.add_done_callback(_delayed_jobs.discard)
+    return task
+
+
+async def dispatch_jobs(queue, job_type, items, delay=0):
+    """
+    Hand jobs over to the workers. With the memory dispatch mode they
+    go on the queue of this process, with the database mode they are
+    stored for whichever process claims them first.
+    """
+    if settings.JOB_DISPATCH_MODE != DATABASE_DISPATCH:
+        for item in items:
+            if delay:
+                put_later(queue, item, delay)
+            else:
+                queue.put_nowait(item)
+        return
+
+    if not items:
+        return
+    available_at = datetime.utcnow() + timedelta(seconds=delay)
+    async with async_session_maker() as db:
+        db.add_all([
+            QueuedJob(
+                job_type=SourceType(job_type).value,
+                payload=list(item),
+                available_at=available_at
+            )
+            for item in items
+        ])
+        await db.commit()
+
+
+async def dispatch_job(queue, job_type, item, delay=0):
+    await dispatch_jobs(queue, job_type, [item], delay)
+
+
+async def claim_jobs(db, job_types, limit):
+    """
+    Lease up to limit due jobs of the given types to this process and
+    return (id, payload) of them. Jobs leased by processes which died
+    are claimed again once their lease ran out. Rows locked by a
+    concurrent claim are skipped on PostgreSQL, sqlite runs one claim
+    at a time.
+    """
+    due = (
+        select(QueuedJob.id)
+        .where(
+            QueuedJob.job_type.in_(job_types),
+            QueuedJob.available_at <= datetime.utcnow(),
+            abandoned(QueuedJob)
+        )
+        .order_by(QueuedJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(QueuedJob)
+        .where(QueuedJob.id.in_(due.scalar_subquery()))
+        .values(**lease())
+        .returning(QueuedJob.id, QueuedJob.payload)
+    )
+    jobs = result.all()
+    await db.commit()
+    return jobs
+
+
+async def run_claimed_job(job_id, handler, payload, running, finished):
+    """Run the job, its row is only removed once it is done"""
+    try:
+        await handler(*payload)
+    except Exception as e:
+        logger.error(f"Error running queued job {job_id}: {str(e)}")
+    finally:
+        running[handler] -= 1
+        finished.set()
+
+    async with async_session_maker() as db:
+        await db.execute(
+            delete(QueuedJob)
+            .where(QueuedJob.id == job_id, QueuedJob.claimed_by == WORKER_ID)
+        )
+        await db.commit()
+
+
+async def process_queued_jobs(workers):
+    """
+    Claim stored jobs while the workers of this process have free
+    capacity. `workers` maps job types to (handler, capacity) of the
+    worker processing them: the coroutine function called with the
+    job payload and the number of jobs it runs at a time. Job types
+    with the same handler share its capacity.
+    """
+    groups = {}
+    for job_type, worker in workers.items():
+        groups.setdefault(worker, []).append(job_type.value)
+    running = {handler: 0 for handler, _ in groups}
+    finished = asyncio.Event()
+
+    while True:
+        try:
+            finished.clear()
+            backlog = False
+            for (handler, capacity), job_types in groups.items():
+                limit = min(
+                    capacity - running[handler], settings.JOB_CLAIM_BATCH_SIZE)
+                if limit <= 0:
+                    continue
+                async with async_session_maker() as db:
+                    jobs = await claim_jobs(db, job_types, limit)
+
+                for job_id, payload in jobs:
+                    running[handler] += 1
+                    task = asyncio.create_task(run_claimed_job(
+                        job_id, handler, payload, running, finished))
+                    _claimed_jobs.add(task)
+                    task.add_done_callback(_claimed_jobs.discard)
+                backlog = backlog or (
+                    len(jobs) == limit and running[handler] < capacity)
+
+            # Keep claiming while there is a backlog, otherwise until
+            # the next interval or until a job finishes
+            if not backlog:
+                try:
+                    await asyncio.wait_for(
+                        finished.wait(), settings.JOB_CLAIM_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"Error claiming queued jobs: {str(e)}")
+            await asyncio.sleep(settings.JOB_CLAIM_INTERVAL)
+
+
+async def renew_leases():
+    """Extend the leases of everything this process is working on"""
+    async with async_session_maker() as db:
+        await db.execute(
+            update(QueuedJob)
+            .where(QueuedJob.claimed_by == WORKER_ID)
+            .values(**lease())
+        )
+        for model, statuses in LEASED_STATUSES.items():
+            await db.execute(
+                update(model)
+                .where(
+                    model.claimed_by == WORKER_ID,
+                    model.status.in_(statuses)
+                )
+                # Not an update of the row as far as users are concerned
+                .values(updated_at=model.updated_at, **lease())
+            )
+        await db.commit()
+
+
+async def maintain_leases(recoveries):
+    """
+    Keep the leases of this process and recover the work of processes
+    whose leases ran out, with the given coroutine functions
+    """
+    while True:
+        try:
+            await renew_leases()
+            for recover in recoveries:
+                await recover()
+        except Exception as e:
+            logger.error(f"Error maintaining job leases: {str(e)}")
+        await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
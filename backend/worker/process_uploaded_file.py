@@ -1,11 +1,13 @@
 import asyncio
 
-from backend.api.models import FileUpload, ProcessingStatus, Note
+from backend.api.models import FileUpload, ProcessingStatus, Note, SourceType
 from backend.vector_store.adapter import vector_db
 from backend.core.logging import get_logger
 from backend.database import async_session_maker
-from sqlalchemy import select, func
+from sqlalchemy import select
 from backend.config import settings
+from backend.worker.retry import handle_job_failure
+from backend.worker.shared_content import store_shared_content, hash_file
 
 vector_store = vector_db()
 
@@ -22,14 +24,15 @@ async def process_uploaded_file_queue():
     while True:
         try:
             # Get an item from the queue
-            file_path, file_name, file_url, file_id, user_email, source_type = await file_processor_queue.get()
+            file_path, file_name, file_url, file_id, user_email, source_type, attempt = await file_processor_queue.get()
 
             # Process the URL in a separate task to avoid blocking the queue
-            asyncio.create_task(process_file(
-                file_path, file_name, file_url, file_id, user_email, source_type))
+            task = asyncio.create_task(process_file(
+                file_path, file_name, file_url, file_id, user_email, source_type, attempt))
 
-            # Mark the queue task as done
-            # file_processor_queue.task_done()
+            # Mark the queue task as done once it is processed, jobs
+            # claimed from the database never went through the queue
+            task.add_done_callback(lambda _: file_processor_queue.task_done())
 
         except Exception as e:
             logger.error(f"Error in URL processing queue: {str(e)}")
@@ -43,20 +46,13 @@ async def process_file(
         file_url,
         file_id,
         user_email,
-        source_type):
+        source_type,
+        attempt=1):
     # Acquire the semaphore to limit concurrency
     async with concurrency_limit:
         async with async_session_maker() as db:
+            file_row = None
             try:
-                await asyncio.to_thread(
-                    vector_store.add_uploaded_document_content_to_vector_store,
-                    file_path,
-                    file_name,
-                    file_url,
-                    file_id,
-                    user_email
-                )
-
                 if source_type == "note":
                     stmt = select(Note).where(Note.id == file_id)
                 else:
@@ -64,13 +60,67 @@ async def process_file(
                 result = await db.execute(stmt)
                 file_row = result.scalars().first()
 
-                file_row.status = ProcessingStatus.FINISHED
-                file_row.updated_at = func.now()
+                if not file_row:
+                    logger.error(
+                        f"{source_type} with ID {file_id} not found")
+                    return
+
+                # A previous attempt may have stored some chunks already
+                if attempt > 1:
+                    await asyncio.to_thread(
+                        vector_store.remove_documents, file_name, user_email)
+
+                def embed(belongs_to):
+                    vector_store.add_uploaded_document_content_to_vector_store(
+                        file_path, file_name, file_url, file_id, belongs_to)
+
+                embedded = True
+                if source_type == SourceType.NOTE:
+                    # Notes are edited in place, they are never shared
+                    await asyncio.to_thread(embed, user_email)
+                else:
+                    content_hash = file_row.content_hash
+                    if not content_hash:
+                        content_hash = await asyncio.to_thread(
+                            hash_file, file_path)
+                    embedded = await store_shared_content(
+                        db,
+                        file_row,
+                        content_hash,
+                        SourceType.FILE,
+                        file_url,
+                        file_name,
+                        embed
+                    )
+
+                # Files reusing content get its status along with it
+                if embedded:
+                    file_row.status = ProcessingStatus.FINISHED
                 await db.commit()
 
-                file_processor_queue.task_done()
                 logger.info(
                     f"Successfully processed File: {file_name} for user {user_email}")
             except Exception as e:
                 logger.error(
                     f"Error Processing file: {file_name} for user {user_email}: {str(e)}")
+                # Either retry later or move the job to dead-letter
+                try:
+                    if file_row:
+                        await handle_job_failure(
+                            db,
+                            file_row,
+                            SourceType(source_type),
+                            {
+                                "file_path": file_path,
+                                "file_name": file_name,
+                                "file_url": file_url
+                            },
+                            attempt,
+                            e,
+                            file_processor_queue,
+                            (file_path, file_name, file_url, file_id,
+                             user_email, source_type, attempt + 1)
+                        )
+                except Exception as err:
+                    logger.error(
+                        f"Error recording failure of file {file_name}: {str(err)}")
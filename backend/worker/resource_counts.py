@@ -0,0 +1,64 @@
+from sqlalchemy import select, update, func, literal
+
+from backend.api.models import (
+    FileUpload,
+    Link,
+    Note,
+    ResourceCount,
+    SourceType
+)
+from backend.database import insert
+
+RESOURCE_MODELS = {
+    SourceType.FILE: FileUpload,
+    SourceType.LINK: Link,
+    SourceType.NOTE: Note,
+}
+
+
+async def adjust_count(db, user_id, resource, delta):
+    """
+    Add delta to the number of links, files or notes of the user.
+    Runs in the caller's transaction, nothing is committed. Counts
+    which were never loaded are left alone, they are computed from
+    the rows once needed.
+    """
+    if not delta:
+        return
+    await db.execute(
+        update(ResourceCount)
+        .where(
+            ResourceCount.user_id == user_id,
+            ResourceCount.resource == resource
+        )
+        .values(count=ResourceCount.count + delta)
+    )
+
+
+async def get_count(db, user_id, resource):
+    """Number of links, files or notes of the user"""
+    result = await db.execute(
+        select(ResourceCount.count).where(
+            ResourceCount.user_id == user_id,
+            ResourceCount.resource == resource
+        )
+    )
+    count = result.scalar()
+    if count is not None:
+        return count
+
+    # Counted and stored in one statement, so no insert or delete
+    # can happen in between
+    model = RESOURCE_MODELS[resource]
+    await db.execute(
+        insert(ResourceCount)
+        .from_select(
+            ["user_id", "resource", "count"],
+            select(literal(user_id), literal(resource.value), func.count())
+            .select_from(model)
+            .where(model.user_id == user_id)
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "resource"])
+    )
+    await db.commit()
+    return await get_count(db, user_id, resource)
@@ -0,0 +1,134 @@
+import asyncio
+import random
+from dataclasses import dataclass
+
+import aiohttp
+import httpx
+import ollama
+from sqlalchemy import select
+
+from backend.api.models import (
+    DeadLetterJob,
+    ErrorKind,
+    ProcessingStatus,
+    SourceType
+)
+from backend.config import settings
+from backend.core.logging import get_logger
+from backend.worker.dispatch import dispatch_job
+
+logger = get_logger()
+
+# HTTP status codes which are worth retrying
+TRANSIENT_HTTP_STATUS = {408, 425, 429}
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+
+    def backoff(self, attempt):
+        """Exponential backoff with full jitter for the given attempt"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, delay)
+
+
+RETRY_POLICIES = {
+    SourceType.LINK: RetryPolicy(
+        max_attempts=settings.LINK_JOB_MAX_ATTEMPTS,
+        base_delay=settings.JOB_RETRY_BASE_DELAY,
+        max_delay=settings.JOB_RETRY_MAX_DELAY
+    ),
+    SourceType.FILE: RetryPolicy(
+        max_attempts=settings.FILE_JOB_MAX_ATTEMPTS,
+        base_delay=settings.JOB_RETRY_BASE_DELAY,
+        max_delay=settings.JOB_RETRY_MAX_DELAY
+    ),
+    SourceType.NOTE: RetryPolicy(
+        max_attempts=settings.FILE_JOB_MAX_ATTEMPTS,
+        base_delay=settings.JOB_RETRY_BASE_DELAY,
+        max_delay=settings.JOB_RETRY_MAX_DELAY
+    ),
+}
+
+
+def is_transient_status(status_code):
+    return status_code >= 500 or status_code in TRANSIENT_HTTP_STATUS
+
+
+def classify_error(err):
+    """Decide whether a failed job is worth retrying"""
+    if isinstance(err, aiohttp.ClientResponseError):
+        if is_transient_status(err.status):
+            return ErrorKind.TRANSIENT
+        return ErrorKind.PERMANENT
+
+    if isinstance(err, ollama.ResponseError):
+        if is_transient_status(err.status_code):
+            return ErrorKind.TRANSIENT
+        return ErrorKind.PERMANENT
+
+    # Timeouts and connection issues while fetching urls,
+    # or while talking to ollama for embeddings
+    if isinstance(err, (
+            asyncio.TimeoutError,
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+            httpx.TransportError,
+            ConnectionError)):
+        return ErrorKind.TRANSIENT
+
+    return ErrorKind.PERMANENT
+
+
+async def record_dead_letter(
+        db, job_type, resource_id, user_id, payload, attempts, err):
+    result = await db.execute(
+        select(DeadLetterJob).where(
+            DeadLetterJob.job_type == job_type,
+            DeadLetterJob.resource_id == resource_id
+        )
+    )
+    dead_letter = result.scalars().first()
+    if not dead_letter:
+        dead_letter = DeadLetterJob(
+            job_type=job_type,
+            resource_id=resource_id,
+            user_id=user_id
+        )
+        db.add(dead_letter)
+
+    dead_letter.payload = payload
+    dead_letter.attempts = attempts
+    dead_letter.error_kind = classify_error(err)
+    dead_letter.last_error = f"{type(err).__name__}: {err}"
+
+
+async def handle_job_failure(
+        db, row, job_type, payload, attempt, err, queue, item):
+    """
+    Either schedule another attempt of a failed job or move it
+    to the dead-letter table, and update the row status accordingly.
+    `item` is the queue entry to use for the next attempt.
+    """
+    policy = RETRY_POLICIES[job_type]
+    error_kind = classify_error(err)
+
+    if error_kind == ErrorKind.TRANSIENT and attempt < policy.max_attempts:
+        delay = policy.backoff(attempt)
+        row.status = ProcessingStatus.PENDING
+        await db.commit()
+        await dispatch_job(queue, job_type, item, delay)
+        logger.warning(
+            f"Retrying {job_type.value} job id={row.id} in {delay:.1f}s "
+            f"(attempt {attempt}/{policy.max_attempts}): {err}")
+        return
+
+    row.status = ProcessingStatus.FAILED
+    await record_dead_letter(
+        db, job_type, row.id, row.user_id, payload, attempt, err)
+    await db.commit()
+    logger.error(
+        f"Moved {job_type.value} job id={row.id} to dead-letter after "
+        f"{attempt} attempt(s) ({error_kind.value}): {err}")
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass, field
+
+from sqlalchemy import select, update, delete
+
+from backend.api.models import (
+    FileUpload,
+    Link,
+    ProcessingStatus,
+    SharedContent,
+    SourceType
+)
+from backend.vector_store.adapter import vector_db
+from backend.database import async_session_maker, insert
+from backend.worker.dispatch import abandoned, lease
+from backend.core.logging import get_logger
+
+vector_store = vector_db()
+
+logger = get_logger()
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Content which nobody is embedding at the moment
+CLAIMABLE_STATUSES = [ProcessingStatus.PENDING, ProcessingStatus.FAILED]
+
+
+def content_key(content_id):
+    """`belongs_to` value of the chunks of a shared content"""
+    return f"content:{content_id}"
+
+
+def hash_text(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def acquire_content(
+        db, row, content_hash, source_type, source, title=None):
+    """
+    Point the link or file row to the shared content with the given
+    hash, creating the content if needed. Nothing is committed, the
+    caller commits and then releases the previously referenced content.
+    Returns (content, claimed, previous_content_id) where claimed tells
+    whether the caller is responsible for embedding the content.
+    """
+    await db.execute(
+        insert(SharedContent)
+        .values(
+            content_hash=content_hash,
+            source_type=source_type,
+            ref_count=0,
+            status=ProcessingStatus.PENDING
+        )
+        .on_conflict_do_nothing(index_elements=["content_hash"])
+    )
+    result = await db.execute(
+        select(SharedContent)
+        .where(SharedContent.content_hash == content_hash)
+        .execution_options(populate_existing=True)
+    )
+    content = result.scalars().first()
+    previous_status = content.status
+
+    previous_content_id = None
+    if row.content_id != content.id:
+        previous_content_id = row.content_id
+        row.content_id = content.id
+        await db.execute(
+            update(SharedContent)
+            .where(SharedContent.id == content.id)
+            .values(ref_count=SharedContent.ref_count + 1)
+        )
+
+    # Only one of the rows sharing the content gets to embed it
+    result = await db.execute(
+        update(SharedContent)
+        .where(
+            SharedContent.id == content.id,
+            SharedContent.status.in_(CLAIMABLE_STATUSES)
+        )
+        .values(
+            status=ProcessingStatus.IN_PROGRESS,
+            source=source,
+            title=title,
+            **lease()
+        )
+    )
+    claimed = result.rowcount == 1
+
+    # Failed or interrupted attempt may have stored some chunks already
+    if claimed and previous_status == ProcessingStatus.FAILED:
+        await asyncio.to_thread(
+            vector_store.remove_content_documents, content_key(content.id))
+
+    return content, claimed, previous_content_id
+
+
+async def set_content_status(db, content_id, status):
+    """Status of the shared content and of the links and files using it"""
+    await db.execute(
+        update(SharedContent)
+        .where(SharedContent.id == content_id)
+        .values(status=status)
+    )
+    for model in (Link, FileUpload):
+        await db.execute(
+            update(model)
+            .where(model.content_id == content_id)
+            .values(status=status)
+        )
+
+
+async def take_content_status(db, row):
+    """
+    Give a row reusing content embedded for another row the status
+    of that content, it is updated along when the content is done
+    """
+    model = type(row)
+    await db.execute(
+        update(model)
+        .where(model.id == row.id)
+        .values(status=(
+            select(SharedContent.status)
+            .where(SharedContent.id == row.content_id)
+            .scalar_subquery()
+        ))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def release_content(db, content_id):
+    """
+    Drop a reference to the shared content, the content and its
+    chunks are removed along with the last reference.
+    """
+    await db.execute(
+        update(SharedContent)
+        .where(SharedContent.id == content_id)
+        .values(ref_count=SharedContent.ref_count - 1)
+    )
+    result = await db.execute(
+        delete(SharedContent)
+        .where(SharedContent.id == content_id, SharedContent.ref_count <= 0)
+    )
+    await db.commit()
+
+    if result.rowcount:
+        await asyncio.to_thread(
+            vector_store.remove_content_documents, content_key(content_id))
+        logger.info(f"Removed shared content id={content_id}")
+
+
+async def store_shared_content(
+        db, row, content_hash, source_type, source, title, embed):
+    """
+    Reference the shared content for the row and embed it, unless
+    the same content is already stored (or being stored) for another
+    link or file. `embed(belongs_to)` is run in a thread and stores
+    the chunks under the given owner key.
+    Returns True if the content was embedded, otherwise the row has
+    taken the status of the content.
+    """
+    content, claimed, previous_content_id = await acquire_content(
+        db, row, content_hash, source_type, source, title)
+    await db.commit()
+
+    if previous_content_id:
+        await release_content(db, previous_content_id)
+
+    if not claimed:
+        logger.info(
+            f"Reusing shared content id={content.id} for {source}")
+        await take_content_status(db, row)
+        await db.commit()
+        return False
+
+    try:
+        await asyncio.to_thread(embed, content_key(content.id))
+    except Exception:
+        await set_content_status(db, content.id, ProcessingStatus.FAILED)
+        await db.commit()
+        raise
+
+    await set_content_status(db, content.id, ProcessingStatus.FINISHED)
+    await db.commit()
+    return True
+
+
+async def reset_interrupted_contents():
+    """
+    Content being embedded by a stopped server will never be
+    finished, make it claimable again.
+    """
+    async with async_session_maker() as db:
+        result = await db.execute(
+            update(SharedContent)
+            .where(
+                SharedContent.status == ProcessingStatus.IN_PROGRESS,
+                abandoned(SharedContent)
+            )
+            .values(status=ProcessingStatus.FAILED)
+        )
+        await db.commit()
+
+    if result.rowcount:
+        logger.info(f"Reset {result.rowcount} interrupted shared contents")
+
+
+@dataclass
+class SharedAccess:
+    """Shared contents referenced by a user"""
+    username: str
+    # Content key -> metadata of the user's own link or file
+    metadata: dict = field(default_factory=dict)
+    # Source of the user's link or file -> source stored with the chunks
+    sources: dict = field(default_factory=dict)
+
+    @property
+    def keys(self):
+        return list(self.metadata)
+
+    def translate_sources(self, sources):
+        if not sources:
+            return sources
+        return list(dict.fromkeys(
+            self.sources.get(source, source) for source in sources))
+
+    def remap(self, doc):
+        """Present a shared chunk as part of the user's own resource"""
+        metadata = self.metadata.get(doc.metadata.get("belongs_to"))
+        if metadata:
+            doc.metadata.update(metadata)
+        return doc
+
+
+async def load_shared_access(db, user, sources=None, source_type=None):
+    """
+    Shared contents the user may search, only those of the given
+    sources and source type when the search is limited to them
+    """
+    access = SharedAccess(username=user.email)
+    references = {}
+    user_sources = {}
+
+    if source_type in (None, SourceType.LINK):
+        query = select(Link.id, Link.url, Link.title, Link.content_id).where(
+            Link.user_id == user.id, Link.content_id.isnot(None))
+        if sources:
+            query = query.where(Link.url.in_(sources))
+        result = await db.execute(query)
+        for link_id, url, title, content_id in result.all():
+            user_sources.setdefault(content_id, []).append(url)
+            references.setdefault(content_id, {
+                "source": url,
+                "title": title,
+                "link_id": f"{link_id}",
+                "belongs_to": user.email
+            })
+
+    if source_type in (None, SourceType.FILE):
+        query = select(
+            FileUpload.id,
+            FileUpload.filename,
+            FileUpload.file_url,
+            FileUpload.content_id
+        ).where(
+            FileUpload.user_id == user.id, FileUpload.content_id.isnot(None))
+        if sources:
+            query = query.where(FileUpload.file_url.in_(sources))
+        result = await db.execute(query)
+        for file_id, filename, file_url, content_id in result.all():
+            user_sources.setdefault(content_id, []).append(file_url)
+            references.setdefault(content_id, {
+                "source": file_url,
+                "filename": filename,
+                "file_id": f"{file_id}",
+                "belongs_to": user.email
+            })
+
+    if not references:
+        return access
+
+    result = await db.execute(
+        select(SharedContent.id, SharedContent.source)
+        .where(SharedContent.id.in_(list(references)))
+    )
+    for content_id, source in result.all():
+        access.metadata[content_key(content_id)] = references[content_id]
+        for user_source in user_sources[content_id]:
+            access.sources[user_source] = source
+
+    return access
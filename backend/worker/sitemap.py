@@ -0,0 +1,260 @@
+import re
+import zlib
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+import aiohttp
+from sqlalchemy import select
+
+from backend.api.models import SitemapEntry, SourceType
+from backend.config import settings
+from backend.core.logging import get_logger
+from backend.core.utils import normalize_url
+from backend.worker.url_processor import (
+    url_processing_queue,
+    upsert_links,
+    LinkAction
+)
+from backend.worker.dispatch import dispatch_jobs
+
+logger = get_logger()
+
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 64 * 1024
+
+
+class SitemapError(Exception):
+    pass
+
+
+def local_name(tag):
+    """Tag name without the xml namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_lastmod(value):
+    """Parse W3C datetime of a sitemap entry into naive UTC datetime"""
+    if not value:
+        return None
+    try:
+        lastmod = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if lastmod.tzinfo:
+        lastmod = lastmod.astimezone(timezone.utc).replace(tzinfo=None)
+    return lastmod
+
+
+def read_sitemap_events(parser):
+    """
+    Yield (is_index, loc, lastmod) for every <url> or <sitemap>
+    element parsed so far, and free the parsed elements.
+    """
+    for _, elem in parser.read_events():
+        name = local_name(elem.tag)
+        if name not in ("url", "sitemap"):
+            continue
+
+        loc = None
+        lastmod = None
+        for child in elem:
+            child_name = local_name(child.tag)
+            if child_name == "loc":
+                loc = (child.text or "").strip()
+            elif child_name == "lastmod":
+                lastmod = parse_lastmod(child.text)
+        elem.clear()
+
+        if loc:
+            yield name == "sitemap", loc, lastmod
+
+
+async def iter_sitemap_urls(session, url, depth=0):
+    """
+    Stream and parse the sitemap (or sitemap index) at the given url,
+    yielding (loc, lastmod) of its pages. Gzip compressed sitemaps
+    are decompressed on the fly.
+    """
+    parser = ElementTree.XMLPullParser(events=("end",))
+    decompressor = None
+    size = 0
+    child_sitemaps = []
+
+    async with session.get(url, allow_redirects=True) as response:
+        if response.status != 200:
+            raise aiohttp.ClientResponseError(
+                response.request_info,
+                response.history,
+                status=response.status,
+                message=f"HTTP status {response.status}"
+            )
+
+        first_chunk = True
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if first_chunk:
+                first_chunk = False
+                if chunk.startswith(GZIP_MAGIC):
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+
+            size += len(chunk)
+            if size > settings.SITEMAP_MAX_BYTES:
+                raise SitemapError(f"Sitemap {url} is too large")
+
+            parser.feed(chunk)
+            for is_index, loc, lastmod in read_sitemap_events(parser):
+                if is_index:
+                    child_sitemaps.append(loc)
+                else:
+                    yield loc, lastmod
+
+        if decompressor:
+            parser.feed(decompressor.flush())
+        parser.close()
+        for is_index, loc, lastmod in read_sitemap_events(parser):
+            if is_index:
+                child_sitemaps.append(loc)
+            else:
+                yield loc, lastmod
+
+    if child_sitemaps and depth >= settings.SITEMAP_MAX_DEPTH:
+        logger.warning(
+            f"Ignoring {len(child_sitemaps)} nested sitemaps of {url}")
+        return
+
+    for child_url in child_sitemaps:
+        try:
+            async for loc, lastmod in iter_sitemap_urls(
+                    session, child_url, depth + 1):
+                yield loc, lastmod
+        except Exception as err:
+            logger.error(f"Error reading sitemap {child_url}: {err}")
+
+
+def compile_patterns(patterns):
+    return [re.compile(pattern) for pattern in patterns or []]
+
+
+def is_wanted(url, lastmod, include, exclude, modified_since):
+    if include and not any(pattern.search(url) for pattern in include):
+        return False
+    if any(pattern.search(url) for pattern in exclude):
+        return False
+    if modified_since and lastmod and lastmod < modified_since:
+        return False
+    return True
+
+
+async def store_sitemap_batch(db, user, headers, batch, counts):
+    """
+    Add links for new sitemap entries and refresh the ones whose
+    lastmod changed since the previous import. Everything else is
+    skipped.
+    """
+    entries = {}
+    invalid = 0
+    for loc, lastmod in batch:
+        try:
+            entries[normalize_url(loc)] = (loc, lastmod)
+        except ValueError:
+            # Malformed <loc>, e.g. a port which is not a number
+            invalid += 1
+    counts["invalid"] += invalid
+    counts["skipped"] += len(batch) - invalid - len(entries)
+
+    result = await db.execute(
+        select(SitemapEntry).where(
+            SitemapEntry.user_id == user.id,
+            SitemapEntry.url.in_(list(entries))
+        )
+    )
+    known = {entry.url: entry for entry in result.scalars().all()}
+
+    new_urls = []
+    changed_urls = []
+    for url, (loc, lastmod) in entries.items():
+        entry = known.get(url)
+        if not entry:
+            new_urls.append(loc)
+        elif lastmod and lastmod != entry.lastmod:
+            changed_urls.append(loc)
+        else:
+            counts["skipped"] += 1
+
+    # Urls may already be known from other sources, those are
+    # only linked to the sitemap unless their lastmod changed
+    resolved = await upsert_links(db, user, new_urls)
+    resolved += await upsert_links(db, user, changed_urls, refresh=True)
+
+    jobs = []
+    for link, action in resolved:
+        _, lastmod = entries[link.normalized_url]
+        entry = known.get(link.normalized_url)
+        if not entry:
+            entry = SitemapEntry(url=link.normalized_url, user_id=user.id)
+            db.add(entry)
+        entry.lastmod = lastmod
+        entry.link_id = link.id
+
+        if action == LinkAction.CREATED:
+            counts["enqueued"] += 1
+        elif action == LinkAction.REFRESHED:
+            counts["refreshed"] += 1
+        else:
+            counts["skipped"] += 1
+            continue
+        jobs.append((link.id, link.url, user.email, headers, 1))
+    await db.commit()
+
+    await dispatch_jobs(url_processing_queue, SourceType.LINK, jobs)
+
+
+async def import_sitemap(
+        db,
+        user,
+        url,
+        headers,
+        include_patterns=None,
+        exclude_patterns=None,
+        modified_since=None):
+    include = compile_patterns(include_patterns)
+    exclude = compile_patterns(exclude_patterns)
+    if modified_since and modified_since.tzinfo:
+        modified_since = modified_since.astimezone(
+            timezone.utc).replace(tzinfo=None)
+
+    counts = {
+        "discovered": 0,
+        "enqueued": 0,
+        "refreshed": 0,
+        "skipped": 0,
+        "invalid": 0
+    }
+    batch = []
+
+    timeout = aiohttp.ClientTimeout(total=settings.SITEMAP_REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(
+            headers=headers, timeout=timeout) as session:
+        async for loc, lastmod in iter_sitemap_urls(session, url):
+            if counts["discovered"] >= settings.SITEMAP_MAX_URLS:
+                logger.warning(
+                    f"Sitemap {url} has more than "
+                    f"{settings.SITEMAP_MAX_URLS} urls, ignoring the rest")
+                break
+            counts["discovered"] += 1
+
+            if not is_wanted(loc, lastmod, include, exclude, modified_since):
+                counts["skipped"] += 1
+                continue
+
+            batch.append((loc, lastmod))
+            if len(batch) >= settings.SITEMAP_BATCH_SIZE:
+                await store_sitemap_batch(db, user, headers, batch, counts)
+                batch = []
+
+    if batch:
+        await store_sitemap_batch(db, user, headers, batch, counts)
+
+    logger.info(f"Imported sitemap {url} for user {user.email}: {counts}")
+    return counts
@@ -1,14 +1,19 @@
 import asyncio
 import aiohttp
+import enum
 from bs4 import BeautifulSoup
 
-from backend.api.models import Link, ProcessingStatus
+from backend.api.models import Link, ProcessingStatus, SourceType
 from backend.vector_store.adapter import vector_db
 from backend.core.logging import get_logger
+from backend.core.utils import normalize_url
 from urllib.parse import urlparse
-from backend.database import async_session_maker
+from backend.database import async_session_maker, insert
 from sqlalchemy import select
 from backend.config import settings
+from backend.worker.retry import handle_job_failure
+from backend.worker.shared_content import store_shared_content, hash_text
+from backend.worker.resource_counts import adjust_count
 
 
 vector_store = vector_db()
@@ -20,6 +25,102 @@ logger = get_logger()
 url_processing_queue = asyncio.Queue()
 concurrency_limit = asyncio.Semaphore(settings.LINKS_JOB_QUEUE_CONCURRENCY)
 
+# Links which are already queued or being fetched
+IN_FLIGHT_STATUSES = {ProcessingStatus.PENDING, ProcessingStatus.IN_PROGRESS}
+
+
+class LinkAction(str, enum.Enum):
+    CREATED = "created"
+    # Finished or failed link is fetched again
+    REFRESHED = "refreshed"
+    # Duplicate of a link which is still queued or being fetched
+    ATTACHED = "attached"
+    # Duplicate of a finished link
+    MERGED = "merged"
+
+
+async def upsert_links(
+        db, user, urls, refresh=False, status=ProcessingStatus.PENDING):
+    """
+    Resolve urls against the existing links of the user by their
+    normalized url. New urls are inserted with the given status,
+    failed links (and finished ones when refresh is set) are reset
+    to it and lose their stored chunks, other duplicates are left
+    alone. Returns (link, action) for every distinct url, the caller
+    is responsible for processing created and refreshed links.
+    """
+    wanted = {}
+    for url in urls:
+        wanted.setdefault(normalize_url(url), url)
+    if not wanted:
+        return []
+
+    result = await db.execute(
+        select(Link).where(
+            Link.user_id == user.id,
+            Link.normalized_url.in_(list(wanted))
+        )
+    )
+    existing = {link.normalized_url: link for link in result.scalars().all()}
+
+    created_ids = set()
+    missing = [key for key in wanted if key not in existing]
+    if missing:
+        # Urls submitted concurrently by another request are skipped
+        # here and picked up as existing links below
+        stmt = (
+            insert(Link)
+            .values([
+                {
+                    "url": wanted[key],
+                    "normalized_url": key,
+                    "user_id": user.id,
+                    "status": status
+                }
+                for key in missing
+            ])
+            .on_conflict_do_nothing(
+                index_elements=["user_id", "normalized_url"])
+            .returning(Link.id)
+        )
+        result = await db.execute(stmt)
+        created_ids = set(result.scalars().all())
+        await adjust_count(db, user.id, SourceType.LINK, len(created_ids))
+
+        result = await db.execute(
+            select(Link).where(
+                Link.user_id == user.id,
+                Link.normalized_url.in_(missing)
+            )
+        )
+        for link in result.scalars().all():
+            existing[link.normalized_url] = link
+
+    resolved = []
+    refreshed = []
+    for key in wanted:
+        link = existing[key]
+        if link.id in created_ids:
+            action = LinkAction.CREATED
+        elif link.status in IN_FLIGHT_STATUSES:
+            action = LinkAction.ATTACHED
+        elif refresh or link.status == ProcessingStatus.FAILED:
+            action = LinkAction.REFRESHED
+            link.status = status
+            refreshed.append(link)
+        else:
+            action = LinkAction.MERGED
+        resolved.append((link, action))
+    await db.commit()
+
+    # Drop chunks of outdated content, fresh ones replace them
+    for link in refreshed:
+        await asyncio.to_thread(
+            vector_store.remove_link_documents, link.id, user.email)
+
+    return resolved
+
+
 # Helper function to get base URL
 
 
@@ -32,29 +133,22 @@ async def process_url_queue():
     while True:
         try:
             # Get an item from the queue
-            link_id, url, user_email, headers = await url_processing_queue.get()
+            link_id, url, user_email, headers, attempt = await url_processing_queue.get()
 
             # Process the URL in a separate task to avoid blocking the queue
-            asyncio.create_task(process_single_url(
-                link_id, url, user_email, headers))
+            task = asyncio.create_task(process_single_url(
+                link_id, url, user_email, headers, attempt))
 
-            # Mark the queue task as done
-            # url_processing_queue.task_done()
+            # Mark the queue task as done once it is processed, jobs
+            # claimed from the database never went through the queue
+            task.add_done_callback(lambda _: url_processing_queue.task_done())
 
         except Exception as e:
             logger.error(f"Error in URL processing queue: {str(e)}")
             await asyncio.sleep(1)  # P
 
 
-def extract_metadata_from_html(html_content, base_url):
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    text = soup.get_text()
-
-    # Extract title
-    title = soup.title.string if soup.title else None
-
-    # Extract favicon
+def extract_favicon(soup, base_url):
     favicon = None
     favicon_link = soup.find('link', rel=lambda r: r and (
         'icon' in r.lower() or 'shortcut icon' in r.lower()))
@@ -66,18 +160,57 @@ def extract_metadata_from_html(html_content, base_url):
         else:
             favicon = favicon_url
 
+    return favicon
+
+
+def extract_metadata_from_html(html_content, base_url):
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    text = soup.get_text()
+
+    # Extract title
+    title = soup.title.string if soup.title else None
+
+    # Extract favicon
+    favicon = extract_favicon(soup, base_url)
+
     return title, favicon, text
 
 
+async def fetch_url_content(url, headers):
+    """Fetch the url and return its title, favicon and text content"""
+    async with aiohttp.ClientSession() as session:
+        request_kwargs = {
+            "timeout": 30,
+            "allow_redirects": True,
+            "max_redirects": 10,
+            "headers": headers
+        }
+        async with session.get(url, **request_kwargs) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info,
+                    response.history,
+                    status=response.status,
+                    message=f"HTTP status {response.status}"
+                )
+            html_content = await response.text()
+            # Get the base URL for resolving relative URLs
+            base_url = get_base_url(str(response.url))
+
+            return extract_metadata_from_html(html_content, base_url)
+
+
 # Background task to process URLs from the queue
-async def process_single_url(link_id, url, user_email, headers):
+async def process_single_url(link_id, url, user_email, headers, attempt=1):
     # Acquire the semaphore to limit concurrency
     async with concurrency_limit:
         logger.info(
-            f"Processing URL {url} for user {user_email} (link ID: {link_id})")
+            f"Processing URL {url} for user {user_email} (link ID: {link_id}, attempt: {attempt})")
 
         # Create a new session for this task
         async with async_session_maker() as db:
+            link = None
             try:
                 # Update status to in progress
                 stmt = select(Link).where(Link.id == link_id)
@@ -91,57 +224,55 @@ async def process_single_url(link_id, url, user_email, headers):
                 link.status = ProcessingStatus.IN_PROGRESS
                 await db.commit()
 
-                # Fetch URL content
-                async with aiohttp.ClientSession() as session:
-                    try:
-                        request_kwargs = {
-                            "timeout": 30,
-                            "allow_redirects": True,
-                            "max_redirects": 10,
-                            "headers": headers
-                        }
-                        async with session.get(url, **request_kwargs) as response:
-                            if response.status == 200:
-                                html_content = await response.text()
-                                # Get the base URL for resolving relative URLs
-                                base_url = get_base_url(str(response.url))
-
-                                # Extract title and favicon
-                                title, favicon, text_content = extract_metadata_from_html(
-                                    html_content, base_url)
-
-                                # Update link with metadata
-                                link.title = title
-                                link.favicon = favicon
-
-                                # Add to vector store
-                                await asyncio.to_thread(vector_store.add_link_content_to_vector_store,
-                                                        text_content, url, title, link_id, user_email)
-
-                                # Update status to finished
-                                link.status = ProcessingStatus.FINISHED
-                                logger.info(
-                                    f"Successfully processed URL {url} for user {user_email} and link_id={link_id}")
-                            else:
-                                logger.error(
-                                    f"Failed to fetch URL {url}: HTTP status {response.status}")
-                                link.status = ProcessingStatus.FAILED
-                    except Exception as e:
-                        logger.error(f"Error fetching URL {url}: {str(e)}")
-                        link.status = ProcessingStatus.FAILED
-
-                # Commit changes
+                # Extract title and favicon
+                title, favicon, text_content = await fetch_url_content(
+                    url, headers)
+
+                # Update link with metadata
+                link.title = title
+                link.favicon = favicon
+
+                # A previous attempt may have stored some chunks already
+                if attempt > 1:
+                    await asyncio.to_thread(
+                        vector_store.remove_link_documents, link_id, user_email)
+
+                # Add to vector store, unless the same content was
+                # already added by this or any other user
+                embedded = await store_shared_content(
+                    db,
+                    link,
+                    hash_text(title, text_content),
+                    SourceType.LINK,
+                    url,
+                    title,
+                    lambda belongs_to: vector_store.add_link_content_to_vector_store(
+                        text_content, url, title, link_id, belongs_to)
+                )
+
+                # Links reusing content get its status along with it
+                if embedded:
+                    link.status = ProcessingStatus.FINISHED
                 await db.commit()
-
-                url_processing_queue.task_done()
+                logger.info(
+                    f"Successfully processed URL {url} for user {user_email} and link_id={link_id}")
 
             except Exception as e:
                 logger.error(
                     f"Error processing URL {url} for user {user_email}: {str(e)}")
-                # Try to mark the link as failed if possible
+                # Either retry later or move the job to dead-letter
                 try:
                     if link:
-                        link.status = ProcessingStatus.FAILED
-                        await db.commit()
-                except:
-                    pass
+                        await handle_job_failure(
+                            db,
+                            link,
+                            SourceType.LINK,
+                            {"url": url, "headers": headers},
+                            attempt,
+                            e,
+                            url_processing_queue,
+                            (link_id, url, user_email, headers, attempt + 1)
+                        )
+                except Exception as err:
+                    logger.error(
+                        f"Error recording failure of URL {url}: {str(err)}")
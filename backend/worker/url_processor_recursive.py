@@ -1,13 +1,48 @@
 import asyncio
+import aiohttp
 from bs4 import BeautifulSoup
+import hashlib
 import re
+import time
+from array import array
 
-from backend.api.models import Link, ProcessingStatus
+from backend.api.models import (
+    User,
+    CrawlJob,
+    CrawlStatus,
+    ProcessingStatus,
+    SourceType,
+    ErrorKind
+)
 from backend.vector_store.adapter import vector_db
 from backend.core.logging import get_logger
-from urllib.parse import urlparse
+from backend.core.utils import normalize_url
+from urllib.parse import urlparse, urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
 from backend.database import async_session_maker
-from langchain_community.document_loaders import RecursiveUrlLoader
+from sqlalchemy import select, update
+from sqlalchemy.orm import undefer
+from backend.config import settings
+from backend.worker.dispatch import abandoned, lease
+from backend.worker.retry import (
+    RETRY_POLICIES,
+    classify_error,
+    handle_job_failure
+)
+from backend.worker.shared_content import (
+    acquire_content,
+    release_content,
+    set_content_status,
+    take_content_status,
+    content_key,
+    hash_text
+)
+from backend.worker.url_processor import (
+    url_processing_queue,
+    extract_favicon,
+    upsert_links,
+    LinkAction
+)
 
 
 vector_store = vector_db()
@@ -17,7 +52,12 @@ logger = get_logger()
 
 # Create a queue for background processing
 recursive_url_processing_queue = asyncio.Queue()
-concurrency_limit = asyncio.Semaphore(4)
+concurrency_limit = asyncio.Semaphore(settings.CRAWL_JOB_CONCURRENCY)
+
+# crawl job id -> Crawler, for crawls currently running in this process
+running_crawlers = {}
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
 
 # Helper function to get base URL
 
@@ -31,10 +71,10 @@ async def process_recursive_url_queue():
     while True:
         try:
             # Get an item from the queue
-            url, user, headers = await recursive_url_processing_queue.get()
+            job_id = await recursive_url_processing_queue.get()
 
             # Process the URL in a separate task to avoid blocking the queue
-            asyncio.create_task(crawl_url(url, user, headers))
+            asyncio.create_task(crawl_url(job_id))
 
             # Mark the queue task as done
             # recursive_url_processing_queue.task_done()
@@ -44,50 +84,516 @@ async def process_recursive_url_queue():
             await asyncio.sleep(1)  # P
 
 
-def bs4_extractor(html: str) -> str:
+def parse_html_page(html, page_url):
+    """Return title, favicon, text content and outgoing links of the page"""
     soup = BeautifulSoup(html, "lxml")
-    return re.sub(r"\n\n+", "\n\n", soup.text).strip()
 
+    title = None
+    if soup.title and soup.title.string:
+        title = soup.title.string.strip()
+
+    favicon = extract_favicon(soup, get_base_url(page_url))
+
+    links = [
+        urljoin(page_url, anchor["href"])
+        for anchor in soup.find_all("a", href=True)
+    ]
+
+    text = re.sub(r"\n\n+", "\n\n", soup.text).strip()
+    return title, favicon, text, links
+
+
+async def resume_interrupted_crawls():
+    """
+    Put crawls which were interrupted by a stopped server on the queue
+    of this process
+    """
+    async with async_session_maker() as db:
+        result = await db.execute(
+            update(CrawlJob)
+            .where(
+                CrawlJob.status.in_([CrawlStatus.PENDING, CrawlStatus.RUNNING]),
+                abandoned(CrawlJob)
+            )
+            .values(status=CrawlStatus.PENDING, **lease())
+            .returning(CrawlJob.id)
+        )
+        job_ids = sorted(result.scalars().all())
+        await db.commit()
+
+    for job_id in job_ids:
+        await recursive_url_processing_queue.put(job_id)
+
+    if job_ids:
+        logger.info(f"Resuming {len(job_ids)} interrupted crawl(s)")
+
+
+def crawl_progress(job):
+    """Progress of the crawl job, using live numbers if it is running"""
+    crawler = running_crawlers.get(job.id)
+    if crawler:
+        return {
+            "pages_crawled": crawler.pages_crawled,
+            "pages_failed": crawler.pages_failed,
+            "urls_visited": len(crawler.seen),
+            "urls_pending": len(crawler.pending)
+        }
+    return {
+        "pages_crawled": job.pages_crawled or 0,
+        "pages_failed": job.pages_failed or 0,
+        "urls_visited": job.urls_visited or 0,
+        "urls_pending": job.urls_pending or 0
+    }
+
+
+class VisitedUrlSet:
+    """
+    Set of visited urls which only keeps 64 bit hashes of the
+    normalised urls, so that the visited set of large sites stays
+    small in memory and in checkpoints (8 bytes per url).
+    """
+
+    def __init__(self, hashes=()):
+        self.hashes = set(hashes)
+
+    @staticmethod
+    def url_hash(url):
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def add(self, url):
+        self.hashes.add(self.url_hash(url))
+
+    def __contains__(self, url):
+        return self.url_hash(url) in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def to_bytes(self):
+        return array("Q", self.hashes).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        hashes = array("Q")
+        if data:
+            hashes.frombytes(data)
+        return cls(hashes)
+
+
+class RobotsRules:
+    """Lazily fetched and cached robots.txt rules per origin"""
+
+    def __init__(self, session, user_agent):
+        self.session = session
+        self.user_agent = user_agent
+        self.parsers = {}
+        self.locks = {}
+
+    async def allowed(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+
+        parser = self.parsers.get(origin)
+        if parser is None:
+            lock = self.locks.setdefault(origin, asyncio.Lock())
+            async with lock:
+                parser = self.parsers.get(origin)
+                if parser is None:
+                    parser = await self.fetch(origin)
+                    self.parsers[origin] = parser
+
+        return parser.can_fetch(self.user_agent, url)
+
+    async def fetch(self, origin):
+        robots_url = f"{origin}/robots.txt"
+        parser = RobotFileParser(robots_url)
+        try:
+            async with self.session.get(robots_url) as response:
+                if response.status in (401, 403):
+                    parser.disallow_all = True
+                elif response.status >= 400:
+                    parser.allow_all = True
+                else:
+                    parser.parse((await response.text()).splitlines())
+        except Exception as err:
+            logger.warning(f"Unable to fetch {robots_url}: {err}")
+            parser.allow_all = True
+        return parser
+
+
+class Crawler:
+    """
+    Crawls pages concurrently starting from the given url.
+    Fetched pages are handed over to a single ingest task which
+    stores and embeds them in batches, so fetching never waits
+    for embeddings. Crawl state is checkpointed to the crawl job,
+    so that the crawl can be paused and resumed later on.
+    """
+
+    def __init__(self, job, user):
+        options = job.options or {}
+        self.job_id = job.id
+        self.root_url = job.root_url
+        self.user = user
+        self.headers = job.headers or {}
+        self.max_depth = options.get("max_depth", settings.CRAWL_MAX_DEPTH)
+        self.max_pages = options.get("max_pages", settings.CRAWL_MAX_PAGES)
+        self.concurrency = options.get(
+            "concurrency", settings.CRAWL_CONCURRENCY)
+        self.same_domain = options.get("same_domain", True)
+        self.path_prefix = options.get("path_prefix")
+        self.respect_robots = options.get("respect_robots", True)
+
+        self.host = urlsplit(self.root_url).netloc
+        self.frontier = asyncio.Queue()
+        # Bounded, so that fetching slows down to the pace of
+        # embeddings instead of piling up pages in memory
+        self.ingest_queue = asyncio.Queue(
+            maxsize=settings.CRAWL_INGEST_BATCH_SIZE * 2)
+        self.seen = VisitedUrlSet.from_bytes(job.visited)
+        # url -> depth of every url which is queued or being
+        # processed, but not yet stored. This is the frontier
+        # which gets checkpointed.
+        self.pending = {}
+        self.resume_frontier = job.frontier or []
+        self.pages_crawled = job.pages_crawled or 0
+        self.pages_failed = job.pages_failed or 0
+        self.stopping = asyncio.Event()
+        self.last_checkpoint = time.monotonic()
+
+    def in_scope(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return False
+        if self.same_domain and parts.netloc != self.host:
+            return False
+        if self.path_prefix and not parts.path.startswith(self.path_prefix):
+            return False
+        return True
+
+    def add_to_frontier(self, url, depth):
+        if url in self.seen or len(self.seen) >= self.max_pages:
+            return
+        self.seen.add(url)
+        self.enqueue(url, depth)
+
+    def enqueue(self, url, depth):
+        self.pending[url] = depth
+        self.frontier.put_nowait((url, depth))
+
+    def complete(self, url):
+        self.pending.pop(url, None)
+
+    def pause(self):
+        self.stopping.set()
+
+    async def checkpoint(self, db, status=None):
+        """Store the crawl state, caller needs to commit"""
+        job = await db.get(CrawlJob, self.job_id)
+        job.frontier = [[url, depth] for url, depth in self.pending.items()]
+        job.visited = self.seen.to_bytes()
+        job.pages_crawled = self.pages_crawled
+        job.pages_failed = self.pages_failed
+        job.urls_visited = len(self.seen)
+        job.urls_pending = len(self.pending)
+        if status:
+            job.status = status
+        elif job.status == CrawlStatus.PAUSED:
+            # paused by a request handled in another process
+            self.pause()
+        self.last_checkpoint = time.monotonic()
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(total=settings.CRAWL_REQUEST_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=timeout,
+                connector=connector) as session:
+            self.session = session
+            self.robots = RobotsRules(
+                session, self.headers.get("User-Agent", "*"))
+
+            if self.resume_frontier:
+                for url, depth in self.resume_frontier:
+                    self.enqueue(url, depth)
+            elif not self.seen:
+                self.add_to_frontier(self.root_url, 0)
+
+            fetchers = [
+                asyncio.create_task(self.fetch_worker())
+                for _ in range(self.concurrency)
+            ]
+            ingester = asyncio.create_task(self.ingest_worker())
+            frontier_done = asyncio.create_task(self.frontier.join())
+            stop_requested = asyncio.create_task(self.stopping.wait())
+            try:
+                await asyncio.wait(
+                    [frontier_done, stop_requested],
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                # On pause, pages which are still being fetched
+                # stay in the pending frontier and get fetched again
+                # on resume. Pages already fetched are still stored.
+                for task in fetchers:
+                    task.cancel()
+                await asyncio.gather(*fetchers, return_exceptions=True)
+                await self.ingest_queue.join()
+            finally:
+                for task in [ingester, frontier_done, stop_requested]:
+                    task.cancel()
+                await asyncio.gather(
+                    ingester,
+                    frontier_done,
+                    stop_requested,
+                    return_exceptions=True
+                )
+
+        if self.stopping.is_set():
+            status = CrawlStatus.PAUSED
+        else:
+            status = CrawlStatus.FINISHED
 
-# Background task to process URLs from the queue
-async def crawl_url(url, user, headers):
-    loader = RecursiveUrlLoader(
-        url,
-        headers=headers,
-        continue_on_failure=True,
-        max_depth=2,
-        timeout=300,
-        use_async=True,
-        extractor=bs4_extractor,
-        base_url=get_base_url(url)
-    )
-    # Acquire the semaphore to limit concurrency
-    async with concurrency_limit:
         async with async_session_maker() as db:
+            await self.checkpoint(db, status)
+            await db.commit()
+
+        logger.info(
+            f"Crawl {self.job_id} of {self.root_url} for user {self.user.email} "
+            f"{status.value}: {self.pages_crawled} pages stored, "
+            f"{self.pages_failed} failed, {len(self.pending)} pending")
+
+    async def fetch_worker(self):
+        while True:
+            url, depth = await self.frontier.get()
             try:
-                async for doc in loader.alazy_load():
-                    title = doc.metadata.get("title", "No title")
-                    text = doc.page_content.strip()
-                    source = doc.metadata["source"]
-                    db_link = Link(
-                        url=str(source),
-                        user_id=user.id,
-                        status=ProcessingStatus.PENDING
-                    )
-                    db.add(db_link)
-                    await db.commit()
-                    await db.refresh(db_link)
-                    await asyncio.to_thread(
-                        vector_store.add_link_content_to_vector_store,
-                        text, source, title, db_link.id, user.email
-                    )
-                    db_link.status = ProcessingStatus.FINISHED
-                    await db.commit()
+                await self.crawl_page(url, depth)
+            except Exception as e:
+                self.pages_failed += 1
+                self.complete(url)
+                logger.error(f"Error crawling page {url}: {str(e)}")
+            finally:
+                self.frontier.task_done()
 
-                    logger.info(
-                        f"Successfully processed URL {source} for user {user.email}")
+    async def crawl_page(self, url, depth):
+        if self.respect_robots and not await self.robots.allowed(url):
+            logger.info(f"Skipping {url}: disallowed by robots.txt")
+            self.complete(url)
+            return
 
-                recursive_url_processing_queue.task_done()
+        page = await self.fetch_page(url)
+        if page is None:
+            self.complete(url)
+            return
+
+        final_url, html = page
+        title, favicon, text, links = await asyncio.to_thread(
+            parse_html_page, html, final_url)
+
+        # Extend the frontier before handing the page over for storage,
+        # so that a checkpoint never has the page stored but its
+        # outgoing links missing
+        if depth < self.max_depth:
+            for link in links:
+                try:
+                    link = normalize_url(link)
+                except ValueError:
+                    continue
+                if self.in_scope(link):
+                    self.add_to_frontier(link, depth + 1)
+
+        await self.ingest_queue.put({
+            "source": url,
+            "title": title or "No title",
+            "favicon": favicon,
+            "text_content": text
+        })
+
+    async def fetch_page(self, url):
+        """Fetch html of the page, retrying transient errors"""
+        policy = RETRY_POLICIES[SourceType.LINK]
+        attempt = 1
+        while True:
+            try:
+                async with self.session.get(
+                        url,
+                        allow_redirects=True,
+                        max_redirects=10) as response:
+                    if response.status != 200:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info,
+                            response.history,
+                            status=response.status,
+                            message=f"HTTP status {response.status}"
+                        )
+                    content_type = response.headers.get("Content-Type", "")
+                    if not content_type.startswith(HTML_CONTENT_TYPES):
+                        return None
+                    return str(response.url), await response.text()
+            except Exception as err:
+                if (classify_error(err) == ErrorKind.TRANSIENT
+                        and attempt < policy.max_attempts):
+                    await asyncio.sleep(policy.backoff(attempt))
+                    attempt += 1
+                    continue
+                raise
+
+    async def ingest_worker(self):
+        while True:
+            # Take whatever has been fetched meanwhile as one batch
+            pages = [await self.ingest_queue.get()]
+            while (len(pages) < settings.CRAWL_INGEST_BATCH_SIZE
+                    and not self.ingest_queue.empty()):
+                pages.append(self.ingest_queue.get_nowait())
+
+            try:
+                await self.ingest_pages(pages)
             except Exception as e:
+                self.pages_failed += len(pages)
+                for page in pages:
+                    self.complete(page["source"])
                 logger.error(
-                    f"Error crawling URL {url} for user {user.email}: {str(e)}")
+                    f"Error storing {len(pages)} crawled pages of "
+                    f"{self.root_url}: {str(e)}")
+            finally:
+                for _ in pages:
+                    self.ingest_queue.task_done()
+
+    async def ingest_pages(self, pages):
+        async with async_session_maker() as db:
+            # Stored pages get their content replaced, the ones queued
+            # or being fetched by another job are left to that job
+            resolved = await upsert_links(
+                db,
+                self.user,
+                [page["source"] for page in pages],
+                refresh=True,
+                status=ProcessingStatus.IN_PROGRESS
+            )
+            resolved = {link.normalized_url: (link, action)
+                        for link, action in resolved}
+
+            links = []
+            new_pages = []
+            for page in pages:
+                link, action = resolved.pop(
+                    normalize_url(page["source"]), (None, None))
+                if action not in (LinkAction.CREATED, LinkAction.REFRESHED):
+                    self.complete(page["source"])
+                    continue
+                link.title = page["title"]
+                link.favicon = page["favicon"]
+                page["link_id"] = link.id
+                links.append(link)
+                new_pages.append(page)
+
+            # Pages whose content is stored already only reference it
+            claimed = []
+            reused = []
+            previous_content_ids = []
+            for page, link in zip(new_pages, links):
+                content, is_claimed, previous_content_id = await acquire_content(
+                    db,
+                    link,
+                    hash_text(page["title"], page["text_content"]),
+                    SourceType.LINK,
+                    page["source"],
+                    page["title"]
+                )
+                if is_claimed:
+                    page["belongs_to"] = content_key(content.id)
+                    claimed.append((page, content.id))
+                else:
+                    reused.append(link)
+                if previous_content_id:
+                    previous_content_ids.append(previous_content_id)
+            await db.commit()
+
+            for content_id in previous_content_ids:
+                await release_content(db, content_id)
+
+            pages = new_pages
+            if not pages:
+                return
+
+            try:
+                if claimed:
+                    await asyncio.to_thread(
+                        vector_store.add_links_content_to_vector_store,
+                        [page for page, _ in claimed], self.user.email
+                    )
+            except Exception as err:
+                for _, content_id in claimed:
+                    await set_content_status(
+                        db, content_id, ProcessingStatus.FAILED)
+                # Hand the pages over to the regular link pipeline,
+                # which retries them with backoff
+                for link in links:
+                    await handle_job_failure(
+                        db,
+                        link,
+                        SourceType.LINK,
+                        {"url": link.url, "headers": self.headers},
+                        1,
+                        err,
+                        url_processing_queue,
+                        (link.id, link.url, self.user.email, self.headers, 2)
+                    )
+                self.pages_failed += len(pages)
+                for page in pages:
+                    self.complete(page["source"])
+                return
+
+            for _, content_id in claimed:
+                await set_content_status(
+                    db, content_id, ProcessingStatus.FINISHED)
+            # Links reusing content get its status along with it
+            for link in reused:
+                await take_content_status(db, link)
+            self.pages_crawled += len(pages)
+            for page in pages:
+                self.complete(page["source"])
+
+            elapsed = time.monotonic() - self.last_checkpoint
+            if elapsed >= settings.CRAWL_CHECKPOINT_INTERVAL:
+                await self.checkpoint(db)
+            await db.commit()
+
+
+# Background task to process URLs from the queue
+async def crawl_url(job_id):
+    # Acquire the semaphore to limit concurrency
+    async with concurrency_limit:
+        crawler = None
+        try:
+            async with async_session_maker() as db:
+                result = await db.execute(
+                    select(CrawlJob)
+                    .options(undefer(CrawlJob.frontier), undefer(CrawlJob.visited))
+                    .where(CrawlJob.id == job_id)
+                )
+                job = result.scalars().first()
+
+                # Job may have been paused while waiting in the queue
+                if not job or job.status != CrawlStatus.PENDING:
+                    return
+
+                user = await db.get(User, job.user_id)
+                job.status = CrawlStatus.RUNNING
+                await db.commit()
+
+            crawler = Crawler(job, user)
+            running_crawlers[job_id] = crawler
+            await crawler.run()
+        except Exception as e:
+            logger.error(f"Error running crawl {job_id}: {str(e)}")
+            if crawler:
+                async with async_session_maker() as db:
+                    await crawler.checkpoint(db, CrawlStatus.FAILED)
+                    await db.commit()
+        finally:
+            # Only this run's entry, never a later run of the same job
+            if crawler and running_crawlers.get(job_id) is crawler:
+                del running_crawlers[job_id]
+            recursive_url_processing_queue.task_done()
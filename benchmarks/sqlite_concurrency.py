@@ -0,0 +1,208 @@
+"""
+Concurrent read/write throughput of the sqlite database with the
+default settings and with the production profile of backend/database.py.
+
+Writers commit status updates of notes, like the background workers
+do, while readers run the list endpoint query (latest notes of a user
+plus total count). Only the standard library is needed:
+
+    python benchmarks/sqlite_concurrency.py --writers 16 --readers 8
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+PROFILES = {
+    # sqlite3 / aiosqlite defaults, as used before the production profile
+    "default": {
+        "pragmas": [],
+        "indexes": False,
+    },
+    "production": {
+        "pragmas": [
+            "PRAGMA journal_mode=WAL",
+            "PRAGMA synchronous=NORMAL",
+            "PRAGMA busy_timeout=5000",
+            f"PRAGMA mmap_size={256 * 1024 * 1024}",
+        ],
+        "indexes": True,
+    },
+}
+
+
+def create_database(path, users, notes_per_user, indexes):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE notes ("
+        "id INTEGER PRIMARY KEY, url VARCHAR, title VARCHAR, "
+        "filename VARCHAR, file_path VARCHAR, status VARCHAR, "
+        "created_at DATETIME, updated_at DATETIME, user_id INTEGER)"
+    )
+    conn.execute("CREATE INDEX ix_notes_user_id ON notes (user_id)")
+    if indexes:
+        conn.execute(
+            "CREATE INDEX ix_notes_user_updated_at "
+            "ON notes (user_id, updated_at)")
+
+    start = datetime(2024, 1, 1)
+    rows = []
+    for user_id in range(1, users + 1):
+        for i in range(notes_per_user):
+            stamp = start + timedelta(seconds=random.randrange(10 ** 7))
+            rows.append((
+                f"/file/note/note-{user_id}-{i}.md",
+                f"Note {i}",
+                f"note-{user_id}-{i}.md",
+                f"/tmp/note-{user_id}-{i}.md",
+                "finished",
+                stamp,
+                stamp,
+                user_id
+            ))
+    conn.executemany(
+        "INSERT INTO notes (url, title, filename, file_path, status, "
+        "created_at, updated_at, user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def connect(path, pragmas):
+    # Same timeout the aiosqlite driver uses by default
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    for pragma in pragmas:
+        conn.execute(pragma)
+    return conn
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {"write": [], "read": []}
+        self.errors = 0
+
+    def record(self, kind, latency):
+        with self.lock:
+            self.latencies[kind].append(latency)
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+
+def writer(path, pragmas, max_id, stop, stats):
+    conn = connect(path, pragmas)
+    while not stop.is_set():
+        note_id = random.randint(1, max_id)
+        started = time.perf_counter()
+        try:
+            conn.execute(
+                "UPDATE notes SET status = ?, updated_at = ? WHERE id = ?",
+                (random.choice(["in_progress", "finished"]),
+                 datetime.utcnow(), note_id)
+            )
+            conn.commit()
+        except sqlite3.OperationalError:
+            conn.rollback()
+            stats.error()
+            continue
+        stats.record("write", time.perf_counter() - started)
+    conn.close()
+
+
+def reader(path, pragmas, users, stop, stats):
+    conn = connect(path, pragmas)
+    while not stop.is_set():
+        user_id = random.randint(1, users)
+        started = time.perf_counter()
+        try:
+            conn.execute(
+                "SELECT id, url, title, filename, created_at, updated_at "
+                "FROM notes WHERE user_id = ? "
+                "ORDER BY updated_at DESC LIMIT 100 OFFSET 0",
+                (user_id,)
+            ).fetchall()
+            conn.execute(
+                "SELECT count(*) FROM notes WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            stats.error()
+            continue
+        stats.record("read", time.perf_counter() - started)
+    conn.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_profile(name, args):
+    profile = PROFILES[name]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.db")
+        create_database(
+            path, args.users, args.notes_per_user, profile["indexes"])
+        # journal_mode=WAL is persistent, set it once like the app does
+        connect(path, profile["pragmas"]).close()
+
+        stats = Stats()
+        stop = threading.Event()
+        threads = [
+            threading.Thread(
+                target=writer,
+                args=(path, profile["pragmas"],
+                      args.users * args.notes_per_user, stop, stats))
+            for _ in range(args.writers)
+        ] + [
+            threading.Thread(
+                target=reader,
+                args=(path, profile["pragmas"], args.users, stop, stats))
+            for _ in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    writes = stats.latencies["write"]
+    reads = stats.latencies["read"]
+    print(
+        f"{name:<11} "
+        f"writes/s {len(writes) / args.duration:>8.0f}  "
+        f"reads/s {len(reads) / args.duration:>8.0f}  "
+        f"write p99 {percentile(writes, 0.99) * 1000:>7.1f}ms  "
+        f"read p99 {percentile(reads, 0.99) * 1000:>7.1f}ms  "
+        f"read median {statistics.median(reads or [0]) * 1000:>6.1f}ms  "
+        f"locked errors {stats.errors}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--notes-per-user", type=int, default=5000)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--profile", choices=list(PROFILES), action="append")
+    args = parser.parse_args()
+
+    for name in args.profile or list(PROFILES):
+        run_profile(name, args)
+
+
+if __name__ == "__main__":
+    main()
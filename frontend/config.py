@@ -36,6 +36,14 @@ class Settings(BaseSettings):
     # default editors - streamlit_default, easymde
     DEFAULT_EDITOR: str = "easymde"
     UPLOAD_FILE_TYPES: list[str] = ['txt', 'pdf', "md", "json", "sh"]
+    # Files larger than this are uploaded in resumable parts
+    CHUNKED_UPLOAD_THRESHOLD: int = 16 * 1024 * 1024
+    UPLOAD_PART_RETRIES: int = 5
+    # Fields and characters of the references requested in
+    # "only links" mode, the whole chunks are only needed as context
+    REFERENCE_FIELDS: list[str] = [
+        "page_content", "source", "page", "title", "filename", "source_type"]
+    REFERENCE_SNIPPET_LENGTH: int = 500
     DEFAULT_HEADERS: Dict[str, str] = {
         "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:136.0) Gecko/20100101 Firefox/136.0",
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
@@ -17,7 +17,8 @@ from frontend.utils import (
     submit_link,
     submit_bulk_links,
     submit_recursive_crawl_link,
-    fetch_documents,
+    stream_documents,
+    stream_chat_events,
     upload_note_to_api_server,
     fetch_notes,
     fetch_file,
@@ -132,36 +133,6 @@ class OllamaChatApp:
         self.qna_tab = st
         self.main_content, self.right_sidebar = self.qna_tab.columns([3, 1])
 
-    def format_chat_history(self):
-        """Format the entire chat history for context"""
-        formatted_messages = []
-
-        # Add system message first
-        formatted_messages.append({
-            "role": "system",
-            "content": 'You are a document Q&A assistant. Only answer questions based on the provided context. If the answer cannot be found in the context, say so.'
-        })
-
-        # Add all previous messages
-        formatted_messages.extend(st.session_state.messages)
-
-        return formatted_messages
-
-    def format_chat_history_unfocused(self):
-        """Format the entire chat history for context"""
-        formatted_messages = []
-
-        # Add system message first
-        formatted_messages.append({
-            "role": "system",
-            "content": 'You are a document Q&A assistant'
-        })
-
-        # Add all previous messages
-        formatted_messages.extend(st.session_state.messages)
-
-        return formatted_messages
-
     def process_uploaded_file_with_links(self, uploaded_file):
         """Process uploaded file, extact links, fetch pages and store in vector database"""
         if uploaded_file is not None:
@@ -231,82 +202,39 @@ class OllamaChatApp:
             st.error(f"Error extracting text from PDF: {str(e)}")
             return None
 
-    def create_prompt_with_context(self, query: str, context: str) -> str:
-        """Create a focused prompt that instructs the model to use only the provided context"""
-        return f"""Please answer the question based ONLY on the provided context. If the context doesn't contain the information needed to answer the question, please respond with "I cannot answer this question based on the provided context."
-
-Context: {context}
-
-Question: {query}
-
-Answer: """
-
-    def create_prompt_without_context(self, query: str) -> str:
-        """Create a focused prompt that instructs the model to use only the provided context"""
-        return f"""Please answer the following question"
-
-Question: {query}
-
-Answer: """
-
-    async def get_llm_response(self, prompt: str, context: str = None, context_aware: bool = True) -> AsyncGenerator[str, None]:
-        """Get streaming response from LLM  model"""
+    async def get_llm_response(self, prompt: str, context_aware: bool = True) -> AsyncGenerator[str, None]:
+        """Get streaming response of the LLM model from the backend"""
         try:
-            client = ollama.AsyncClient(host=settings.OLLAMA_HOST)
-
-            # Create system message to enforce context-based answering
-            system_message_focused = {
-                'role': 'system',
-                'content': 'You are a document Q&A assistant. Only answer questions based on the provided context. If the answer cannot be found in the context, say so.'
-            }
-            system_message_non_focused = {
-                'role': 'system',
-                'content': 'You are Q&A assistant'
-            }
-
-            # Create the focused prompt
-            if context_aware:
-                focused_prompt = self.create_prompt_with_context(
-                    prompt, context)
-            else:
-                non_focused_prompt = self.create_prompt_without_context(prompt)
-
-            if len(st.session_state.messages) > 1 and context_aware:
-                messages = self.format_chat_history()
-                messages.append({'role': 'user', 'content': focused_prompt})
-            elif len(st.session_state.messages) > 1 and not context_aware:
-                messages = self.format_chat_history_unfocused()
-                messages.append(
-                    {'role': 'user', 'content': non_focused_prompt})
-            elif context_aware:
-                messages = [
-                    system_message_focused,
-                    {'role': 'user', 'content': focused_prompt}
-                ]
-            else:
-                messages = [
-                    system_message_non_focused,
-                    {'role': 'user', 'content': non_focused_prompt}
-                ]
-
-            stream = await client.chat(
-                model=st.session_state.ollama_model_selected,
-                messages=messages,
-                stream=True
-            )
-
-            async for chunk in stream:
+            # Current prompt is the last message
+            history = st.session_state.messages[:-1]
+            async for event, data in stream_chat_events(
+                prompt,
+                st.session_state.ollama_model_selected,
+                history,
+                context_aware
+            ):
                 if not st.session_state.is_generating:
                     break
-                if 'message' in chunk:
-                    content = chunk['message'].get('content', '')
-                    if content:
-                        yield content
-                        await asyncio.sleep(0)
+                if event == "references":
+                    self.display_chat_references(data["documents"])
+                elif event == "error":
+                    yield f"\nError: {data['error']}"
+                elif event == "message":
+                    yield data["content"]
+                    await asyncio.sleep(0)
 
         except Exception as e:
             yield f"\nError: {str(e)}"
 
+    def display_chat_references(self, docs):
+        """References used as context, as sent before the answer"""
+        st.session_state.prompt_with_docs['docs'] = docs
+        if not self.show_references() or not docs:
+            return
+        ref = self.references_container()
+        for i, doc in enumerate(docs, 1):
+            self.display_reference(ref, doc, i)
+
     def display_chat_history(self):
         """Display chat messages from history"""
         for message in st.session_state.messages:
@@ -326,90 +254,106 @@ Answer: """
         else:
             st.session_state.exclude_selected.append(source)
 
+    def show_references(self):
+        return st.session_state.discussion_mode in ["context-aware", "only-links"]
+
+    def references_container(self, index=0):
+        # index field is used for controlling
+        # where to display the references
+        if index == 2:
+            ref = self.main_content
+        else:
+            ref = self.right_sidebar
+        with ref:
+            if st.session_state.include_selected:
+                st.info(
+                    f"Included reference: {','.join(st.session_state.include_selected)}", icon="ℹ️")
+            if st.session_state.exclude_selected:
+                st.info(
+                    f"Excluded reference: {','.join(st.session_state.exclude_selected)}", icon="ℹ️")
+        return ref
+
     def display_references(self, index=0):
         docs = st.session_state.prompt_with_docs.get("docs", [])
 
-        if st.session_state.discussion_mode in ["context-aware", "only-links"] and docs:
-            context = "\n\n".join(
-                [doc["page_content"] for doc in docs])
-            # Prepare references for sidebar
-            references = []
-
-            for doc in docs:
-                metadata = doc["metadata"]
-                source = metadata.get("source", "N/A")
-                reference = {
-                    "source": source,
-                    "page": metadata.get("page", "N/A"),
-                    "score": doc["score"],
-                    "text": doc["page_content"],
-                    "title": metadata.get("title", source),
-                    "filename": metadata.get("filename", ""),
-                    "source_type": metadata.get("source_type", "")
-                }
-                references.append(reference)
-
-            # index field is used for controlling
-            # where to display the references
-            if index == 2:
-                ref = self.main_content
-            else:
-                ref = self.right_sidebar
-            with ref:
-                if st.session_state.include_selected:
-                    st.info(
-                        f"Included reference: {','.join(st.session_state.include_selected)}", icon="ℹ️")
-                if st.session_state.exclude_selected:
-                    st.info(
-                        f"Excluded reference: {','.join(st.session_state.exclude_selected)}", icon="ℹ️")
-
-                for i, ref in enumerate(references, 1):
-                    if ref["filename"]:
-                        src = ref['filename']
-                    else:
-                        src = ref['source']
-                    if index == 2:
-                        expand = True
-                    elif st.session_state.discussion_mode == "only-links":
-                        # It means, discussion mode is show only links
-                        # but the references will load on right sidebar
-                        # so we don't want to auto expand them
-                        expand = False
-                    else:
-                        expand = (i == 1)
-                    with st.expander(
-                        f"Reference {i} (Score: {ref['score']:.2f}, Page: {ref['page']})",
-                        expanded=expand
-                    ):
-                        st.session_state.right_sidebar_rendered = True
-                        st.radio(
-                            src,
-                            options=["Include", "Exclude"],
-                            key=f"radio_{index}_{i}",
-                            horizontal=True,
-                            index=None,
-                            on_change=self.handle_selection_change,
-                            args=(ref['source'], f"radio_{index}_{i}",)
+        if self.show_references() and docs:
+            ref = self.references_container(index)
+            for i, doc in enumerate(docs, 1):
+                self.display_reference(ref, doc, i, index)
+
+    def stream_references(self, prompt):
+        """Display references while they arrive and return all of them"""
+        docs = []
+        ref = None
+        for i, doc in enumerate(stream_documents(prompt), 1):
+            docs.append(doc)
+            if not self.show_references():
+                continue
+            if ref is None:
+                ref = self.references_container()
+            self.display_reference(ref, doc, i)
+        return docs
+
+    def display_reference(self, container, doc, i, index=0):
+        metadata = doc["metadata"]
+        source = metadata.get("source", "N/A")
+        ref = {
+            "source": source,
+            "page": metadata.get("page", "N/A"),
+            "score": doc["score"],
+            "text": doc.get("page_content", ""),
+            "title": metadata.get("title", source),
+            "filename": metadata.get("filename", ""),
+            "source_type": metadata.get("source_type", "")
+        }
+
+        if ref["filename"]:
+            src = ref['filename']
+        else:
+            src = ref['source']
+        if index == 2:
+            expand = True
+        elif st.session_state.discussion_mode == "only-links":
+            # It means, discussion mode is show only links
+            # but the references will load on right sidebar
+            # so we don't want to auto expand them
+            expand = False
+        else:
+            expand = (i == 1)
+        with container:
+            with st.expander(
+                f"Reference {i} (Score: {ref['score']:.2f}, Page: {ref['page']})",
+                expanded=expand
+            ):
+                st.session_state.right_sidebar_rendered = True
+                st.radio(
+                    src,
+                    options=["Include", "Exclude"],
+                    key=f"radio_{index}_{i}",
+                    horizontal=True,
+                    index=None,
+                    on_change=self.handle_selection_change,
+                    args=(ref['source'], f"radio_{index}_{i}",)
+                )
+                if ref['text']:
+                    txt = re.sub(r'\n+', '\n', ref['text'])
+                    st.markdown(txt[:500])
+                if ref['filename']:
+
+                    cols = st.columns([5, 3])
+                    cols[0].button(
+                        "View Document",
+                        key=f"btn_{index}_{i}",
+                        on_click=self.render_file_sync,
+                        args=(ref['source'], ref['page'],)
+                    )
+                    if ref['source_type'] == "note":
+                        cols[1].button(
+                            "Edit",
+                            key=f"edit_note_button_{index}_{i}",
+                            on_click=self.edit_note_btn_clicked,
+                            args=(ref['source'],)
                         )
-                        if ref['text']:
-                            txt = re.sub(r'\n+', '\n', ref['text'])
-                            st.markdown(txt[:500])
-                        if ref['filename']:
-
-                            cols = st.columns([5, 3])
-                            cols[0].button(
-                                "View Document",
-                                key=f"btn_{index}_{i}",
-                                on_click=self.render_file_sync,
-                                args=(ref['source'], ref['page'],)
-                            )
-                            if ref['source_type'] == "note":
-                                cols[1].button(
-                                    "Edit",
-                                    key=f"edit_note_button_{index}_{i}",
-                                    on_click=self.edit_note_btn_clicked,
-                                    args=(ref['source'],)
-                                )
 
     def format_resource_list(self, docs):
         formatted_text = ""
@@ -432,32 +376,19 @@ Answer: """
     async def process_response(self, docs, prompt: str):
 
         discussion_mode = st.session_state.discussion_mode
-        context = None
-
-        if len(st.session_state.messages) > 1:
-            msgs = [msg["content"] for msg in st.session_state.messages]
-            msgstr = '\n'.join(msgs)
-            prompt = msgstr + "\n" + prompt
-
-        if docs:
-            context = "\n\n".join(
-                [doc["page_content"] for doc in docs])
 
         with self.main_content.chat_message("assistant"):
             message_placeholder = st.empty()
             self.qna_tab.container().empty()
             full_response = ""
 
-            if discussion_mode == "context-aware" and not context:
-                full_response = "I couldn't find relevant information in the uploaded document to answer your question."
-                message_placeholder.markdown(full_response)
-            elif discussion_mode == "only-links":
+            if discussion_mode == "only-links":
                 message_placeholder.markdown(
                     f"Total references found: {len(docs)}")
                 self.display_references(2)
             else:
                 context_aware = True if discussion_mode == "context-aware" else False
-                async for response_chunk in self.get_llm_response(prompt, context, context_aware):
+                async for response_chunk in self.get_llm_response(prompt, context_aware):
                     full_response += response_chunk
                     message_placeholder.markdown(full_response + "▌")
                     time.sleep(0.01)
@@ -1113,12 +1044,15 @@ Answer: """
                 prompt = self.set_source_type(prompt)
 
                 st.session_state.context_window_size = input_context_window_size
-                docs = fetch_documents(prompt)
+                if st.session_state.discussion_mode == "only-links":
+                    docs = self.stream_references(prompt)
+                else:
+                    # Backend searches the references of the answer
+                    docs = []
 
                 st.session_state.prompt_with_docs['docs'] = docs
                 st.session_state.prompt_with_docs['prompt'] = prompt
 
-                self.display_references()
                 st.session_state.is_generating = True
                 asyncio.run(self.process_response(docs, prompt))
                 st.session_state.is_generating = False
@@ -1,4 +1,6 @@
 # frontend/utils.py
+import aiohttp
+import hashlib
 import json
 import requests
 import streamlit as st
@@ -87,6 +89,9 @@ def navigate_to(page):
 
 
 def upload_file_to_api_server(uploaded_file):
+    if uploaded_file.size > settings.CHUNKED_UPLOAD_THRESHOLD:
+        return upload_file_in_chunks(uploaded_file)
+
     headers = {
         "Authorization": f"Bearer {st.session_state.token}"
     }
@@ -109,6 +114,82 @@ def upload_file_to_api_server(uploaded_file):
         return False, uploaded_file.name
 
 
+def file_checksum(uploaded_file, chunk_size=1024 * 1024):
+    checksum = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def upload_file_in_chunks(uploaded_file):
+    """Upload the file in parts, resuming after dropped connections"""
+    headers = {
+        "Authorization": f"Bearer {st.session_state.token}"
+    }
+
+    response = requests.post(
+        f"{settings.API_URL}/file/upload/init",
+        headers=headers,
+        json={
+            "filename": uploaded_file.name,
+            "size": uploaded_file.size,
+            "content_type": uploaded_file.type
+        }
+    )
+    if response.status_code != 201:
+        st.error(f"Upload failed: {response.text}")
+        return False, uploaded_file.name
+
+    upload = response.json()
+    upload_url = f"{settings.API_URL}/file/upload/{upload['upload_id']}"
+    progress = st.progress(0.0, text=f"Uploading {uploaded_file.name}")
+
+    offset = 0
+    retries = 0
+    while offset < upload["size"]:
+        uploaded_file.seek(offset)
+        chunk = uploaded_file.read(upload["chunk_size"])
+        try:
+            response = requests.put(
+                upload_url,
+                headers=headers,
+                params={"offset": offset},
+                data=chunk
+            )
+            response.raise_for_status()
+            offset = response.json()["offset"]
+            retries = 0
+        except requests.RequestException as err:
+            retries += 1
+            if retries > settings.UPLOAD_PART_RETRIES:
+                st.error(f"Upload failed: {err}")
+                return False, uploaded_file.name
+            time.sleep(retries)
+            # Continue from whatever the server has stored
+            try:
+                response = requests.get(upload_url, headers=headers)
+                if response.status_code == 200:
+                    offset = response.json()["offset"]
+            except requests.RequestException:
+                pass
+        progress.progress(offset / upload["size"])
+
+    response = requests.post(
+        f"{upload_url}/finalize",
+        headers=headers,
+        json={"checksum": file_checksum(uploaded_file)}
+    )
+    progress.empty()
+
+    if response.status_code == 202:
+        result = response.json()
+        return True, result["filename"]
+    else:
+        st.error(f"Upload failed: {response.text}")
+        return False, uploaded_file.name
+
+
 def upload_note_to_api_server(content, title):
     headers = {
         "Authorization": f"Bearer {st.session_state.token}",
@@ -232,12 +313,7 @@ def submit_recursive_crawl_link(link, custom_headers):
     return False
 
 
-def fetch_documents(prompt):
-    headers = {
-        "Authorization": f"Bearer {st.session_state.token}",
-        "Content-Type": "application/json"
-    }
-
+def search_request_data(prompt):
     data = {
         "include_sources": st.session_state.include_selected,
         "exclude_sources": st.session_state.exclude_selected,
@@ -248,10 +324,23 @@ def fetch_documents(prompt):
     if st.session_state.source_type:
         data["source_type"] = st.session_state.source_type
 
+    if st.session_state.discussion_mode == "only-links":
+        # References are only listed, no need for the whole chunks
+        data["fields"] = settings.REFERENCE_FIELDS
+        data["snippet_length"] = settings.REFERENCE_SNIPPET_LENGTH
+    return data
+
+
+def fetch_documents(prompt):
+    headers = {
+        "Authorization": f"Bearer {st.session_state.token}",
+        "Content-Type": "application/json"
+    }
+
     response = requests.post(
         f"{settings.API_URL}/documents/search",
         headers=headers,
-        json=data
+        json=search_request_data(prompt)
     )
 
     docs = []
@@ -262,6 +351,67 @@ def fetch_documents(prompt):
     return docs
 
 
+def stream_documents(prompt):
+    """Yield search results as the server finds them"""
+    headers = {
+        "Authorization": f"Bearer {st.session_state.token}",
+        "Content-Type": "application/json"
+    }
+
+    with requests.post(
+        f"{settings.API_URL}/documents/search/stream",
+        headers=headers,
+        json=search_request_data(prompt),
+        stream=True
+    ) as response:
+        if response.status_code != 200:
+            return
+        for line in response.iter_lines():
+            if not line:
+                continue
+            doc = json.loads(line)
+            if "error" in doc:
+                st.error(doc["error"])
+                return
+            yield doc
+
+
+async def stream_chat_events(prompt, model, history, context_aware):
+    """Yield (event, data) of the server-sent events of /chat/stream"""
+    headers = {
+        "Authorization": f"Bearer {st.session_state.token}",
+        "Content-Type": "application/json"
+    }
+
+    data = search_request_data(prompt)
+    data.update({
+        "model": model,
+        "history": history,
+        "context_aware": context_aware
+    })
+
+    async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None)) as session:
+        async with session.post(
+            f"{settings.API_URL}/chat/stream",
+            headers=headers,
+            json=data
+        ) as response:
+            if response.status != 200:
+                yield "error", {"error": f"Chat failed: {response.status}"}
+                return
+
+            event = "message"
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    yield event, json.loads(line[len("data:"):])
+                elif not line:
+                    event = "message"
+
+
 def fetch_notes(skip=0, limit=100):
     headers = {
         "Authorization": f"Bearer {st.session_state.token}",
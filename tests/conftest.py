@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Settings create their directories under the home directory on import
+os.environ["HOME"] = tempfile.mkdtemp(prefix="inquisitive-tests-")
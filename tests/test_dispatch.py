@@ -0,0 +1,64 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from backend.api.models import QueuedJob, SourceType
+from backend.config import settings
+from backend.database import async_session_maker, create_db_and_tables
+from backend.worker import process_uploaded_file, url_processor
+from backend.worker.dispatch import dispatch_job, process_queued_jobs
+
+
+async def queued_job_count():
+    async with async_session_maker() as db:
+        result = await db.execute(select(func.count()).select_from(QueuedJob))
+        return result.scalar()
+
+
+def test_database_dispatch_runs_jobs(monkeypatch):
+    """Jobs claimed from the database never went through a memory queue"""
+    monkeypatch.setattr(settings, "JOB_DISPATCH_MODE", "database")
+    monkeypatch.setattr(settings, "JOB_CLAIM_INTERVAL", 0.05)
+    errors = []
+
+    def recording(handler):
+        async def run(*payload):
+            try:
+                await handler(*payload)
+            except Exception as err:
+                errors.append(err)
+                raise
+        return run
+
+    async def run():
+        await create_db_and_tables()
+        # Rows of the jobs don't exist, the handlers return right away
+        await dispatch_job(
+            url_processor.url_processing_queue,
+            SourceType.LINK,
+            (404, "http://example.invalid/", "user@example.com", {}, 1)
+        )
+        await dispatch_job(
+            process_uploaded_file.file_processor_queue,
+            SourceType.FILE,
+            ("/nonexistent", "missing.txt", "/file/missing.txt", 404,
+             "user@example.com", SourceType.FILE.value, 1)
+        )
+        assert await queued_job_count() == 2
+
+        worker = asyncio.create_task(process_queued_jobs({
+            SourceType.LINK: (recording(url_processor.process_single_url), 1),
+            SourceType.FILE: (recording(process_uploaded_file.process_file), 1),
+        }))
+        try:
+            for _ in range(100):
+                if await queued_job_count() == 0:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            worker.cancel()
+
+        assert await queued_job_count() == 0
+
+    asyncio.run(run())
+    assert errors == []
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from backend.config import settings
+from backend.core.ollama_hosts import OllamaHostPool
+from backend.core.ollama_scheduler import OllamaScheduler
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Ollama endpoints used by the pool, behaving as server.mode says"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        line = json.dumps(data).encode() + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.mode == "error":
+            self.reply(500, {"error": "unavailable"})
+        else:
+            self.reply(200, {"version": "0.0.0"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(self.path)
+        if self.server.mode == "error":
+            self.reply(500, {"error": "unavailable"})
+        elif self.path == "/api/embed":
+            port = float(self.server.server_port)
+            self.reply(200, {
+                "model": body["model"],
+                "embeddings": [[port] for _ in body["input"]]
+            })
+        elif self.path == "/api/chat":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            message = {
+                "model": body["model"],
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": "first"},
+                "done": False
+            }
+            self.write_chunk(message)
+            if self.server.mode == "drop":
+                # Gone in the middle of the answer
+                self.connection.shutdown(socket.SHUT_RDWR)
+                self.close_connection = True
+                return
+            self.write_chunk({
+                **message,
+                "message": {"role": "assistant", "content": ""},
+                "done": True
+            })
+            self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def stand_in():
+    """Start a local stand-in Ollama server, returns it"""
+    servers = []
+
+    def start(mode="ok"):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        server.mode = mode
+        server.requests = []
+        server.url = f"http://127.0.0.1:{server.server_port}"
+        threading.Thread(
+            target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def unused_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def embed(client):
+    return client.embed("model", ["text"])["embeddings"]
+
+
+async def chat(pool, contents):
+    async for chunk in pool.stream(lambda client: client.chat(
+            model="model",
+            messages=[{"role": "user", "content": "hi"}],
+            stream=True)):
+        contents.append(chunk.message.content)
+
+
+async def check_health(pool, host):
+    async with httpx.AsyncClient() as client:
+        await pool.check_health(client, host)
+
+
+def test_least_outstanding_host_is_picked(stand_in):
+    pool = OllamaHostPool([stand_in().url for _ in range(3)])
+
+    first = pool.acquire()
+    second = pool.acquire()
+    third = pool.acquire()
+    assert len({first, second, third}) == 3
+
+    pool.release(second)
+    assert pool.acquire() is second
+    # Equally busy hosts are picked least recently first
+    for host in (first, second, third):
+        pool.release(host)
+    assert pool.acquire() is first
+
+
+def test_host_is_ejected_after_max_failures(stand_in, monkeypatch):
+    monkeypatch.setattr(settings, "OLLAMA_HOST_MAX_FAILURES", 2)
+    pool = OllamaHostPool([unused_url(), stand_in().url])
+    dead, healthy = pool.hosts
+
+    # Equally busy, the dead host is tried first every time
+    pool.run(embed)
+    assert dead.failures == 1
+    assert dead.ejected_until <= time.monotonic()
+
+    pool.run(embed)
+    assert dead.ejected_until > time.monotonic()
+    assert pool.available_count() == 1
+    assert all(pool.acquire() is healthy for _ in range(3))
+
+
+def test_embed_is_retried_on_next_host(stand_in):
+    failing, healthy = stand_in("error"), stand_in()
+    pool = OllamaHostPool([failing.url, healthy.url])
+
+    assert pool.run(embed) == [[float(healthy.server_port)]]
+    assert failing.requests == ["/api/embed"]
+    assert pool.hosts[0].failures == 1
+    assert all(host.outstanding == 0 for host in pool.hosts)
+
+
+def test_embed_error_of_request_is_not_retried(stand_in):
+    servers = [stand_in(), stand_in()]
+    pool = OllamaHostPool([server.url for server in servers])
+
+    with pytest.raises(ValueError):
+        pool.run(lambda client: (embed(client), int("not a number")))
+    assert sum(len(server.requests) for server in servers) == 1
+    assert all(host.failures == 0 for host in pool.hosts)
+
+
+def test_stream_is_retried_before_first_chunk(stand_in):
+    failing, healthy = stand_in("error"), stand_in()
+    pool = OllamaHostPool([failing.url, healthy.url])
+
+    contents = []
+    asyncio.run(chat(pool, contents))
+    assert contents == ["first", ""]
+    assert failing.requests == ["/api/chat"]
+    assert healthy.requests == ["/api/chat"]
+
+
+def test_stream_is_not_retried_after_first_chunk(stand_in):
+    dropping, healthy = stand_in("drop"), stand_in()
+    pool = OllamaHostPool([dropping.url, healthy.url])
+
+    contents = []
+    with pytest.raises(httpx.TransportError):
+        asyncio.run(chat(pool, contents))
+    assert contents == ["first"]
+    assert healthy.requests == []
+    assert pool.hosts[0].failures == 1
+    assert all(host.outstanding == 0 for host in pool.hosts)
+
+
+def test_passing_health_check_keeps_request_ejection(stand_in, monkeypatch):
+    monkeypatch.setattr(settings, "OLLAMA_HOST_MAX_FAILURES", 1)
+    server = stand_in()
+    pool = OllamaHostPool([server.url])
+    host = pool.acquire()
+    pool.release(host, ConnectionError("refused"))
+
+    asyncio.run(check_health(pool, host))
+    assert host.ejected_until > time.monotonic()
+
+
+def test_passing_health_check_ends_check_ejection(stand_in):
+    server = stand_in("error")
+    pool = OllamaHostPool([server.url])
+    host = pool.hosts[0]
+
+    asyncio.run(check_health(pool, host))
+    assert host.ejected_until > time.monotonic()
+
+    server.mode = "ok"
+    asyncio.run(check_health(pool, host))
+    assert host.ejected_until <= time.monotonic()
+
+
+def test_scheduler_limits_count_usable_hosts():
+    hosts = 2
+    scheduler = OllamaScheduler(2, {}, 2, lambda: hosts)
+    granted = []
+    for _ in range(5):
+        scheduler.enqueue("model", 0, lambda: granted.append(True))
+    assert len(granted) == 4
+
+    # One host ejected, freed slots are not handed out again
+    hosts = 1
+    scheduler.release("model")
+    scheduler.release("model")
+    assert len(granted) == 4
+    scheduler.release("model")
+    assert len(granted) == 5